@@ -0,0 +1,155 @@
+"""
+Semantic answer cache: reuse a previous answer when a new question is a near-duplicate.
+    Keyed by the query embedding the retriever already computes (cosine similarity >= threshold)
+    An entry only matches when it was produced against the same index version and settings (model, k)
+    LRU + TTL eviction with a size cap, hit/miss/eviction counters
+    Optional on-disk persistence (JSON entries + .npy embeddings) so the cache survives restarts
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_DIR="data/cache/answers"
+DEFAULT_SIMILARITY_THRESHOLD=0.92
+DEFAULT_MAX_ENTRIES=5000
+DEFAULT_TTL_SECONDS=24*3600
+
+
+#persist dir for the answers of one LLM router (keyed by router.name, e.g. "gpt-4o-mini+llama3:8b"),
+#so every app serving the same backends shares one cache
+def cache_dir_for(router_name,root=ANSWER_CACHE_DIR):
+    return os.path.join(root,re.sub(r"[^\w.+-]","_",router_name))
+
+
+def _normalize(vector):
+    vector=np.asarray(vector,dtype=np.float32).reshape(-1)
+    norm=np.linalg.norm(vector)
+    return vector/norm if norm>0 else vector
+
+
+class SemanticCache:
+    """
+    Thread-safe in-memory cache of answers keyed by normalized query embeddings.
+    Embeddings live in a preallocated (max_entries, dim) matrix, so a lookup is one matrix-vector product.
+    """
+
+    def __init__(self,threshold=DEFAULT_SIMILARITY_THRESHOLD,max_entries=DEFAULT_MAX_ENTRIES,
+                 ttl_seconds=DEFAULT_TTL_SECONDS,persist_dir=None):
+        self.threshold=threshold
+        self.max_entries=max_entries
+        self.ttl_seconds=ttl_seconds
+        self.persist_dir=persist_dir
+
+        self._matrix=None                       # (max_entries, dim), allocated on first store
+        self._valid=np.zeros(max_entries,dtype=bool)
+        self._entries=OrderedDict()             # slot -> {"namespace","index_version","chunk_ids","result","created"}, LRU order
+        self._free=list(range(max_entries-1,-1,-1))
+        self._lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+        if persist_dir and os.path.exists(os.path.join(persist_dir,"entries.json")):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self,entry,now):
+        return self.ttl_seconds is not None and now-entry["created"]>self.ttl_seconds
+
+    def _release(self,slot):
+        del self._entries[slot]
+        self._valid[slot]=False
+        self._free.append(slot)
+
+    def lookup(self,query_vector,namespace,index_version):
+        """
+        Return the cached result of the most similar live question, or None.
+        namespace separates answers produced with different settings (e.g. "mistral:k=5").
+        """
+        query=_normalize(query_vector)
+        now=time.time()
+        with self._lock:
+            found=None
+            if self._matrix is not None and self._entries:
+                sims=self._matrix@query
+                sims[~self._valid]=-np.inf
+                candidates=np.flatnonzero(sims>=self.threshold)
+                for slot in candidates[np.argsort(-sims[candidates])]:
+                    slot=int(slot)
+                    entry=self._entries[slot]
+                    if self._expired(entry,now):
+                        self._release(slot)
+                        self.evictions+=1
+                        continue
+                    if entry["namespace"]==namespace and entry["index_version"]==index_version:
+                        found=(slot,float(sims[slot]))
+                        break
+
+            if found is None:
+                self.misses+=1
+                return None
+            slot,similarity=found
+            self._entries.move_to_end(slot)
+            self.hits+=1
+            result=dict(self._entries[slot]["result"])
+        result["cache_similarity"]=similarity
+        return result
+
+    def _store_locked(self,embedding,entry):
+        if self._matrix is None:
+            self._matrix=np.zeros((self.max_entries,embedding.shape[0]),dtype=np.float32)
+        if not self._free:
+            oldest=next(iter(self._entries))
+            self._release(oldest)
+            self.evictions+=1
+        slot=self._free.pop()
+        self._matrix[slot]=embedding
+        self._valid[slot]=True
+        self._entries[slot]=entry
+
+    def store(self,query_vector,namespace,index_version,result,chunk_ids=()):
+        entry={
+            "namespace":namespace,
+            "index_version":index_version,
+            "chunk_ids":list(chunk_ids),
+            "result":result,
+            "created":time.time(),
+        }
+        with self._lock:
+            self._store_locked(_normalize(query_vector),entry)
+
+    def stats(self):
+        total=self.hits+self.misses
+        return {"entries":len(self._entries),"hits":self.hits,"misses":self.misses,
+                "evictions":self.evictions,"hit_rate":self.hits/total if total else 0.0}
+
+    def save(self,persist_dir=None):
+        persist_dir=persist_dir or self.persist_dir
+        os.makedirs(persist_dir,exist_ok=True)
+        with self._lock:
+            slots=list(self._entries)
+            meta=[self._entries[slot] for slot in slots]
+            embeddings=self._matrix[slots] if slots else np.zeros((0,0),dtype=np.float32)
+        np.save(os.path.join(persist_dir,"embeddings.npy"),embeddings)
+        with open(os.path.join(persist_dir,"entries.json"),"w") as f:
+            json.dump(meta,f)
+
+    def load(self,persist_dir=None):
+        persist_dir=persist_dir or self.persist_dir
+        with open(os.path.join(persist_dir,"entries.json"),"r") as f:
+            meta=json.load(f)
+        embeddings=np.load(os.path.join(persist_dir,"embeddings.npy"))
+        now=time.time()
+        with self._lock:
+            # entries were saved in LRU order, so the most recently used survive the size cap
+            for entry,embedding in zip(meta,embeddings):
+                if not self._expired(entry,now):
+                    self._store_locked(embedding.astype(np.float32),entry)
@@ -4,31 +4,281 @@ FastAPI  entry point for the Amazon Reviews RAG system (gpt 4mini-based).
 This API exposes endpoints to:
     Accept user questions related to Amazon product reviews
     Generate answers using RAG pipeline
-    Perform health checks to verify the service is running
+    Report per-backend LLM latency/health (/backends)
+    Expose request latency histograms and counters in the Prometheus text format (/metrics)
+    Time every stage of a request (tracing.py): per-stage totals in the Server-Timing header,
+    the span tree in a "debug" field on request ("debug": true), slow requests in a rotating trace log
+    Perform health checks to verify the service is running and warmed up
 
-The RAG logic is inside `rag_engine.generate_answer`.
+The RAG logic is inside `generation.GenerationService`; `create_app` builds the app for a list of
+LLM backends (api_ollama.py is the same app with the Ollama backend only); the semantic cache persists
+under a directory named after the router's models, so apps with the same backends share it.
+Importing this module is cheap (torch/sentence_transformers, tiktoken and mlflow load lazily). At startup
+the lifespan hook only creates the backends and executor; a warm-up task then loads the FAISS index
+(vector codes mapped from the file, see retriever.py), metadata and embedding model into a shared
+`Retriever` that every request reuses and runs one dummy query through it. Until that finished /health and the /ask endpoints answer 503, and
+/health reports the time of every startup step and of the first request served.
+Endpoints are async: embedding/search run on a dedicated executor and completions are awaited
+on shared clients, so waiting requests do not hold threadpool workers. Each completion goes to the
+fastest healthy backend and fails over to the next one (see llm_router.py).
 """
 
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from pydantic import BaseModel
 
-from src.retriever import retrieve
-from src.rag_engine import generate_answer
+from src.answer_cache import SemanticCache, cache_dir_for
+from src.filters import normalize_filters
+from src.generation import GenerationService
+from src.llm_backends import create_backends
+from src.llm_router import LLMRouter
+from src.metrics import REGISTRY
+from src.reranker import Reranker
+from src.retriever import Retriever, set_default_retriever
+from src.streaming import sse_response
+from src.tracing import Trace, log_if_slow, span, start_trace, traced_events
 
+#threads for CPU-bound embedding + FAISS search
+RETRIEVAL_WORKERS=4
+#semantic answer cache (near-duplicate questions skip the LLM); persisted across restarts
+SEMANTIC_CACHE_ENABLED=True
+#cross-encoder rerank of the retrieved candidates (loads a second model at startup)
+RERANK_ENABLED=False
+#LLM backends in routing preference order (used until live latencies are known);
+#("openai","ollama") fails over to the local model when OpenAI is down or slow
+LLM_BACKENDS=("openai",)
+#second request when a completion runs past its backend's p95 (costs extra calls on slow requests)
+HEDGE_ENABLED=False
+#serve /health (503 "starting") while the models load; False holds startup until warm-up finished
+WARMUP_IN_BACKGROUND=True
+RETRY_AFTER_SECONDS=5
 
+logger=logging.getLogger(__name__)
 
-app=FastAPI(title="Amazon reviews rag API")
 
+#ms since this process started (None where /proc is unavailable)
+def process_uptime_ms():
+    try:
+        with open("/proc/self/stat","r") as f:
+            start_ticks=int(f.read().rsplit(")",1)[1].split()[19])
+        with open("/proc/uptime","r") as f:
+            uptime=float(f.read().split()[0])
+    except (OSError,ValueError,IndexError):
+        return None
+    #(clock ticks: 10 ms resolution)
+    return round((uptime-start_ticks/os.sysconf("SC_CLK_TCK"))*1000,1)
+
+#load index, metadata, encoder (and reranker) once per process, then run a dummy query through them;
+#the blocking parts run on the retrieval executor so the event loop keeps answering /health
+async def warm_up(app,generation):
+    startup=app.state.startup
+    loop=asyncio.get_running_loop()
+    start=time.perf_counter()
+
+    def load():
+        retriever=Retriever()
+        timings=dict(retriever.load_timings)
+        reranker=None
+        if RERANK_ENABLED:
+            t=time.perf_counter()
+            reranker=Reranker()
+            timings["reranker_load_ms"]=(time.perf_counter()-t)*1000
+        return retriever,reranker,timings
+
+    try:
+        retriever,reranker,timings=await loop.run_in_executor(app.state.executor,load)
+        set_default_retriever(retriever)
+        generation.retriever=retriever
+        generation.reranker=reranker
+        timings.update(await loop.run_in_executor(app.state.executor,generation.warm_up))
+    except Exception as e:
+        startup.update(status="failed",error=f"{type(e).__name__}: {e}")
+        logger.exception("warm-up failed: %s",startup["error"])
+        return
+    app.state.retriever=retriever
+    app.state.reranker=reranker
+    timings["warmup_ms"]=(time.perf_counter()-start)*1000
+    for name,value in timings.items():
+        REGISTRY.set_gauge("startup_ms",{"step":name},value)
+    startup.update({name:round(value,3) for name,value in timings.items()})
+    startup["ready_after_ms"]=process_uptime_ms()
+    startup["status"]="ready"
+    logger.info("ready: warm-up %.0f ms, %.0f ms after process start",timings["warmup_ms"],startup["ready_after_ms"] or 0)
+
+#backends/executor at startup, models in a background warm-up (awaited before serving unless WARMUP_IN_BACKGROUND);
+#cache_dir defaults to the router's own directory (cache_dir_for(router.name))
+def make_lifespan(backend_names,cache_dir=None):
+    @asynccontextmanager
+    async def lifespan(app:FastAPI):
+        app.state.startup={"status":"starting","lifespan_start_ms":process_uptime_ms()}
+        app.state.first_request=None
+        app.state.retriever=None
+        app.state.reranker=None
+        executor=ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS,thread_name_prefix="retrieval")
+        router=LLMRouter(create_backends(backend_names),hedge=HEDGE_ENABLED)
+        cache=SemanticCache(persist_dir=cache_dir or cache_dir_for(router.name)) if SEMANTIC_CACHE_ENABLED else None
+        app.state.executor=executor
+        app.state.answer_cache=cache
+        app.state.generation=GenerationService(router,None,executor,cache,None)
+        REGISTRY.start()
+        warmup=asyncio.create_task(warm_up(app,app.state.generation))
+        if not WARMUP_IN_BACKGROUND:
+            await warmup
+            if app.state.startup["status"]=="failed":
+                raise RuntimeError(f"warm-up failed: {app.state.startup['error']}")
+        yield
+        # a model load cannot be interrupted; let it finish before tearing down
+        await warmup
+        await app.state.generation.aclose()
+        executor.shutdown(wait=False)
+        # last MLflow flush of the request metrics
+        REGISTRY.stop()
+        if cache is not None:
+            cache.save()
+    return lifespan
+
+#the shared GenerationService, or 503 (with Retry-After) while the models are still loading
+def ready_generation(request:Request):
+    startup=request.app.state.startup
+    if startup["status"]!="ready":
+        raise HTTPException(status_code=503,detail=f"service {startup['status']}",
+                            headers={"Retry-After":str(RETRY_AFTER_SECONDS)})
+    return request.app.state.generation
+
+#latency of the first request answered after warm-up (what is left of the cold start for a user)
+def note_first_request(app,trace):
+    if app.state.first_request is None:
+        app.state.first_request={"endpoint":trace.name,"total_ms":round(trace.total_ms,3)}
+        REGISTRY.set_gauge("first_request_ms",{"endpoint":trace.name},trace.total_ms)
+
+
+#optional metadata filters applied inside the vector search (see src/filters.py)
+class RetrievalFilters(BaseModel):
+    verified_only:bool=False
+    min_rating:Optional[float]=None
+    max_rating:Optional[float]=None
+    since:Optional[Union[int,str]]=None
+    until:Optional[Union[int,str]]=None
+    parent_asin:Optional[Union[str,List[str]]]=None
 
 class Question(BaseModel):
     question:str
+    filters:Optional[RetrievalFilters]=None
+    debug:bool=False
+
+class BatchQuestion(BaseModel):
+    questions:List[str]
+    filters:Optional[RetrievalFilters]=None
+    debug:bool=False
+
+#validated filter dict for the engine (bad dates -> 422 instead of a failed search)
+def request_filters(payload):
+    if payload.filters is None:
+        return None
+    try:
+        return normalize_filters(payload.filters.model_dump(exclude_none=True))
+    except ValueError as e:
+        raise HTTPException(status_code=422,detail=str(e))
+
+
+#JSON response carrying the request's Server-Timing header (and its span tree as "debug" when asked for);
+#called inside the request's trace so serialisation is timed too
+def traced_response(app,trace,result,debug=False,**info):
+    if debug:
+        result={**result,"debug":trace.to_dict()}
+    with span("serialize"):
+        body=json.dumps(result,ensure_ascii=False).encode("utf-8")
+    trace.finish()
+    log_if_slow(trace,**info)
+    note_first_request(app,trace)
+    return Response(body,media_type="application/json",headers={"Server-Timing":trace.server_timing()})
+
+#stream events inside the request's trace; the "done" event carries the span tree when asked for
+async def traced_stream(app,trace,events,debug=False):
+    info={}
+    async for event,data in traced_events(trace,events):
+        if event=="done":
+            trace.finish()
+            note_first_request(app,trace)
+            info["llm_backend"]=data.get("llm_backend")
+            if debug:
+                data={**data,"debug":trace.to_dict()}
+        elif event=="error":
+            info["error"]=data.get("error")
+        yield event,data
+    log_if_slow(trace,**info)
+
+
+def create_app(backend_names=LLM_BACKENDS,title="Amazon reviews rag API",cache_dir=None)->FastAPI:
+    app=FastAPI(title=title,lifespan=make_lifespan(backend_names,cache_dir))
+
+    @app.post("/ask")
+    async def ask_question(payload:Question,request:Request,generation=Depends(ready_generation)):
+        with start_trace("/ask",question=payload.question) as trace:
+            try:
+                result=await generation.answer(payload.question, k=5, filters=request_filters(payload))
+            except Exception as e:
+                trace.finish()
+                log_if_slow(trace,error=f"{type(e).__name__}: {e}")
+                raise
+            return traced_response(request.app,trace,result,payload.debug,prompt_chars=len(result.get("prompt") or ""),
+                                   llm_backend=result.get("llm_backend"),cached=bool(result.get("cached")))
+
+    #many questions in one request: batched retrieval, bounded concurrent LLM calls,
+    #results in request order, failed items carry an "error" field
+    @app.post("/ask/batch")
+    async def ask_batch(payload:BatchQuestion,request:Request,generation=Depends(ready_generation)):
+        with start_trace("/ask/batch",batch_size=len(payload.questions)) as trace:
+            results=await generation.answer_many(payload.questions, k=5, filters=request_filters(payload))
+            return traced_response(request.app,trace,{"results":results},payload.debug,
+                                   prompt_chars=sum(len(r.get("prompt") or "") for r in results))
+
+    #Server-Sent Events: "sources" first, then "token" events as the LLM produces them, then "done" with timings
+    #(headers go out before any stage ran, so there is no Server-Timing header; use "debug" instead)
+    @app.post("/ask/stream")
+    async def ask_stream(payload:Question,request:Request,generation=Depends(ready_generation)):
+        trace=Trace("/ask/stream",question=payload.question)
+        events=generation.stream(payload.question, k=5, filters=request_filters(payload))
+        return sse_response(traced_stream(request.app,trace,events,payload.debug))
+
+    @app.get("/cache/stats")
+    def cache_stats(request:Request):
+        cache=request.app.state.answer_cache
+        return cache.stats() if cache is not None else {"enabled":False}
+
+    #rolling latency percentiles, error rate, health and in-flight requests of every LLM backend
+    @app.get("/backends")
+    def backend_stats(request:Request):
+        return request.app.state.generation.stats()
+
+    #request histograms/counters since startup, plus the backends' live state as gauges
+    @app.get("/metrics")
+    def metrics(request:Request):
+        for backend in request.app.state.generation.stats()["backends"]:
+            labels={"backend":backend["backend"]}
+            REGISTRY.set_gauge("backend_in_flight",labels,backend["in_flight"])
+            REGISTRY.set_gauge("backend_healthy",labels,int(backend["healthy"]))
+        return PlainTextResponse(REGISTRY.render_prometheus(),media_type="text/plain; version=0.0.4")
+
+    #readiness: 200 once warm-up finished, 503 while starting (or when it failed); with the startup timings
+    @app.get("/health")
+    def health(request:Request):
+        startup=request.app.state.startup
+        ready=startup["status"]=="ready"
+        return JSONResponse(status_code=200 if ready else 503,
+                            content={"status":"ok" if ready else startup["status"],"startup":startup,
+                                     "first_request":request.app.state.first_request})
 
+    return app
 
-@app.post("/ask")
-def ask_question(payload:Question):
-    return generate_answer(payload.question, k=5)
 
-@app.get("/health")
-def health():
-    return{"status":"ok"}     
+app=create_app()
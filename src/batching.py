@@ -0,0 +1,26 @@
+"""
+Small helper for running independent per-item work (e.g. LLM calls) with bounded concurrency.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_CONCURRENCY=4
+
+
+def map_bounded(fn,items,max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Apply fn to every item using at most max_concurrency threads.
+    Returns one (ok, value) pair per item in input order; value is the raised
+    exception when ok is False, so one failing item never fails the others.
+    """
+    def safe(item):
+        try:
+            return True,fn(item)
+        except Exception as e:
+            return False,e
+
+    items=list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1,min(max_concurrency,len(items)))) as pool:
+        return list(pool.map(safe,items))
@@ -0,0 +1,371 @@
+"""
+Offline, reproducible latency benchmark of the retrieval and generation stages.
+    A synthetic corpus of --rows chunks (Zipf-distributed words of a made-up vocabulary) is written as a
+    metadata store + FAISS index (+ BM25 index with --hybrid) into a work dir
+    StubEncoder stands in for the sentence transformer: a text's vector is the normalised sum of
+    per-word vectors seeded from the word's md5, so nothing is downloaded and every run sees the same vectors
+    Token counts/offsets of the synthetic rows are precomputed with a word-level stub tokenizer, so
+    build_context packs from stored counts exactly as it does for real metadata (no tiktoken files needed)
+    Stages, each timed call by call after a warm-up:
+        embed_query      Retriever.embed_query (stub encoder + wrapper)
+        search_faiss     one query vector against the index
+        get_results      metadata rows of the top-k ids
+        build_context    budgeted context for --llm-model
+        retrieve         Retriever.retrieve (embed + search (+ BM25 fusion) + rows)
+        generate_answer  GenerationService.answer over a FakeBackend answering after --llm-latency-ms,
+                         with --concurrency requests in flight
+    For every stage: p50/p95/p99/mean/max latency in ms and throughput (calls/s)
+
+Results are written as JSON (--output). With --baseline (an earlier results file) every stage's --metric
+is compared with the baseline and the command exits with status 1 when one got slower by more than
+--tolerance (and by more than --min-delta-ms, so sub-millisecond noise does not fail a run).
+
+    python -m src.benchmark --rows 50000 --output bench.json
+    python -m src.benchmark --rows 50000 --baseline bench.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import gc
+import hashlib
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+from src.bm25_builder import build_lexical_index
+from src.context_builder import PRECOMPUTED_TOKENIZERS, TOKEN_OFFSET_STRIDE, build_context, context_piece
+from src.faiss_builder import INDEX_TYPES, build_faiss_index, default_search_params, save_faiss_index
+from src.generation import GenerationService
+from src.index_params import index_version, save_search_params
+from src.llm_backends import MODEL_NAME, FakeBackend
+from src.llm_router import LLMRouter
+from src.metadata_store import write_metadata_store
+from src.retriever import Retriever, get_results, search_faiss
+
+DEFAULT_ROWS=20000
+DEFAULT_DIM=768
+DEFAULT_VOCAB=5000
+DEFAULT_QUERIES=200
+DEFAULT_ITERATIONS=500
+DEFAULT_GENERATE_ITERATIONS=200
+DEFAULT_WARMUP=20
+DEFAULT_K=5
+DEFAULT_TOLERANCE=0.2
+DEFAULT_MIN_DELTA_MS=0.05
+METRICS=("p50_ms","p95_ms","p99_ms","mean_ms")
+STAGES=("embed_query","search_faiss","get_results","build_context","retrieve","generate_answer")
+SEED=42
+#synthetic chunks are MIN_CHUNK_WORDS..CHUNK_WORD_LIMIT words, like the chunker's
+MIN_CHUNK_WORDS=40
+CHUNK_WORD_LIMIT=250
+ROWS_PER_PRODUCT=20
+
+WORD_RE=re.compile(r"\w+")
+STUB_TOKEN_RE=re.compile(r"\w+|[^\w\s]")
+
+
+def word_vector(word,dim):
+    seed=int(hashlib.md5(word.encode("utf-8")).hexdigest()[:16],16)
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+class StubEncoder:
+    """
+    Deterministic stand-in for SentenceTransformer: normalised sum of md5-seeded word vectors.
+    Texts sharing words get nearby vectors, so queries built from a chunk's words find that chunk.
+    """
+
+    def __init__(self,dim=DEFAULT_DIM):
+        self.dim=dim
+        self._vectors={}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _word(self,word):
+        vector=self._vectors.get(word)
+        if vector is None:
+            vector=self._vectors[word]=word_vector(word,self.dim)
+        return vector
+
+    def _encode_one(self,text):
+        words=WORD_RE.findall(text.lower())
+        vector=np.sum([self._word(w) for w in words],axis=0) if words else np.zeros(self.dim,dtype=np.float32)
+        return vector/max(float(np.linalg.norm(vector)),1e-12)
+
+    def encode(self,texts,convert_to_numpy=True,**kwargs):
+        if isinstance(texts,str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(t) for t in texts]) if texts else np.zeros((0,self.dim),dtype=np.float32)
+
+
+#token counts/offsets in context_builder's stored format, from words and punctuation instead of a real tokenizer
+def stub_token_info(row,tokenizers=PRECOMPUTED_TOKENIZERS):
+    starts=[m.start() for m in STUB_TOKEN_RE.finditer(context_piece(row))]
+    offsets=starts[TOKEN_OFFSET_STRIDE::TOKEN_OFFSET_STRIDE]
+    return {"token_counts":{name:len(starts) for name in tokenizers},
+            "token_offsets":{name:list(offsets) for name in tokenizers}}
+
+
+def make_vocabulary(size,rng):
+    letters=np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words=set()
+    while len(words)<size:
+        words.add("".join(rng.choice(letters,size=int(rng.integers(3,10)))))
+    return sorted(words)
+
+def synthetic_corpus(rows,vocab_size=DEFAULT_VOCAB,seed=SEED):
+    """
+    (metadata rows, word ids per row, vocabulary): review chunks of Zipf-distributed words,
+    ROWS_PER_PRODUCT chunks per product.
+    """
+    rng=np.random.default_rng(seed)
+    vocab=make_vocabulary(vocab_size,rng)
+    metadata=[]
+    word_ids=[]
+    for i in range(rows):
+        n_words=int(rng.integers(MIN_CHUNK_WORDS,CHUNK_WORD_LIMIT+1))
+        ids=np.minimum(rng.zipf(1.3,size=n_words)-1,vocab_size-1)
+        text=" ".join(vocab[j] for j in ids)
+        product=i//ROWS_PER_PRODUCT
+        row={"chunk_id":f"syn-{i:08d}","asin":f"B{product:09d}","parent_asin":f"P{product:09d}",
+             "product_name":f"{vocab[product%vocab_size].title()} {vocab[(product*7)%vocab_size]} {product}",
+             "review_title":" ".join(vocab[j] for j in ids[:5]),"rating":float(rng.integers(1,6)),
+             "timestamp":int(1_400_000_000_000+rng.integers(0,300_000_000_000)),"helpful_vote":int(rng.integers(0,50)),
+             "verified_purchase":bool(rng.random()<0.8),"start_word":0,"end_word":n_words,"chunk_text":text}
+        row.update(stub_token_info(row))
+        metadata.append(row)
+        word_ids.append(ids)
+    return metadata,word_ids,vocab
+
+#corpus embeddings without re-parsing the texts: per-row sums of the vocabulary's word vectors
+def corpus_embeddings(word_ids,vocab,encoder):
+    word_vectors=np.stack([encoder._word(w) for w in vocab])
+    lengths=np.array([len(ids) for ids in word_ids])
+    sums=np.add.reduceat(word_vectors[np.concatenate(word_ids)],np.concatenate([[0],np.cumsum(lengths)[:-1]]),axis=0)
+    return (sums/np.maximum(np.linalg.norm(sums,axis=1,keepdims=True),1e-12)).astype(np.float32)
+
+#questions of 4..10 words drawn from random chunks
+def make_queries(metadata,n,seed=SEED):
+    rng=np.random.default_rng(seed+1)
+    queries=[]
+    for row in rng.choice(len(metadata),size=n):
+        words=metadata[int(row)]["chunk_text"].split()
+        start=int(rng.integers(0,max(1,len(words)-10)))
+        queries.append(" ".join(words[start:start+int(rng.integers(4,11))]))
+    return queries
+
+
+def corpus_config(args):
+    return {"rows":args.rows,"dim":args.dim,"vocab":args.vocab,"seed":args.seed,"index_type":args.index_type,
+            "hybrid":args.hybrid}
+
+def corpus_paths(workdir):
+    return {"index_path":os.path.join(workdir,"faiss","bench.index"),
+            "metadata_store_path":os.path.join(workdir,"metadata_store"),
+            "lexical_path":os.path.join(workdir,"lexical"),
+            "metadata_path":os.path.join(workdir,"metadata.jsonl"),
+            "partition_path":os.path.join(workdir,"partitions")}
+
+def build_corpus(workdir,config):
+    """
+    Write the synthetic corpus to workdir unless an identical one (same config) is already there.
+    Returns (queries, build timings).
+    """
+    paths=corpus_paths(workdir)
+    config_path=os.path.join(workdir,"corpus.json")
+    if os.path.exists(config_path):
+        with open(config_path,"r") as f:
+            saved=json.load(f)
+        if saved["config"]==config:
+            return saved["queries"],{"reused":True}
+
+    timings={"reused":False}
+    t=time.perf_counter()
+    metadata,word_ids,vocab=synthetic_corpus(config["rows"],config["vocab"],config["seed"])
+    embeddings=corpus_embeddings(word_ids,vocab,StubEncoder(config["dim"]))
+    timings["corpus_seconds"]=time.perf_counter()-t
+
+    t=time.perf_counter()
+    write_metadata_store(metadata,paths["metadata_store_path"])
+    index=build_faiss_index(embeddings,config["index_type"])
+    save_faiss_index(index,paths["index_path"])
+    save_search_params(paths["index_path"],default_search_params(config["index_type"]))
+    if config["hybrid"]:
+        build_lexical_index(metadata,paths["lexical_path"],index_version=index_version(paths["index_path"]))
+    timings["index_seconds"]=time.perf_counter()-t
+
+    queries=make_queries(metadata,DEFAULT_QUERIES,config["seed"])
+    with open(config_path,"w") as f:
+        json.dump({"config":config,"queries":queries},f)
+    return queries,timings
+
+def open_retriever(workdir,dim,hybrid):
+    return Retriever(**corpus_paths(workdir),hybrid=hybrid,model=StubEncoder(dim))
+
+
+def summarize(latencies_ns,elapsed_seconds=None):
+    ms=np.asarray(latencies_ns,dtype=np.float64)/1e6
+    if elapsed_seconds is None:
+        elapsed_seconds=ms.sum()/1000
+    p50,p95,p99=np.percentile(ms,[50,95,99])
+    return {"iterations":len(ms),"p50_ms":float(p50),"p95_ms":float(p95),"p99_ms":float(p99),
+            "mean_ms":float(ms.mean()),"max_ms":float(ms.max()),
+            "throughput_per_s":len(ms)/elapsed_seconds if elapsed_seconds>0 else None}
+
+#call fn(i) warmup times untimed, then iterations times timed
+def time_calls(fn,iterations,warmup=DEFAULT_WARMUP):
+    for i in range(warmup):
+        fn(i)
+    gc.collect()
+    latencies=[]
+    for i in range(iterations):
+        t=time.perf_counter_ns()
+        fn(i)
+        latencies.append(time.perf_counter_ns()-t)
+    return summarize(latencies)
+
+async def time_generation(service,queries,iterations,concurrency,k,warmup=DEFAULT_WARMUP):
+    for i in range(warmup):
+        await service.answer(queries[i%len(queries)],k)
+    gc.collect()
+    semaphore=asyncio.Semaphore(concurrency)
+    latencies=[0]*iterations
+
+    async def one(i):
+        async with semaphore:
+            t=time.perf_counter_ns()
+            await service.answer(queries[i%len(queries)],k)
+            latencies[i]=time.perf_counter_ns()-t
+
+    start=time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(iterations)))
+    return summarize(latencies,time.perf_counter()-start)
+
+
+def run_stages(retriever,queries,args):
+    stages=[s for s in STAGES if s in args.stages]
+    k=args.k
+    n=len(queries)
+    # inputs of the isolated stages are prepared up front so each stage times only itself
+    vectors=[retriever.embed_query(q) for q in queries]
+    hits=[search_faiss(retriever.index,v,k)[1] for v in vectors]
+    retrieved=[get_results(ids,retriever.metadata) for ids in hits]
+
+    calls={"embed_query":lambda i:retriever.embed_query(queries[i%n]),
+           "search_faiss":lambda i:search_faiss(retriever.index,vectors[i%n],k),
+           "get_results":lambda i:get_results(hits[i%n],retriever.metadata),
+           "build_context":lambda i:build_context(retrieved[i%n],args.llm_model),
+           "retrieve":lambda i:retriever.retrieve(queries[i%n],k=k)}
+    results={}
+    for stage in stages:
+        if stage=="generate_answer":
+            continue
+        results[stage]=time_calls(calls[stage],args.iterations,args.warmup)
+        print(f"{stage:16s} p50 {results[stage]['p50_ms']:.3f} ms  p99 {results[stage]['p99_ms']:.3f} ms",file=sys.stderr)
+
+    if "generate_answer" in stages:
+        backend=FakeBackend(model=args.llm_model,latency_ms=args.llm_latency_ms,max_concurrency=args.concurrency,seed=args.seed)
+        with ThreadPoolExecutor(max_workers=max(4,args.concurrency)) as executor:
+            service=GenerationService(LLMRouter([backend]),retriever,executor,log_metrics=None)
+            results["generate_answer"]=asyncio.run(time_generation(service,queries,args.generate_iterations,
+                                                                   args.concurrency,k,args.warmup))
+        results["generate_answer"]["concurrency"]=args.concurrency
+        print(f"{'generate_answer':16s} p50 {results['generate_answer']['p50_ms']:.3f} ms  "
+              f"{results['generate_answer']['throughput_per_s']:.0f} req/s",file=sys.stderr)
+    return results
+
+
+def environment():
+    return {"python":platform.python_version(),"platform":platform.platform(),"machine":platform.machine(),
+            "cpu_count":os.cpu_count(),"numpy":np.__version__,"faiss":getattr(faiss,"__version__",None),
+            "faiss_omp_threads":faiss.omp_get_max_threads()}
+
+def compare(results,baseline,tolerance=DEFAULT_TOLERANCE,metric="p95_ms",min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    """
+    One row per stage present in both runs: (stage, baseline, current, ratio, regressed).
+    """
+    rows=[]
+    for stage,current in results["stages"].items():
+        base=baseline.get("stages",{}).get(stage)
+        if base is None or base.get(metric) is None:
+            continue
+        ratio=current[metric]/base[metric] if base[metric]>0 else float("inf")
+        regressed=current[metric]>base[metric]*(1+tolerance) and current[metric]-base[metric]>min_delta_ms
+        rows.append((stage,base[metric],current[metric],ratio,regressed))
+    return rows
+
+
+def parse_args():
+    parser=argparse.ArgumentParser(description="Offline latency benchmark of retrieval and generation stages")
+    parser.add_argument("--rows",type=int,default=DEFAULT_ROWS,help="synthetic chunks in the corpus")
+    parser.add_argument("--dim",type=int,default=DEFAULT_DIM)
+    parser.add_argument("--vocab",type=int,default=DEFAULT_VOCAB)
+    parser.add_argument("--index-type",choices=INDEX_TYPES,default="flat")
+    parser.add_argument("--hybrid",action="store_true",help="also build and query a BM25 index")
+    parser.add_argument("--seed",type=int,default=SEED)
+    parser.add_argument("--k",type=int,default=DEFAULT_K)
+    parser.add_argument("--iterations",type=int,default=DEFAULT_ITERATIONS)
+    parser.add_argument("--generate-iterations",type=int,default=DEFAULT_GENERATE_ITERATIONS)
+    parser.add_argument("--warmup",type=int,default=DEFAULT_WARMUP)
+    parser.add_argument("--stages",nargs="+",choices=STAGES,default=list(STAGES))
+    parser.add_argument("--llm-model",default=MODEL_NAME,help="model whose context budget/tokenizer is used")
+    parser.add_argument("--llm-latency-ms",type=float,default=0.0,help="fake LLM latency (0: pipeline overhead only)")
+    parser.add_argument("--concurrency",type=int,default=1,help="generate_answer requests in flight")
+    parser.add_argument("--workdir",default=None,help="keep the corpus here and reuse it (default: temp dir)")
+    parser.add_argument("--output",default=None,help="results JSON (default: stdout)")
+    parser.add_argument("--baseline",default=None,help="earlier results JSON to compare with")
+    parser.add_argument("--tolerance",type=float,default=DEFAULT_TOLERANCE,help="allowed slowdown (0.2 = 20%%)")
+    parser.add_argument("--metric",choices=METRICS,default="p95_ms")
+    parser.add_argument("--min-delta-ms",type=float,default=DEFAULT_MIN_DELTA_MS,
+                        help="slowdowns smaller than this never fail")
+    return parser.parse_args()
+
+def run(args,workdir):
+    config=corpus_config(args)
+    queries,build=build_corpus(workdir,config)
+    retriever=open_retriever(workdir,args.dim,args.hybrid)
+    stages=run_stages(retriever,queries,args)
+    return {"config":{**config,"k":args.k,"llm_model":args.llm_model,"llm_latency_ms":args.llm_latency_ms,
+                      "concurrency":args.concurrency},
+            "environment":environment(),"build":build,"stages":stages}
+
+def main():
+    args=parse_args()
+    if args.workdir is not None:
+        os.makedirs(args.workdir,exist_ok=True)
+        results=run(args,args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="rag-bench-") as workdir:
+            results=run(args,workdir)
+
+    if args.output is not None:
+        with open(args.output,"w") as f:
+            json.dump(results,f,indent=2)
+        print(f"Saved → {args.output}",file=sys.stderr)
+    else:
+        print(json.dumps(results,indent=2))
+
+    if args.baseline is not None:
+        with open(args.baseline,"r") as f:
+            baseline=json.load(f)
+        if baseline.get("config")!=results["config"]:
+            print("warning: baseline was run with a different config",file=sys.stderr)
+        rows=compare(results,baseline,args.tolerance,args.metric,args.min_delta_ms)
+        for stage,base,current,ratio,regressed in rows:
+            print(f"{stage:16s} {args.metric} {base:9.3f} → {current:9.3f} ms ({ratio:5.2f}x)"
+                  f"{'  REGRESSION' if regressed else ''}",file=sys.stderr)
+        if any(r[-1] for r in rows):
+            raise SystemExit(1)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Builds the BM25 lexical index used for hybrid (BM25 + FAISS) retrieval
+    Streams the chunk metadata in FAISS id order
+    Tokenizes product_name + chunk_text
+    Writes postings as flat numpy arrays (see lexical_index.py for the layout), tagged with the
+    version of the FAISS index they index (run after faiss_builder.py, again whenever it rebuilds)
+    Logs build metrics and artifacts using MLflow
+"""
+import json
+import os
+import time
+from array import array
+from collections import Counter
+
+import mlflow
+import numpy as np
+
+from src.index_params import index_version
+from src.lexical_index import BM25_B, BM25_K1, LEXICAL_INDEX_DIR, document_text, tokenize
+from src.metadata_store import iter_metadata_jsonl
+
+METADATA_FILE="data/embeddings/electronics_metadata.jsonl"
+FAISS_INDEX_FILE="data/faiss/electronics.index"
+
+
+def build_lexical_index(rows,path=LEXICAL_INDEX_DIR,k1=BM25_K1,b=BM25_B,index_version=None):
+    """
+    Build the postings arrays from metadata rows (row i = FAISS id i) and save them
+    (index_version: version of that FAISS index, see index_params.index_version).
+    Returns (num_docs, vocab_size, num_postings).
+    """
+    term_to_id={}
+    post_terms=array("i")
+    post_docs=array("i")
+    post_tf=array("H")
+    doc_len=array("i")
+
+    for doc_id,row in enumerate(rows):
+        counts=Counter(tokenize(document_text(row)))
+        doc_len.append(sum(counts.values()))
+        for term,tf in counts.items():
+            term_id=term_to_id.setdefault(term,len(term_to_id))
+            post_terms.append(term_id)
+            post_docs.append(doc_id)
+            post_tf.append(min(tf,65535))
+
+    # renumber terms in sorted order so the vocab can be searched with searchsorted
+    terms=sorted(term_to_id)
+    remap=np.empty(len(terms),dtype=np.int32)
+    for new_id,term in enumerate(terms):
+        remap[term_to_id[term]]=new_id
+
+    term_ids=remap[np.frombuffer(post_terms,dtype=np.int32)] if len(post_terms) else np.zeros(0,dtype=np.int32)
+    order=np.argsort(term_ids,kind="stable")    # stable: docs stay ascending within a term
+    counts=np.bincount(term_ids,minlength=len(terms))
+    term_offsets=np.concatenate([[0],np.cumsum(counts)]).astype(np.int64)
+
+    os.makedirs(path,exist_ok=True)
+    width=max((len(t) for t in terms),default=1)
+    np.save(os.path.join(path,"vocab.npy"),np.array([t.encode("ascii") for t in terms],dtype=f"S{width}"))
+    np.save(os.path.join(path,"term_offsets.npy"),term_offsets)
+    np.save(os.path.join(path,"postings_docs.npy"),np.frombuffer(post_docs,dtype=np.int32)[order])
+    np.save(os.path.join(path,"postings_tf.npy"),np.frombuffer(post_tf,dtype=np.uint16)[order])
+    lengths=np.frombuffer(doc_len,dtype=np.int32)
+    np.save(os.path.join(path,"doc_len.npy"),lengths)
+
+    meta={"num_docs":len(lengths),"avgdl":float(lengths.mean()) if len(lengths) else 0.0,"k1":k1,"b":b,
+          "index_version":index_version}
+    with open(os.path.join(path,"meta.json"),"w") as f:
+        json.dump(meta,f)
+
+    return len(lengths),len(terms),len(order)
+
+def directory_size_mb(path):
+    return sum(os.path.getsize(os.path.join(path,f)) for f in os.listdir(path))/(1024*1024)
+
+
+def main():
+    if not os.path.exists(FAISS_INDEX_FILE):
+        raise FileNotFoundError(f"the BM25 index is built for the FAISS index at {FAISS_INDEX_FILE} (run faiss_builder first)")
+    with mlflow.start_run(run_name="bm25_index_build"):
+        mlflow.log_param("metadata_file",METADATA_FILE)
+        mlflow.log_param("bm25_k1",BM25_K1)
+        mlflow.log_param("bm25_b",BM25_B)
+
+        print("building BM25 index...")
+        t0=time.time()
+        num_docs,vocab_size,num_postings=build_lexical_index(iter_metadata_jsonl(METADATA_FILE),LEXICAL_INDEX_DIR,
+                                                              index_version=index_version(FAISS_INDEX_FILE))
+        build_time=time.time()-t0
+
+        size_mb=directory_size_mb(LEXICAL_INDEX_DIR)
+        mlflow.log_metric("num_docs",num_docs)
+        mlflow.log_metric("vocab_size",vocab_size)
+        mlflow.log_metric("num_postings",num_postings)
+        mlflow.log_metric("index_build_seconds",build_time)
+        mlflow.log_metric("index_size_mb",size_mb)
+        mlflow.log_artifacts(LEXICAL_INDEX_DIR,artifact_path="bm25")
+
+        print(f"Indexed {num_docs} docs, {vocab_size} terms, {num_postings} postings in {build_time:.1f}s")
+        print(f"BM25 index saved: {LEXICAL_INDEX_DIR} ({size_mb:.2f} MB)")
+
+if __name__=="__main__":
+    main()
@@ -3,8 +3,15 @@
         Combines product name, review title, and review text
         Splits long reviews into overlapping word based chunks
         Saves chunked data with metadata
+
+Chunk ids are deterministic (derived from the review identity, word span and text hash),
+so re-running the chunker on unchanged reviews yields the same ids and downstream
+artifacts/embedding cache entries stay valid.
+
+`chunk_document` is also used per record by the streaming ingestion command (src/ingest.py).
 """
 
+import hashlib
 import json
 import uuid
 from pathlib import Path
@@ -16,9 +23,25 @@ CHUNK_WORD_LIMIT = 250
 CHUNK_OVERLAP = 50
 MIN_WORDS = 40
 
+#fixed namespace for uuid5 chunk ids (never change it, or every chunk id changes)
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c2a4e-3b7d-5e90-8a41-2d9c7b5e0f13")
+
 def words(text):
     return text.split()
 
+#content hash of a chunk's text (also the embedding cache key)
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+#within one asin, a review is identified by its author and timestamp
+def review_key(doc):
+    return f"{doc.get('user_id') or ''}|{doc.get('timestamp') or ''}"
+
+#stable chunk id from (asin, review identity, start_word, end_word, text hash)
+def make_chunk_id(asin,review_id,start,end,chunk_hash):
+    key=f"{asin}|{review_id}|{start}|{end}|{chunk_hash}"
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE,key))
+
 def make_chunks(word_list,chunk_size,overlap):
     i = 0
     n = len(word_list)
@@ -38,6 +61,60 @@ def make_chunks(word_list,chunk_size,overlap):
         i+=step
 
 
+#all chunk records of one cleaned review (empty when the review is too short)
+def chunk_document(doc):
+    product_name = doc.get("product_name", "") or ""
+    review_title = doc.get("title", "") or ""
+    review_text  = doc.get("text", "") or ""
+
+    asin= doc.get("asin")
+    parent_asin = doc.get("parent_asin")
+    rating=doc.get("rating")
+    timestamp=doc.get("timestamp")
+    helpful=doc.get("helpful_vote")
+    verified=doc.get("verified_purchase")
+    review_id=review_key(doc)
+
+    # Using title + text as source for chunking 
+    combined= (
+        f"Product: {product_name}. "
+        f"Review Title: {review_title}. "
+        f"Review: {review_text}"
+    ).strip()
+
+    w=words(combined)
+
+    #skip short documents
+    if len(w)<MIN_WORDS:
+        return []
+
+    chunks=[]
+    for start,end, chunk_words in make_chunks(w, CHUNK_WORD_LIMIT, CHUNK_OVERLAP):
+        chunk_text =  " ".join(chunk_words).strip()
+
+        #skip tiny chunks after joining them 
+        if len(chunk_text)< MIN_WORDS:
+            continue
+
+        chunk_hash=text_hash(chunk_text)
+        chunks.append({
+            "chunk_id": make_chunk_id(asin,review_id,start,end,chunk_hash),
+            "asin": asin,
+            "parent_asin": parent_asin,         
+            "product_name": product_name,
+            "rating": rating,
+            "timestamp": timestamp,
+            "helpful_vote": helpful,
+            "verified_purchase": verified,
+            "start_word": start,
+            "end_word": end,
+            "chunk_text": chunk_text,
+            "text_hash": chunk_hash
+
+        })
+    return chunks
+
+
 def main():
     Path(OUTPUT).parent.mkdir(parents=True, exist_ok=True)
     out_count = 0
@@ -49,55 +126,7 @@ def main():
 
         for line in infile:
             doc_count+=1
-            doc= json.loads(line)
-
-            product_name = doc.get("product_name", "") or ""
-            review_title = doc.get("title", "") or ""
-            review_text  = doc.get("text", "") or ""
-
-            asin= doc.get("asin")
-            parent_asin = doc.get("parent_asin")
-            rating=doc.get("rating")
-            timestamp=doc.get("timestamp")
-            helpful=doc.get("helpful_vote")
-            verified=doc.get("verified_purchase")
-
-            # Using title + text as source for chunking 
-            combined= (
-                f"Product: {product_name}. "
-                f"Review Title: {review_title}. "
-                f"Review: {review_text}"
-            ).strip()
-
-            w=words(combined)
-
-            #skip short documents
-            if len(w)<MIN_WORDS:
-                continue
-
-
-            for start,end, chunk_words in make_chunks(w, CHUNK_WORD_LIMIT, CHUNK_OVERLAP):
-                chunk_text =  " ".join(chunk_words).strip()
-
-                #skip tiny chunks after joining them 
-                if len(chunk_text)< MIN_WORDS:
-                    continue
-
-                chunk={
-                    "chunk_id": str(uuid.uuid4()),
-                    "asin": asin,
-                    "parent_asin": parent_asin,         
-                    "product_name": product_name,
-                    "rating": rating,
-                    "timestamp": timestamp,
-                    "helpful_vote": helpful,
-                    "verified_purchase": verified,
-                    "start_word": start,
-                    "end_word": end,
-                    "chunk_text": chunk_text
-
-                }
-
+            for chunk in chunk_document(json.loads(line)):
                 outfile.write(json.dumps(chunk,ensure_ascii=False)+ "\n")
                 out_count+=1
 
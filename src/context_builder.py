@@ -0,0 +1,159 @@
+"""
+Shared, token-budgeted context builder for both LLM backends (OpenAI and Ollama).
+    Every retrieved chunk becomes one context piece: provenance tag, product name, cleaned chunk text
+    Token counts of each piece are computed once at embed time for every tokenizer in PRECOMPUTED_TOKENIZERS,
+    together with token offsets (the character position of every TOKEN_OFFSET_STRIDE-th token)
+    At request time pieces are packed into the model's budget from those numbers, and a piece that
+    does not fit is cut at a stored offset, so nothing is tokenized again
+    Rows without precomputed counts (older metadata, other tokenizers) fall back to tokenizing the piece
+
+Each model maps to a tokenizer (MODEL_TOKENIZERS) and a token budget (MODEL_CONTEXT_BUDGETS).
+"""
+
+import functools
+import re
+from typing import Dict, List
+
+from src.tracing import annotate, span
+
+#tokenizer used to count context tokens for each LLM
+MODEL_TOKENIZERS={
+    "gpt-4o-mini":"o200k_base",
+    "gpt-4o":"o200k_base",
+    "mistral":"mistral",
+}
+#Hugging Face tokenizers for models that do not use tiktoken
+HF_TOKENIZERS={"mistral":"mistralai/Mistral-7B-Instruct-v0.2"}
+#tokenizer used for models missing from MODEL_TOKENIZERS
+DEFAULT_TOKENIZER="o200k_base"
+#tokenizers whose counts/offsets are stored with the chunk metadata by the embedder
+PRECOMPUTED_TOKENIZERS=("o200k_base","mistral")
+
+#context token budget per model (smaller for local models, where long prompts are slow)
+MODEL_CONTEXT_BUDGETS={"gpt-4o-mini":3000,"gpt-4o":3000,"mistral":1500}
+DEFAULT_CONTEXT_BUDGET=2000
+
+#a stored offset every this many tokens (truncation granularity)
+TOKEN_OFFSET_STRIDE=16
+#only keep a truncated piece when at least this many tokens of it fit
+MIN_PARTIAL_TOKENS=50
+
+
+#clean the retrived text before passing to llm
+def clean_text(text:str)->str:
+    text = re.sub(r"\[\[(VIDEOID|ASIN)[^\]]*\]\]", "", text)
+    text = re.sub(r"\s+"," ",text).strip()
+    return text
+
+#the context text of one retrieved chunk (provenance tag so answers can cite it, product name, cleaned text)
+def context_piece(r:Dict)->str:
+    product = r.get("product_name") or "Unknown Product"
+    provenance=f"[source:{r.get('asin','unknown')}:{r.get('chunk_id','unknown')}]"
+    txt=clean_text(r.get("chunk_text") or "")
+    return (
+        f"{provenance}\n"
+        f"Product: {product}\n"
+        f"{txt}\n"
+    )
+
+
+class _TiktokenTokenizer:
+    def __init__(self,encoding_name):
+        import tiktoken
+        self.encoding=tiktoken.get_encoding(encoding_name)
+
+    #character offset where each token starts
+    def token_starts(self,text):
+        _,starts=self.encoding.decode_with_offsets(self.encoding.encode_ordinary(text))
+        return starts
+
+class _HFTokenizer:
+    def __init__(self,model_id):
+        from transformers import AutoTokenizer
+        self.tokenizer=AutoTokenizer.from_pretrained(model_id)
+
+    def token_starts(self,text):
+        enc=self.tokenizer(text,add_special_tokens=False,return_offsets_mapping=True)
+        return [start for start,_ in enc["offset_mapping"]]
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(name):
+    """
+    Tokenizer by name: a tiktoken encoding, or a key of HF_TOKENIZERS.
+    When a Hugging Face tokenizer cannot be loaded (transformers missing, offline) the default
+    tiktoken encoding is used instead, so counts become estimates rather than errors.
+    """
+    if name in HF_TOKENIZERS:
+        try:
+            return _HFTokenizer(HF_TOKENIZERS[name])
+        except (ImportError,OSError,ValueError) as e:
+            print(f"tokenizer {name} unavailable ({type(e).__name__}); estimating with {DEFAULT_TOKENIZER}")
+            return get_tokenizer(DEFAULT_TOKENIZER)
+    return _TiktokenTokenizer(name)
+
+def tokenizer_for_model(model):
+    return MODEL_TOKENIZERS.get(model,DEFAULT_TOKENIZER)
+
+def context_budget(model):
+    return MODEL_CONTEXT_BUDGETS.get(model,DEFAULT_CONTEXT_BUDGET)
+
+def count_tokens(text:str,tokenizer_name=DEFAULT_TOKENIZER)->int:
+    return len(get_tokenizer(tokenizer_name).token_starts(text))
+
+
+#(token count, offsets) of a piece: offsets[j] is where token (j+1)*TOKEN_OFFSET_STRIDE starts
+def piece_token_info(piece,tokenizer_name):
+    starts=get_tokenizer(tokenizer_name).token_starts(piece)
+    return len(starts),[int(s) for s in starts[TOKEN_OFFSET_STRIDE::TOKEN_OFFSET_STRIDE]]
+
+def precompute_token_info(row,tokenizers=PRECOMPUTED_TOKENIZERS):
+    """
+    Token counts and offsets of a metadata row's context piece for each tokenizer, as stored by the embedder:
+    {"token_counts": {name: n}, "token_offsets": {name: [char offsets]}}
+    """
+    piece=context_piece(row)
+    counts={}
+    offsets={}
+    for name in tokenizers:
+        counts[name],offsets[name]=piece_token_info(piece,name)
+    return {"token_counts":counts,"token_offsets":offsets}
+
+def _token_info(r,piece,tokenizer_name):
+    counts=r.get("token_counts") or {}
+    offsets=r.get("token_offsets") or {}
+    if tokenizer_name in counts and tokenizer_name in offsets:
+        return counts[tokenizer_name],offsets[tokenizer_name]
+    with span("tokenize",tokenizer=tokenizer_name):
+        return piece_token_info(piece,tokenizer_name)
+
+
+def build_context(retrieved:List[Dict],model:str,max_tokens:int=None)->str:
+    """
+    Pack retrieved chunks (in order) into the model's context budget.
+    The first piece that does not fit is cut at the last stored token offset inside the budget
+    (when at least MIN_PARTIAL_TOKENS of it fit) and packing stops there.
+    """
+    tokenizer_name=tokenizer_for_model(model)
+    if max_tokens is None:
+        max_tokens=context_budget(model)
+
+    ctx_parts=[]
+    total_tokens=0
+    for r in retrieved:
+        piece=context_piece(r)
+        piece_tokens,offsets=_token_info(r,piece,tokenizer_name)
+
+        #tokens budget check
+        if total_tokens + piece_tokens > max_tokens:
+            remaining=max_tokens - total_tokens
+            # allow partial chunk if meaningful
+            cut=min(remaining//TOKEN_OFFSET_STRIDE,len(offsets))
+            if remaining > MIN_PARTIAL_TOKENS and cut > 0:
+                ctx_parts.append(piece[:offsets[cut-1]] + "....\n")
+            break
+
+        ctx_parts.append(piece)
+        total_tokens+=piece_tokens
+    annotate(context_tokens=total_tokens,pieces=len(ctx_parts))
+    return "\n".join(ctx_parts)
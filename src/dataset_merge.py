@@ -1,53 +1,199 @@
 """
 Enriches the Amazon reviews dataset by adding product names to each review
 to improve traceability during retrieval
+
+Join modes (--join), by peak memory:
+    all         every parent_asin -> title of the metadata file in a dict
+                (grows with the metadata: ~250 B + title length per product)
+    referenced  first collects the ASINs the reviews mention, then keeps only their titles
+                (grows with the products the reviews mention, not with the metadata)
+    sqlite      streams the titles into an on-disk SQLite table (TITLE_DB) and looks them up
+                LOOKUP_BATCH reviews at a time; memory is the SQLite page cache (SQLITE_CACHE_MB)
+                plus one batch, whatever the size of either file
+    auto        referenced, switching to sqlite when the reviews mention more than
+                MAX_REFERENCED_ASINS ASINs, so memory stays bounded (~MAX_REFERENCED_ASINS x 0.3 KB)
+
+`load_product_titles` / `add_product_name` / `title_source` are also used by the streaming
+ingestion command (src/ingest.py).
 """
 
+import argparse
 import json
-metadata_file = "data/raw/meta_Electronics.jsonl"            
-reviews_file = "data/raw/electronics_50k.jsonl"          
-output_file = "data/raw/electronics_50k_with_product_name.jsonl"  
-
-
-# Build mapping: parent_asin to product title
-asin_to_title = {}
-with open(metadata_file, "r") as f:
-    for line in f:
-        item = json.loads(line.strip())
-        parent_asin = item.get("parent_asin")
-        title = item.get("title")
-    
-        if parent_asin and title:
-     
+import os
+import resource
+import sqlite3
+from itertools import islice
+
+metadata_file = "data/raw/meta_Electronics.jsonl"
+reviews_file = "data/raw/electronics_50k.jsonl"
+output_file = "data/raw/electronics_50k_with_product_name.jsonl"
+
+UNKNOWN_PRODUCT = "Unknown Product"
+
+JOIN_MODES = ("auto", "referenced", "all", "sqlite")
+MAX_REFERENCED_ASINS = 2_000_000
+TITLE_DB = "data/raw/product_titles.sqlite"
+SQLITE_CACHE_MB = 64
+#reviews per title lookup (sqlite mode) / rows per insert while building the table
+LOOKUP_BATCH = 5000
+#SQLite host parameters per IN (...) query
+SQLITE_MAX_PARAMS = 500
+
+
+#(parent_asin, title) of one product metadata record, None when either is missing
+def title_entry(item):
+    parent_asin = item.get("parent_asin")
+    title = item.get("title")
+
+    if parent_asin and title:
+        return parent_asin, title
+    return None
+
+#ASINs a review can be matched on (parent_asin first, then asin)
+def review_asins(review):
+    return [a for a in (review.get("parent_asin"), review.get("asin")) if a]
+
+def iter_title_entries(path=metadata_file):
+    with open(path, "r") as f:
+        for line in f:
+            entry = title_entry(json.loads(line.strip()))
+            if entry:
+                yield entry
+
+# Build mapping: parent_asin to product title (only for the `wanted` ASINs when given)
+def load_product_titles(path=metadata_file, wanted=None):
+    asin_to_title = {}
+    for parent_asin, title in iter_title_entries(path):
+        if wanted is None or parent_asin in wanted:
             asin_to_title[parent_asin] = title
+    return asin_to_title
+
+#every ASIN the reviews can be matched on; None once there are more than max_asins
+def collect_referenced_asins(path=reviews_file, max_asins=None):
+    wanted = set()
+    with open(path, "r") as f:
+        for line in f:
+            wanted.update(review_asins(json.loads(line.strip())))
+            if max_asins is not None and len(wanted) > max_asins:
+                return None
+    return wanted
+
+
+class SqliteTitles:
+    """
+    parent_asin -> title table on disk, looked up a batch of ASINs at a time.
+    """
+
+    def __init__(self, path=TITLE_DB, cache_mb=SQLITE_CACHE_MB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(f"PRAGMA cache_size=-{cache_mb * 1024}")
+
+    #write (parent_asin, title) entries into a fresh table (a repeated ASIN keeps its last title, like the dict)
+    @classmethod
+    def build(cls, entries, path=TITLE_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+        conn.execute("CREATE TABLE titles (asin TEXT PRIMARY KEY, title TEXT) WITHOUT ROWID")
+        entries = iter(entries)
+        while True:
+            rows = list(islice(entries, LOOKUP_BATCH))
+            if not rows:
+                break
+            conn.executemany("INSERT OR REPLACE INTO titles VALUES (?, ?)", rows)
+        conn.commit()
+        conn.close()
+        return cls(path)
+
+    def lookup(self, asins):
+        asins = list(asins)
+        found = {}
+        for s in range(0, len(asins), SQLITE_MAX_PARAMS):
+            part = asins[s:s + SQLITE_MAX_PARAMS]
+            query = f"SELECT asin, title FROM titles WHERE asin IN ({','.join('?' * len(part))})"
+            found.update(self.conn.execute(query, part))
+        return found
+
+    def close(self):
+        self.conn.close()
+
+
+#product titles by the chosen join mode: a dict, or a SqliteTitles for the sqlite join
+def title_source(join="auto", metadata_path=metadata_file, reviews_path=reviews_file, db_path=TITLE_DB):
+    if join not in JOIN_MODES:
+        raise ValueError(f"unknown join mode: {join}")
+    if join == "all":
+        return load_product_titles(metadata_path)
+    if join in ("auto", "referenced"):
+        wanted = collect_referenced_asins(reviews_path, MAX_REFERENCED_ASINS if join == "auto" else None)
+        if wanted is not None:
+            return load_product_titles(metadata_path, wanted)
+        print(f"reviews mention more than {MAX_REFERENCED_ASINS} ASINs; joining through SQLite")
+    return SqliteTitles.build(iter_title_entries(metadata_path), db_path)
+
+#titles for a batch of reviews (the whole dict, or the rows looked up for just these reviews)
+def titles_for(source, reviews):
+    if isinstance(source, SqliteTitles):
+        return source.lookup({a for review in reviews for a in review_asins(review)})
+    return source
+
+
+#Inject the product title into a review (in place)
+def add_product_name(review, asin_to_title):
+    # parent_asin for matching
+    parent_asin = review.get("parent_asin")
+    asin = review.get("asin")
+
+    # Find product title using parent_asin first
+    product_name = None
+    if parent_asin:
+        product_name = asin_to_title.get(parent_asin)
+
+    # match by asin if parent_asin missing
+    if not product_name and asin:
+        product_name = asin_to_title.get(asin)
 
+    #Unknown Product if no match
+    if not product_name:
+        product_name = UNKNOWN_PRODUCT
 
-#Go through review dataset and enrich every line with title
+    review["product_name"] = product_name
+    return review
 
-with open(reviews_file, "r") as fin, open(output_file, "w") as fout:
-    for line in fin:
-        review = json.loads(line.strip())
 
-        # parent_asin for matching
-        parent_asin = review.get("parent_asin")
-        asin = review.get("asin")
+#peak resident memory of this process so far (Linux reports KB)
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
-        # Find product title using parent_asin first
-        product_name = None
-        if parent_asin:
-            product_name = asin_to_title.get(parent_asin)
 
-        # match by asin if parent_asin missing
-        if not product_name and asin:
-            product_name = asin_to_title.get(asin)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Add product titles to reviews")
+    parser.add_argument("--join", choices=JOIN_MODES, default="auto")
+    return parser.parse_args()
 
-        #Unknown Product if no match
-        if not product_name:
-            product_name = "Unknown Product"
+def main():
+    args = parse_args()
+    source = title_source(args.join, metadata_file, reviews_file)
 
-        # Inject product_name
-        review["product_name"] = product_name
+    #Go through review dataset and enrich every line with title
+    with open(reviews_file, "r") as fin, open(output_file, "w") as fout:
+        while True:
+            reviews = [json.loads(line.strip()) for line in islice(fin, LOOKUP_BATCH)]
+            if not reviews:
+                break
+            asin_to_title = titles_for(source, reviews)
+            for review in reviews:
+                fout.write(json.dumps(add_product_name(review, asin_to_title)) + "\n")
 
-        fout.write(json.dumps(review) + "\n")
+    if isinstance(source, SqliteTitles):
+        source.close()
+    print(f"Saved → {output_file} (join: {args.join}, peak RSS {peak_rss_mb():.0f} MB)")
 
 
+if __name__ == "__main__":
+    main()
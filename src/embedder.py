@@ -3,100 +3,286 @@ Generates embeddings for review chunks and stores them with metadata for FAISS-b
     Loads pre chunked data
     Computes embeddings using a SentenceTransformer model
     Stores embeddings and associated metadata for FAISS based retrieval
+
+Chunks are encoded in batches ordered by text length (less padding per batch) and written
+straight into a preallocated .npy memmap, so peak memory is one batch rather than the whole matrix.
+With --workers N the chunk file is sharded across N processes that all write into the same memmap.
+Vectors are cached by (model, chunk text hash), so a rebuild only encodes new or changed chunks.
+With --dtype float16/int8 the final file is stored at reduced precision (see quantization.py).
+Context token counts/offsets for each backend tokenizer are stored with the metadata (see context_builder.py).
 """
 
+import argparse
 import json
+import multiprocessing as mp
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 import os
+import time
 import mlflow
+from array import array
+
+from src.chunker import text_hash
+from src.context_builder import PRECOMPUTED_TOKENIZERS, precompute_token_info
+from src.embedding_cache import EMBEDDING_CACHE_FILE, EmbeddingCache
+from src.metadata_store import METADATA_STORE_DIR, write_metadata_store
+from src.quantization import EMBEDDING_DTYPES, convert_embeddings_file, precision_report, quant_params_path
 
 CHUNK_FILE="data/chunks/electronics_chunks_250w_50ov.jsonl"
 EMBEDDING_FILE="data/embeddings/electronics_embeddings.npy"
 METADATA_FILE="data/embeddings/electronics_metadata.jsonl"
+EMBEDDING_MODEL="sentence-transformers/all-mpnet-base-v2"
+DEFAULT_BATCH_SIZE=64
+#rows copied from/to the embedding cache per round trip
+CACHE_COPY_BATCH=10000
 
 
-#Takes a filename - Opens the file - Reads each line - 
+#Takes a filename - Opens the file - Reads each line -
 # Converts JSON string - Python dict - Returns a list of these dicts
 def load_chunks(chunk_file):
     with open(chunk_file,"r") as f:
         return[json.loads(line) for line in f]
 
+#metadata row stored for every chunk (row i belongs to FAISS id i)
+def chunk_metadata(chunk):
+    return {
+        "chunk_id": chunk["chunk_id"],
+        "asin": chunk["asin"],
+        "parent_asin": chunk.get("parent_asin"),
+        "product_name": chunk.get("product_name"),
+        "review_title": chunk.get("review_title"),
+        "rating": chunk["rating"],
+        "timestamp": chunk["timestamp"],
+        "helpful_vote": chunk["helpful_vote"],
+        "verified_purchase": chunk["verified_purchase"],
+        "start_word": chunk["start_word"],
+        "end_word": chunk["end_word"],
+        "chunk_text": chunk["chunk_text"]
+    }
+
+#one pass over the chunk file: metadata rows, chunk text hashes
+#and the byte offset of every line (used to shard)
+def scan_chunks(chunk_file):
+    metadata=[]
+    hashes=[]
+    line_offsets=array("q")
+    pos=0
+    with open(chunk_file,"rb") as f:
+        for line in f:
+            line_offsets.append(pos)
+            pos+=len(line)
+            chunk=json.loads(line)
+            metadata.append(chunk_metadata(chunk))
+            hashes.append(chunk.get("text_hash") or text_hash(chunk["chunk_text"]))
+    return metadata,hashes,line_offsets
+
+#store each chunk's context-piece token counts/offsets so prompts can be packed without re-tokenizing
+def add_token_info(metadata,tokenizers=PRECOMPUTED_TOKENIZERS):
+    for m in metadata:
+        m.update(precompute_token_info(m,tokenizers))
+    return metadata
+
+# Saves the chunk metadata
+# (JSONL for inspection + the mmap metadata store the retriever reads)
+def save_metadata(metadata):
+    os.makedirs("data/embeddings",exist_ok=True)
+    with open(METADATA_FILE,"w") as f:
+        for m in metadata:
+            f.write(json.dumps(m)+"\n")
+
+    write_metadata_store(metadata,METADATA_STORE_DIR)
+
 # Saves the embeddings matrix and chunk metadata
 def save_embedding(embeddings,metadata):
     os.makedirs("data/embeddings",exist_ok=True)
     np.save(EMBEDDING_FILE,embeddings)
+    save_metadata(metadata)
 
-    with open(METADATA_FILE,"w") as f:
-        for m in metadata:
-            f.write(json.dumps(m)+"\n")
+#preallocate the output .npy file and return it as a writable memmap
+def create_embedding_memmap(path,num_rows,dim):
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    return np.lib.format.open_memmap(path,mode="w+",dtype=np.float32,shape=(num_rows,dim))
 
 
-def main():
+#yield batches of row indices, longest texts first, so each batch has similar lengths
+def length_sorted_batches(texts,batch_size):
+    order=sorted(range(len(texts)),key=lambda i:len(texts[i]),reverse=True)
+    for s in range(0,len(order),batch_size):
+        yield order[s:s+batch_size]
+
+#encode texts batch by batch and write text i into out[out_rows[i]]
+def encode_batched(model,texts,out,out_rows=None,batch_size=DEFAULT_BATCH_SIZE,progress=False):
+    if out_rows is None:
+        out_rows=range(len(texts))
+    batches=list(length_sorted_batches(texts,batch_size))
+    for batch in tqdm(batches,disable=not progress):
+        emb=model.encode([texts[i] for i in batch],batch_size=batch_size,
+                         convert_to_numpy=True,show_progress_bar=False)
+        out[[out_rows[i] for i in batch]]=emb.astype(np.float32)
 
 
+#pool worker: read its rows from the chunk file, encode them and write into the shared memmap
+def _encode_shard(args):
+    worker_id,chunk_file,embedding_file,rows,byte_offsets,batch_size,model_name,threads=args
+    import torch
+    torch.set_num_threads(threads)
+
+    t0=time.time()
+    texts=[]
+    with open(chunk_file,"rb") as f:
+        for offset in byte_offsets:
+            f.seek(offset)
+            texts.append(json.loads(f.readline())["chunk_text"])
+
+    model=SentenceTransformer(model_name)
+    t1=time.time()
+
+    out=np.load(embedding_file,mmap_mode="r+")
+    encode_batched(model,texts,out,out_rows=rows,batch_size=batch_size)
+    out.flush()
+    del out
+    t2=time.time()
+
+    return {"worker_id":worker_id,"num_chunks":len(rows),
+            "load_seconds":t1-t0,"encode_seconds":t2-t1,"total_seconds":t2-t0}
+
+#split the rows to encode into contiguous shards and encode them in a process pool
+def encode_parallel(chunk_file,embedding_file,line_offsets,rows,num_workers,batch_size,model_name=EMBEDDING_MODEL):
+    shards=[s for s in np.array_split(np.asarray(rows,dtype=np.int64),num_workers) if len(s)]
+    threads=max(1,(os.cpu_count() or 1)//len(shards))
+    tasks=[
+        (w,chunk_file,embedding_file,shard.tolist(),[line_offsets[i] for i in shard],batch_size,model_name,threads)
+        for w,shard in enumerate(shards)
+    ]
+    # spawn: torch is not fork-safe once initialised
+    with mp.get_context("spawn").Pool(len(tasks)) as pool:
+        return pool.map(_encode_shard,tasks)
+
+
+def parse_args():
+    parser=argparse.ArgumentParser(description="Generate chunk embeddings")
+    parser.add_argument("--batch-size",type=int,default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers",type=int,default=1,help="number of encoding processes (1 = encode in this process)")
+    parser.add_argument("--no-cache",action="store_true",help="ignore and do not update the embedding cache")
+    parser.add_argument("--dtype",choices=EMBEDDING_DTYPES,default="float32",help="storage precision of the embeddings file")
+    return parser.parse_args()
+
+
+def main():
+    args=parse_args()
+
     # Start MLflow run
     with mlflow.start_run(run_name="embedding_generation"):
         # Log important parameters
-        mlflow.log_param("embedding_model", "sentence-transformers/all-mpnet-base-v2")
+        mlflow.log_param("embedding_model", EMBEDDING_MODEL)
         mlflow.log_param("chunk_size", 250)
         mlflow.log_param("overlap", 50)
+        mlflow.log_param("batch_size", args.batch_size)
+        mlflow.log_param("num_workers", args.workers)
+        mlflow.log_param("embedding_cache", not args.no_cache)
+        mlflow.log_param("embedding_dtype", args.dtype)
 
 
         print("loading chunks...")
-        chunks=load_chunks(CHUNK_FILE)   #list of dicts = chunks
-        print(f"Loaded {len(chunks)} chunks")
-        mlflow.log_metric("num_chunks", len(chunks))
- 
+        metadata,hashes,line_offsets=scan_chunks(CHUNK_FILE)
+        num_chunks=len(metadata)
+        print(f"Loaded {num_chunks} chunks")
+        mlflow.log_metric("num_chunks", num_chunks)
+        if num_chunks==0:
+            raise ValueError(f"no chunks in {CHUNK_FILE} (run the chunker first)")
+
+        print("counting context tokens...")
+        t_tokens=time.time()
+        add_token_info(metadata)
+        mlflow.log_param("context_tokenizers",",".join(PRECOMPUTED_TOKENIZERS))
+        mlflow.log_metric("token_count_seconds",time.time()-t_tokens)
 
-        print("Now loading embedding model...")
-        model=SentenceTransformer("sentence-transformers/all-mpnet-base-v2")
+        cache=None if args.no_cache else EmbeddingCache(EMBEDDING_CACHE_FILE,EMBEDDING_MODEL)
+        cached=cache.contains_many(hashes) if cache else set()
+        misses=[i for i,h in enumerate(hashes) if h not in cached]
+        print(f"Embedding cache: {num_chunks-len(misses)} hits, {len(misses)} to encode")
+        mlflow.log_metric("cache_hits", num_chunks-len(misses))
+        mlflow.log_metric("cache_misses", len(misses))
 
-        embeddings=[]
-        metadata=[]
+        # loaded here even in pool mode: gives the output dim and warms the model cache for the workers
+        model=None
+        if misses:
+            print("Now loading embedding model...")
+            model=SentenceTransformer(EMBEDDING_MODEL)
+            dim=model.get_sentence_embedding_dimension()
+        else:
+            dim=cache.dim()
 
-        import time
-        start_time = time.time()    
+        start_time = time.time()
+
+        out=create_embedding_memmap(EMBEDDING_FILE,num_chunks,dim)
+        hit_rows=[i for i,h in enumerate(hashes) if h in cached]
+        for s in range(0,len(hit_rows),CACHE_COPY_BATCH):
+            rows=hit_rows[s:s+CACHE_COPY_BATCH]
+            vectors=cache.get_many([hashes[i] for i in rows])
+            out[rows]=np.stack([vectors[hashes[i]] for i in rows])
 
         print("computing embeddings...")
-        for chunk in tqdm(chunks):
-            text=chunk["chunk_text"]
-            emb=model.encode(text,convert_to_numpy= True)
-            embeddings.append(emb)
-
-            metadata.append({
-
-
-                "chunk_id": chunk["chunk_id"],
-                "asin": chunk["asin"],
-                "parent_asin": chunk.get("parent_asin"),
-                "product_name": chunk.get("product_name"),
-                "review_title": chunk.get("review_title"),
-                "rating": chunk["rating"],
-                "timestamp": chunk["timestamp"],
-                "helpful_vote": chunk["helpful_vote"],
-                "verified_purchase": chunk["verified_purchase"],
-                "start_word": chunk["start_word"],
-                "end_word": chunk["end_word"],
-                "chunk_text": chunk["chunk_text"]
-            }
-            )
-
-        embeddings=np.vstack(embeddings)
+        if misses and args.workers>1:
+            del model
+            out.flush()
+            stats=encode_parallel(CHUNK_FILE,EMBEDDING_FILE,line_offsets,misses,args.workers,args.batch_size)
+            for s in stats:
+                w=s["worker_id"]
+                mlflow.log_metric(f"worker_{w}_num_chunks", s["num_chunks"])
+                mlflow.log_metric(f"worker_{w}_load_seconds", s["load_seconds"])
+                mlflow.log_metric(f"worker_{w}_encode_seconds", s["encode_seconds"])
+                mlflow.log_metric(f"worker_{w}_chunks_per_second", s["num_chunks"]/max(s["encode_seconds"],1e-9))
+                print(f"worker {w}: {s['num_chunks']} chunks in {s['encode_seconds']:.1f}s")
+        elif misses:
+            texts=[metadata[i]["chunk_text"] for i in misses]
+            encode_batched(model,texts,out,out_rows=misses,batch_size=args.batch_size,progress=True)
+        out.flush()
+
+        if cache and misses:
+            for s in range(0,len(misses),CACHE_COPY_BATCH):
+                rows=misses[s:s+CACHE_COPY_BATCH]
+                cache.put_many([hashes[i] for i in rows],out[rows])
+        if cache:
+            cache.close()
+        del out
+
         end_time = time.time()
-        mlflow.log_metric("time_taken_seconds", end_time - start_time)
-        mlflow.log_metric("embedding_dim", embeddings.shape[1])
+        elapsed=end_time - start_time
+        mlflow.log_metric("time_taken_seconds", elapsed)
+        mlflow.log_metric("chunks_per_second", len(misses)/max(elapsed,1e-9))
+        mlflow.log_metric("embedding_dim", dim)
+        print(f"Encoded {len(misses)} chunks in {elapsed:.1f}s ({len(misses)/max(elapsed,1e-9):.1f} chunks/s)")
+
+        if args.dtype!="float32":
+            print(f"converting embeddings to {args.dtype}...")
+            reduced_file=EMBEDDING_FILE+".tmp.npy"
+            convert_embeddings_file(EMBEDDING_FILE,reduced_file,args.dtype)
+            report=precision_report(np.load(EMBEDDING_FILE,mmap_mode="r"),np.load(reduced_file,mmap_mode="r"),
+                                    reduced_file,args.dtype)
+            if args.dtype=="int8":
+                os.replace(quant_params_path(reduced_file),quant_params_path(EMBEDDING_FILE))
+            os.replace(reduced_file,EMBEDDING_FILE)
+            for name,value in report.items():
+                if isinstance(value,float):
+                    mlflow.log_metric(name,value)
+            print(report)
+        if args.dtype!="int8" and os.path.exists(quant_params_path(EMBEDDING_FILE)):
+            os.remove(quant_params_path(EMBEDDING_FILE))
 
-        print("now saving embeddings...")
-        save_embedding(embeddings,metadata)
+        print("now saving metadata...")
+        save_metadata(metadata)
 
         print("Saving complete.")
         print(f"Embeddings saved to {EMBEDDING_FILE}")
         print(F"Metadata saved to {METADATA_FILE}")
+        print(f"Metadata store saved to {METADATA_STORE_DIR}")
 
-        # Log artifacts 
+        # Log artifacts
         mlflow.log_artifact(EMBEDDING_FILE)
+        if args.dtype=="int8":
+            mlflow.log_artifact(quant_params_path(EMBEDDING_FILE))
         mlflow.log_artifact(METADATA_FILE)
 
 if __name__=="__main__":
@@ -0,0 +1,90 @@
+"""
+Content-addressed on-disk cache of chunk embeddings.
+    Vectors are keyed by (embedding model name, sha256 of the chunk text)
+    Stored in a single SQLite file so it can grow incrementally between rebuilds
+    Lets the embedder encode only new or changed chunks and reuse everything else
+"""
+
+import os
+import sqlite3
+
+import numpy as np
+
+EMBEDDING_CACHE_FILE="data/embeddings/embedding_cache.sqlite"
+
+#sqlite limits the number of bound parameters per statement
+LOOKUP_BATCH=500
+
+
+class EmbeddingCache:
+    """
+    SQLite backed map (model, text_hash) -> float32 vector.
+    """
+
+    def __init__(self,path=EMBEDDING_CACHE_FILE,model_name=""):
+        self.path=path
+        self.model_name=model_name
+        os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+        self.conn=sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self.conn.commit()
+
+    def __len__(self):
+        row=self.conn.execute("SELECT COUNT(*) FROM embeddings WHERE model=?",(self.model_name,)).fetchone()
+        return int(row[0])
+
+    #embedding dimension stored for this model (None when the cache is empty)
+    def dim(self):
+        row=self.conn.execute("SELECT dim FROM embeddings WHERE model=? LIMIT 1",(self.model_name,)).fetchone()
+        return None if row is None else int(row[0])
+
+    def contains_many(self,hashes):
+        """
+        Return the subset of hashes present in the cache (keys only, no vectors are read).
+        """
+        present=set()
+        unique=list(dict.fromkeys(hashes))
+        for s in range(0,len(unique),LOOKUP_BATCH):
+            batch=unique[s:s+LOOKUP_BATCH]
+            placeholders=",".join("?"*len(batch))
+            rows=self.conn.execute(
+                f"SELECT text_hash FROM embeddings WHERE model=? AND text_hash IN ({placeholders})",
+                [self.model_name,*batch],
+            )
+            present.update(h for (h,) in rows)
+        return present
+
+    def get_many(self,hashes):
+        """
+        Return {text_hash: vector} for every hash found in the cache.
+        """
+        found={}
+        unique=list(dict.fromkeys(hashes))
+        for s in range(0,len(unique),LOOKUP_BATCH):
+            batch=unique[s:s+LOOKUP_BATCH]
+            placeholders=",".join("?"*len(batch))
+            rows=self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model=? AND text_hash IN ({placeholders})",
+                [self.model_name,*batch],
+            )
+            for h,blob in rows:
+                found[h]=np.frombuffer(blob,dtype=np.float32)
+        return found
+
+    def put_many(self,hashes,vectors):
+        vectors=np.asarray(vectors,dtype=np.float32)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) VALUES (?,?,?,?)",
+            ((self.model_name,h,int(v.shape[0]),v.tobytes()) for h,v in zip(hashes,vectors)),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -1,11 +1,48 @@
 """
-Evaluates the quality of the retriever by manually measuring how relevant
-the top-k retrieved chunks are for sample queries.
+Offline evaluation of the retriever against labeled queries (qrels), for comparing index builds.
+
+Qrels file (JSONL, one labeled query per line):
+    {"query_id": "q1", "query": "...", "relevant": {"<chunk_id>": 2, "<chunk_id>": 1}, "filters": {...}}
+    grades are graded relevance (>= 1 relevant); chunks not listed count as not relevant;
+    "filters" (optional) are passed to the retriever like the API's (see filters.py)
+
+    evaluate  runs every query once per index artifact (--index name=path, repeatable; all indexes
+              must be built from the same metadata so FAISS ids map to the same chunks):
+              one batched retrieval pass per filter group for the rankings, then every query timed alone
+              (search + lexical fusion + metadata rows; queries are embedded once up front)
+              -> recall@k, precision@k, MRR@k and nDCG@k for each --k, and search latency percentiles,
+              printed side by side and written as JSON (--output) with the per-query numbers
+              --baseline (an earlier --output) fails the run (exit 1) when a metric of an index present in
+              both drops by more than --tolerance
+    pool      writes a qrels file to label: the union of the top --k chunks of every index for each query
+              (TEST_QUERIES, or --queries), as "candidates" next to an empty "relevant"
+
+    python -m src.evaluate_retrieval pool --k 10 --output data/eval/qrels.jsonl
+    python -m src.evaluate_retrieval evaluate --qrels data/eval/qrels.jsonl --k 5 10 \\
+        --index flat=data/faiss/electronics.index --index hnsw=data/faiss/electronics_hnsw.index
 """
-from retriever import retrieve
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from src.filters import filters_key, normalize_filters
+from src.retriever import EMBEDDING_MODEL, FAISS_INDEX_FILE, Retriever, embed_queries, load_encoder
+
+QRELS_FILE = "data/eval/qrels.jsonl"
+DEFAULT_KS = (5, 10)
+DEFAULT_TOLERANCE = 0.01
+METRICS = ("recall", "precision", "mrr", "ndcg")
+SNIPPET_CHARS = 300
 
 # ---------------------------
-# Test queries for evaluation
+# Seed queries for pooling
 # ---------------------------
 
 TEST_QUERIES = [
@@ -29,53 +66,205 @@ TEST_QUERIES = [
 
 
 # ---------------------------
-# Evaluate retriever quality
+# Qrels
+# ---------------------------
+def load_qrels(path=QRELS_FILE):
+    qrels = []
+    with open(path, "r") as f:
+        for n, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            relevant = {str(c): int(g) for c, g in (item.get("relevant") or {}).items() if int(g) > 0}
+            qrels.append({"query_id": str(item.get("query_id", n)), "query": item["query"],
+                          "relevant": relevant, "filters": normalize_filters(item.get("filters"))})
+    return qrels
+
+
+# ---------------------------
+# Metrics
+# ---------------------------
+#metrics of one ranked list of chunk ids against graded judgments
+def score_ranking(ranked, relevant, k):
+    top = ranked[:k]
+    hits = [relevant.get(c, 0) for c in top]
+    found = sum(1 for g in hits if g > 0)
+    first = next((i for i, g in enumerate(hits) if g > 0), None)
+    dcg = sum((2 ** g - 1) / math.log2(i + 2) for i, g in enumerate(hits))
+    ideal = sorted(relevant.values(), reverse=True)[:k]
+    idcg = sum((2 ** g - 1) / math.log2(i + 2) for i, g in enumerate(ideal))
+    return {"recall": found / len(relevant) if relevant else 0.0,
+            "precision": found / k,
+            "mrr": 1 / (first + 1) if first is not None else 0.0,
+            "ndcg": dcg / idcg if idcg > 0 else 0.0}
+
+def latency_summary(latencies_ms):
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99), "mean_ms": float(np.mean(latencies_ms))}
+
+
+# ---------------------------
+# Evaluation of one index
+# ---------------------------
+def rank_queries(retriever, qrels, depth):
+    """
+    Ranked chunk ids per query: one retrieve_many pass per group of queries sharing filters.
+    """
+    groups = defaultdict(list)
+    for i, q in enumerate(qrels):
+        groups[filters_key(q["filters"])].append(i)
+    rankings = [None] * len(qrels)
+    for members in groups.values():
+        batch = retriever.retrieve_many([qrels[i]["query"] for i in members], k=depth, filters=qrels[members[0]]["filters"])
+        for i, (results, _, _) in zip(members, batch):
+            rankings[i] = [r.get("chunk_id") for r in results]
+    return rankings
+
+#per-query latency of everything after the embedding (search, lexical fusion, metadata rows)
+def time_queries(retriever, qrels, vectors, depth):
+    latencies = []
+    for q, vector in zip(qrels, vectors):
+        start = time.perf_counter()
+        retriever.retrieve_vector(vector.reshape(1, -1), depth, q["query"], None, q["filters"])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def evaluate_index(retriever, qrels, ks, vectors):
+    depth = max(ks)
+    start = time.perf_counter()
+    rankings = rank_queries(retriever, qrels, depth)
+    batch_seconds = time.perf_counter() - start
+    latencies = time_queries(retriever, qrels, vectors, depth)
+
+    per_query = []
+    for q, ranked, latency in zip(qrels, rankings, latencies):
+        row = {"query_id": q["query_id"], "latency_ms": latency, "retrieved": ranked[:depth]}
+        for k in ks:
+            for name, value in score_ranking(ranked, q["relevant"], k).items():
+                row[f"{name}@{k}"] = value
+        per_query.append(row)
+
+    summary = {f"{name}@{k}": float(np.mean([row[f"{name}@{k}"] for row in per_query])) for k in ks for name in METRICS}
+    return {"index_path": retriever.index_path, "hybrid": retriever.lexical is not None, "queries": len(qrels),
+            "metrics": summary, "latency": latency_summary(latencies), "batch_seconds": batch_seconds,
+            "per_query": per_query}
+
+
+def parse_indexes(specs):
+    indexes = {}
+    for spec in specs or [f"default={FAISS_INDEX_FILE}"]:
+        name, sep, path = spec.partition("=")
+        if not sep:
+            name, path = os.path.splitext(os.path.basename(spec))[0], spec
+        indexes[name] = path
+    return indexes
+
+def open_retrievers(indexes, model_name=EMBEDDING_MODEL, hybrid=True):
+    encoder = load_encoder(model_name)
+    return {name: Retriever(index_path=path, model_name=model_name, hybrid=hybrid, model=encoder)
+            for name, path in indexes.items()}
+
+def evaluate(qrels, retrievers, ks=DEFAULT_KS):
+    judged = [q for q in qrels if q["relevant"]]
+    if len(judged) < len(qrels):
+        print(f"skipping {len(qrels) - len(judged)} queries without relevant chunks", file=sys.stderr)
+    if not judged:
+        raise ValueError("no judged queries")
+    encoder = next(iter(retrievers.values())).model
+    vectors = embed_queries([q["query"] for q in judged], model=encoder)
+    return {name: evaluate_index(retriever, judged, ks, vectors) for name, retriever in retrievers.items()}
+
+
+#(index, metric, baseline, current) for every metric that dropped by more than tolerance
+def regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    dropped = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, value in result["metrics"].items():
+            if metric in base["metrics"] and value < base["metrics"][metric] - tolerance:
+                dropped.append((name, metric, base["metrics"][metric], value))
+    return dropped
+
+def print_table(results, ks):
+    columns = [f"{name}@{k}" for k in ks for name in METRICS]
+    print(f"{'index':20s} " + " ".join(f"{c:>12s}" for c in columns) + f" {'p50 ms':>9s} {'p95 ms':>9s}")
+    for name, result in results.items():
+        print(f"{name:20s} " + " ".join(f"{result['metrics'][c]:12.3f}" for c in columns)
+              + f" {result['latency']['p50_ms']:9.2f} {result['latency']['p95_ms']:9.2f}")
+
+
+# ---------------------------
+# Pooling candidates to label
 # ---------------------------
-def evaluate_retriever(k=3):
-    total_queries = len(TEST_QUERIES)
-    total_relevance_score = 0
-
-    print("\n======================")
-    print(" RETRIEVAL EVALUATION ")
-    print("======================")
-
-    for query in TEST_QUERIES:
-        print("\n------------------------------------")
-        print(f"Query: {query}")
-
-        results, distances, ids = retrieve(query, k=k)
-
-        # Print top results
-        print("\nTop Results:")
-        for i, r in enumerate(results):
-            print(f"\nResult {i+1}  (Distance: {distances[i]:.4f})")
-            print(r["chunk_text"][:300], "...")
-        
-        # Ask for manual relevance input
-        print("\nHow many of the above results were relevant?")
-        print(f"Enter a number 0–{k}: ")
-
-        while True:
-            try:
-                score = int(input("> "))
-                if 0 <= score <= k:
-                    break
-                else:
-                    print(f"Please enter a valid number between 0 and {k}.")
-            except ValueError:
-                print("Please enter a valid integer.")
-        
-        total_relevance_score += score
-
-    # --------------------
-    # Compute Precision@K
-    # ---------------------
-    precision_at_k = total_relevance_score / (total_queries * k)
-
-    print("\n====================================")
-    print(f" FINAL PRECISION@{k}: {precision_at_k:.2f}")
-    print("====================================")
+def pool_candidates(queries, retrievers, k):
+    items = []
+    names = list(retrievers)
+    rankings = {name: retrievers[name].retrieve_many(queries, k=k) for name in names}
+    for i, query in enumerate(queries):
+        seen = {}
+        for name in names:
+            for r in rankings[name][i][0]:
+                seen.setdefault(r.get("chunk_id"), {"chunk_id": r.get("chunk_id"), "asin": r.get("asin"),
+                                                    "product_name": r.get("product_name"),
+                                                    "text": (r.get("chunk_text") or "")[:SNIPPET_CHARS]})
+        items.append({"query_id": f"q{i + 1}", "query": query, "relevant": {}, "candidates": list(seen.values())})
+    return items
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Retrieval quality (recall/MRR/nDCG) and latency from qrels")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command in ("evaluate", "pool"):
+        p = sub.add_parser(command)
+        p.add_argument("--index", action="append", help="name=path of a FAISS index (repeatable)")
+        p.add_argument("--model", default=EMBEDDING_MODEL)
+        p.add_argument("--no-hybrid", action="store_true", help="vector search only, even if a BM25 index exists")
+    evaluate_args = sub.choices["evaluate"]
+    evaluate_args.add_argument("--qrels", default=QRELS_FILE)
+    evaluate_args.add_argument("--k", type=int, nargs="+", default=list(DEFAULT_KS))
+    evaluate_args.add_argument("--output", default=None, help="results JSON with per-query metrics")
+    evaluate_args.add_argument("--baseline", default=None, help="earlier --output to compare with")
+    evaluate_args.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed absolute drop")
+    pool_args = sub.choices["pool"]
+    pool_args.add_argument("--queries", default=None, help="text file, one query per line (default: TEST_QUERIES)")
+    pool_args.add_argument("--k", type=int, default=10)
+    pool_args.add_argument("--output", default=QRELS_FILE)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    retrievers = open_retrievers(parse_indexes(args.index), args.model, hybrid=not args.no_hybrid)
+
+    if args.command == "pool":
+        queries = TEST_QUERIES
+        if args.queries:
+            with open(args.queries, "r") as f:
+                queries = [line.strip() for line in f if line.strip()]
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            for item in pool_candidates(queries, retrievers, args.k):
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        print(f"Saved {len(queries)} queries to label → {args.output}")
+        return
+
+    ks = sorted(set(args.k))
+    results = evaluate(load_qrels(args.qrels), retrievers, ks)
+    print_table(results, ks)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved → {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            dropped = regressions(results, json.load(f), args.tolerance)
+        for name, metric, base, value in dropped:
+            print(f"REGRESSION {name} {metric}: {base:.3f} → {value:.3f}")
+        if dropped:
+            raise SystemExit(1)
 
 
 if __name__ == "__main__":
-    evaluate_retriever(k=3)
+    main()
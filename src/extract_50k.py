@@ -1,25 +1,50 @@
 """
 Extracts a fixed size subset of Amazon Electronics reviews to create a manageable dataset
 for development and experimentation.
-extracts the first 50,000 review records.
+extracts 50,000 consecutive review records (the first ones, or from --start using the
+gzip record index, see gzip_index.py). For a representative subset use sampling.py instead.
 
 """
 
+import argparse
 import gzip
-import json
+import itertools
+
+from src.gzip_index import GzipRecordReader, index_exists
 
 input_path = "data/raw/electronics_full.jsonl.gz"
 output_path = "data/raw/electronics_50k.jsonl"
 
 limit = 50000
-count = 0
 
-with gzip.open(input_path, "rt", encoding="utf-8") as infile, open(output_path, "w", encoding="utf-8") as outfile:
-    for line in infile:
-        outfile.write(line)
-        count += 1
 
-        if count == limit:
-            break
+def main():
+    parser = argparse.ArgumentParser(description="Extract consecutive reviews from the full dump")
+    parser.add_argument("--start", type=int, default=0, help="first record (needs the gzip index when > 0)")
+    parser.add_argument("--limit", type=int, default=limit)
+    args = parser.parse_args()
+    limit_count = max(args.limit, 0)
+
+    if args.start > 0:
+        if not index_exists(input_path):
+            raise SystemExit(f"build the index first: python -m src.gzip_index build {input_path}")
+        lines = GzipRecordReader(input_path).read_range(args.start, args.start + limit_count)
+        infile = None
+    else:
+        infile = gzip.open(input_path, "rb")
+        lines = infile
+
+    count = 0
+    with open(output_path, "wb") as outfile:
+        # the limit is applied before anything is written, so --limit 0 (or below) writes nothing
+        for line in itertools.islice(lines, limit_count):
+            outfile.write(line)
+            count += 1
+    if infile is not None:
+        infile.close()
+
+    print(f"Saved {count} reviews from record {args.start} to {output_path}")
+
 
-print(f"Saved first {limit} reviews to {output_path}")
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,196 @@
 """
 Builds and stores a FAISS index from precomputed embeddings for  semantic retrieval
     Loads embedding vectors
-    Builds a FAISS IndexFlatL2 index
-    Saves the index for retrieval
+    Builds a FAISS index (exact IndexFlatL2 or an approximate IVF-Flat / IVF-PQ / HNSW / OPQ index)
+    Builds scalar-quantized SQ8 / SQfp16 indexes directly from int8 / float16 embedding files
+    Saves the index together with its search-time parameters (nprobe, efSearch)
+    Reports recall@k on held-out queries against exact flat search, p50/p99 search latency and index size
+    Optionally writes per-parent_asin partitions (--partitions) and benchmarks product-scoped search
     Logs build metrics and artifacts using MLflow
 """
+import argparse
+import json
 import os
 import time
 import faiss
 import numpy as np
 import mlflow
 
+from src.filters import FilterSelection
+from src.index_params import (apply_search_params, filtered_search_parameters, index_version, save_search_params,
+                              search_params_path)
+from src.metadata_store import METADATA_STORE_DIR, MetadataStore, store_exists
+from src.partitions import PARTITION_DIR, PartitionedIndex, write_partitions
+from src.quantization import dequantize_int8, int8_to_sq8_codes, load_quant_params, to_float32
+
 EMBEDDING_FILE="data/embeddings/electronics_embeddings.npy"
 FAISS_DIR ="data/faiss"
 FAISS_INDEX_FILE=os.path.join(FAISS_DIR,"electronics.index")
+INDEX_REPORT_FILE=os.path.join(FAISS_DIR,"electronics_index_report.json")
+
+INDEX_TYPES=["flat","ivf_flat","ivf_pq","hnsw","opq","sq8","sqfp16"]
+#rows converted / added per step (add, add_sa_codes, exact search), keeps memory bounded
+ADD_BATCH=50000
+
+#defaults for the approximate index types
+DEFAULT_PQ_M=64          # PQ sub-quantizers (768-d / 64 = 12 dims each)
+DEFAULT_PQ_NBITS=8
+DEFAULT_HNSW_M=32
+DEFAULT_EF_CONSTRUCTION=200
+DEFAULT_EF_SEARCH=64
+DEFAULT_NPROBE=16
+DEFAULT_TRAIN_SIZE=100000
+DEFAULT_REPORT_QUERIES=500
+DEFAULT_REPORT_K=10
+SEED=42
 
 #  Load embeddings from a .npy file and return a contiguous float32 NumPy array.
+#  float16 files are upcast, int8 files are dequantized with their offset/scale file.
 def load_embeddings(path):
     emb=np.load(path)
 
     if emb.dtype != np.float32:
-        emb=emb.astype(np.float32)
+        emb=to_float32(emb,path)
 
     if not emb.flags['C_CONTIGUOUS']:
         emb=np.ascontiguousarray(emb)
 
     return emb
 
-def build_faiss_index(embeddings):
+class StoredEmbeddings:
+    """
+    float32 rows of an embeddings .npy file without loading it: the stored float32 / float16 / int8
+    matrix stays memory-mapped and only the indexed rows are converted (int8 dequantized with its offset/scale).
+    """
+
+    def __init__(self,path):
+        self.path=path
+        self.stored=np.load(path,mmap_mode="r")
+        self.shape=self.stored.shape
+        self.dtype=self.stored.dtype
+        self.quant_params=load_quant_params(path) if self.dtype==np.int8 else None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self,rows):
+        block=np.asarray(self.stored[rows])
+        if self.quant_params is not None:
+            return dequantize_int8(block,*self.quant_params)
+        return np.ascontiguousarray(block,dtype=np.float32)
+
+#contiguous float32 blocks of the embeddings (or of the given rows), with the position of their first row
+def float32_blocks(embeddings,rows=None,batch=ADD_BATCH):
+    n=embeddings.shape[0] if rows is None else len(rows)
+    for s in range(0,n,batch):
+        block=embeddings[s:s+batch] if rows is None else embeddings[rows[s:s+batch]]
+        yield s,np.ascontiguousarray(block,dtype=np.float32)
+
+#rule of thumb: ~4*sqrt(n) inverted lists
+def default_nlist(num_vectors):
+    return max(1,int(4*np.sqrt(num_vectors)))
+
+#faiss.index_factory description for each supported index type
+def index_factory_string(index_type,nlist,pq_m=DEFAULT_PQ_M,pq_nbits=DEFAULT_PQ_NBITS,hnsw_m=DEFAULT_HNSW_M):
+    if index_type=="flat":
+        return "Flat"
+    if index_type=="ivf_flat":
+        return f"IVF{nlist},Flat"
+    if index_type=="ivf_pq":
+        return f"IVF{nlist},PQ{pq_m}x{pq_nbits}"
+    if index_type=="hnsw":
+        return f"HNSW{hnsw_m},Flat"
+    if index_type=="opq":
+        return f"OPQ{pq_m},IVF{nlist},PQ{pq_m}x{pq_nbits}"
+    if index_type=="sq8":
+        return "SQ8"
+    if index_type=="sqfp16":
+        return "SQfp16"
+    raise ValueError(f"Unknown index type: {index_type} (expected one of {INDEX_TYPES})")
+
+#random subset of rows (of all rows, or of the given ones) used to train the quantizers
+def sample_training_vectors(embeddings,train_size,seed=SEED,rows=None):
+    n=embeddings.shape[0] if rows is None else len(rows)
+    if train_size>=n:
+        return np.ascontiguousarray(embeddings[0:n] if rows is None else embeddings[rows],dtype=np.float32)
+    rng=np.random.default_rng(seed)
+    picked=np.sort(rng.choice(n,size=train_size,replace=False))
+    return np.ascontiguousarray(embeddings[picked if rows is None else rows[picked]],dtype=np.float32)
+
+def build_faiss_index(embeddings,index_type="flat",nlist=None,train_size=DEFAULT_TRAIN_SIZE,
+                      pq_m=DEFAULT_PQ_M,pq_nbits=DEFAULT_PQ_NBITS,hnsw_m=DEFAULT_HNSW_M,
+                      ef_construction=DEFAULT_EF_CONSTRUCTION,rows=None):
 
     """
-    Build an IndexFlatL2 FAISS index and add embeddings.
+    Build a FAISS index of the requested type and add embeddings (all rows, or only the given ones).
+    embeddings can be a float32 array or a StoredEmbeddings file; rows are added ADD_BATCH at a time.
+    Trainable indexes are trained on a random sample of at most train_size vectors.
     Returns the index object.
     """
 
     dim=embeddings.shape[1]
-    index=faiss.IndexFlatL2(dim)
-    index.add(embeddings)
+    if nlist is None:
+        nlist=default_nlist(embeddings.shape[0] if rows is None else len(rows))
+
+    if index_type=="flat":
+        index=faiss.IndexFlatL2(dim)
+    else:
+        index=faiss.index_factory(dim,index_factory_string(index_type,nlist,pq_m,pq_nbits,hnsw_m),faiss.METRIC_L2)
+
+    if index_type=="hnsw":
+        index.hnsw.efConstruction=ef_construction
+
+    if not index.is_trained:
+        index.train(sample_training_vectors(embeddings,train_size,rows=rows))
+
+    for _,block in float32_blocks(embeddings,rows):
+        index.add(block)
+    return index
+
+def build_sq_index_from_codes(path,rows=None):
+    """
+    Build an SQ8 (int8 file) or SQfp16 (float16 file) index by appending the stored
+    codes (all rows, or only the given ones) directly, without decoding to float32 or retraining the quantizer.
+    """
+    stored=np.load(path,mmap_mode="r")
+    dim=stored.shape[1]
+
+    if stored.dtype==np.int8:
+        offset,scale=load_quant_params(path)
+        index=faiss.IndexScalarQuantizer(dim,faiss.ScalarQuantizer.QT_8bit,faiss.METRIC_L2)
+        # faiss SQ8 trained params: per-dim vmin followed by per-dim range
+        faiss.copy_array_to_vector(np.concatenate([offset,scale*255.0]).astype(np.float32),index.sq.trained)
+        index.is_trained=True
+        to_codes=int8_to_sq8_codes
+    elif stored.dtype==np.float16:
+        index=faiss.IndexScalarQuantizer(dim,faiss.ScalarQuantizer.QT_fp16,faiss.METRIC_L2)
+        to_codes=lambda block: np.ascontiguousarray(block).view(np.uint8)
+    else:
+        raise ValueError(f"SQ codes can only be read from int8/float16 files, got {stored.dtype}")
+
+    n=stored.shape[0] if rows is None else len(rows)
+    for s in range(0,n,ADD_BATCH):
+        block=stored[s:s+ADD_BATCH] if rows is None else stored[rows[s:s+ADD_BATCH]]
+        index.add_sa_codes(np.ascontiguousarray(to_codes(np.asarray(block))))
     return index
-    
+
+#stored dtype that each SQ index type can be filled from directly
+SQ_CODE_DTYPES={"sq8":np.int8,"sqfp16":np.float16}
+
+def stored_dtype(path):
+    return np.load(path,mmap_mode="r").dtype
+
+#search-time parameters persisted next to the index for the retriever
+def default_search_params(index_type,nprobe=DEFAULT_NPROBE,ef_search=DEFAULT_EF_SEARCH,embedding_dtype=None):
+    params={"index_type":index_type}
+    if embedding_dtype is not None:
+        params["embedding_dtype"]=embedding_dtype
+    if index_type in ("ivf_flat","ivf_pq","opq"):
+        params["nprobe"]=nprobe
+    if index_type=="hnsw":
+        params["efSearch"]=ef_search
+    return params
+
 def save_faiss_index(index,path):
     """
     Save the FAISS index to disk, ensuring the directory exists.
@@ -47,46 +199,228 @@ def save_faiss_index(index,path):
     os.makedirs(os.path.dirname(path),exist_ok=True)
     faiss.write_index(index,path)
 
+
+#single-query searches (the serving pattern); returns ids and per-query latencies in ms
+def timed_search(index,queries,k):
+    ids=np.empty((queries.shape[0],k),dtype=np.int64)
+    latencies=np.empty(queries.shape[0])
+    for i in range(queries.shape[0]):
+        t=time.perf_counter()
+        _,found=index.search(queries[i:i+1],k)
+        latencies[i]=(time.perf_counter()-t)*1000
+        ids[i]=found[0]
+    return ids,latencies
+
+#exact k nearest rows for each query, searched one float32 block at a time (no full flat index in memory);
+#ids are row numbers, or positions in rows when given
+def exact_search(embeddings,queries,k,rows=None):
+    best_dist=np.empty((queries.shape[0],0),dtype=np.float32)
+    best_ids=np.empty((queries.shape[0],0),dtype=np.int64)
+    for s,block in float32_blocks(embeddings,rows):
+        flat=faiss.IndexFlatL2(block.shape[1])
+        flat.add(block)
+        dist,ids=flat.search(queries,min(k,block.shape[0]))
+        best_dist=np.hstack([best_dist,dist])
+        best_ids=np.hstack([best_ids,ids+s])
+        order=np.argsort(best_dist,axis=1,kind="stable")[:,:k]
+        best_dist=np.take_along_axis(best_dist,order,axis=1)
+        best_ids=np.take_along_axis(best_ids,order,axis=1)
+    return best_ids
+
+def recall_at_k(approx_ids,exact_ids,k):
+    hits=sum(len(set(a[:k]) & set(e[:k])) for a,e in zip(approx_ids,exact_ids))
+    return hits/(len(exact_ids)*k)
+
+def index_size_bytes(index):
+    return int(faiss.serialize_index(index).size)
+
+def build_report(index,embeddings,index_type,build_index,num_queries=DEFAULT_REPORT_QUERIES,k=DEFAULT_REPORT_K,seed=SEED):
+    """
+    Compare the index type against exact flat search on held-out queries: query rows are sampled from the
+    corpus (at most half of it) and build_index(rows) builds a report index on the remaining rows only, so
+    neither search can return a query's own vector. Reports recall@k and p50/p99 latency of that report index,
+    and the serialized size of the full index.
+    """
+    n,dim=embeddings.shape
+    rng=np.random.default_rng(seed+1)
+    query_rows=np.sort(rng.choice(n,size=min(num_queries,n//2),replace=False))
+    base_rows=np.setdiff1d(np.arange(n),query_rows)
+    queries=np.ascontiguousarray(embeddings[query_rows],dtype=np.float32)
+
+    # ids of both searches are positions in base_rows
+    exact=exact_search(embeddings,queries,k,base_rows)
+    approx,lat=timed_search(build_index(base_rows),queries,k)
+
+    return {
+        "index_type":index_type,
+        "num_vectors":int(n),
+        "num_queries":int(len(query_rows)),
+        "k":k,
+        f"recall_at_{k}":recall_at_k(approx,exact,k),
+        "p50_search_ms":float(np.percentile(lat,50)),
+        "p99_search_ms":float(np.percentile(lat,99)),
+        "index_size_mb":index_size_bytes(index)/(1024*1024),
+        "flat_index_size_mb":n*dim*4/(1024*1024),
+    }
+
+def partition_report(index,partitions,num_queries=DEFAULT_REPORT_QUERIES,k=DEFAULT_REPORT_K,seed=SEED):
+    """
+    Latency of product-scoped queries (corpus rows searched within their own parent_asin):
+    the product's partition vs the global index, unfiltered and filtered to the product with an id selector.
+    """
+    rng=np.random.default_rng(seed+2)
+    rows=np.sort(rng.choice(len(partitions.ids),size=min(num_queries,len(partitions.ids)),replace=False))
+    part_lat=[]
+    global_lat=[]
+    filtered_lat=[]
+    block_rows=[]
+    for row in rows:
+        pos=int(np.searchsorted(partitions.offsets,row,side="right"))-1
+        start,end=int(partitions.offsets[pos]),int(partitions.offsets[pos+1])
+        asin=partitions.keys[pos].decode("utf-8")
+        query=np.ascontiguousarray(partitions.vectors[row:row+1],dtype=np.float32)
+        block_rows.append(end-start)
+
+        t=time.perf_counter()
+        partitions.search(query,k,[asin])
+        part_lat.append((time.perf_counter()-t)*1000)
+
+        t=time.perf_counter()
+        index.search(query,k)
+        global_lat.append((time.perf_counter()-t)*1000)
+
+        mask=np.zeros(index.ntotal,dtype=bool)
+        mask[partitions.ids[start:end]]=True
+        selection=FilterSelection(mask)
+        t=time.perf_counter()
+        params,_=filtered_search_parameters(index,selection.selector())
+        index.search(query,k,params=params)
+        filtered_lat.append((time.perf_counter()-t)*1000)
+
+    return {
+        "num_partitions":len(partitions),
+        "partition_queries":int(len(rows)),
+        "partition_mean_rows":float(np.mean(block_rows)),
+        "partition_p50_search_ms":float(np.percentile(part_lat,50)),
+        "partition_p99_search_ms":float(np.percentile(part_lat,99)),
+        "global_p50_search_ms":float(np.percentile(global_lat,50)),
+        "global_p99_search_ms":float(np.percentile(global_lat,99)),
+        "global_filtered_p50_search_ms":float(np.percentile(filtered_lat,50)),
+        "global_filtered_p99_search_ms":float(np.percentile(filtered_lat,99)),
+        "partition_speedup_p50":float(np.percentile(global_lat,50)/max(np.percentile(part_lat,50),1e-9)),
+    }
+
+
+def parse_args():
+    parser=argparse.ArgumentParser(description="Build the FAISS index")
+    parser.add_argument("--index-type",choices=INDEX_TYPES,default="flat")
+    parser.add_argument("--nlist",type=int,default=None,help="IVF lists (default 4*sqrt(n))")
+    parser.add_argument("--pq-m",type=int,default=DEFAULT_PQ_M)
+    parser.add_argument("--pq-nbits",type=int,default=DEFAULT_PQ_NBITS)
+    parser.add_argument("--hnsw-m",type=int,default=DEFAULT_HNSW_M)
+    parser.add_argument("--ef-construction",type=int,default=DEFAULT_EF_CONSTRUCTION)
+    parser.add_argument("--ef-search",type=int,default=DEFAULT_EF_SEARCH)
+    parser.add_argument("--nprobe",type=int,default=DEFAULT_NPROBE)
+    parser.add_argument("--train-size",type=int,default=DEFAULT_TRAIN_SIZE)
+    parser.add_argument("--report-queries",type=int,default=DEFAULT_REPORT_QUERIES,help="0 disables the recall/latency report")
+    parser.add_argument("--report-k",type=int,default=DEFAULT_REPORT_K)
+    parser.add_argument("--partitions",action="store_true",help="also write per-parent_asin partitions for product-scoped search")
+    return parser.parse_args()
+
+
 #load embeddings - build index - save index - track everything in MLflow.
 def main():
+    args=parse_args()
     with mlflow.start_run(run_name="faiss_index_build"):
-        mlflow.log_param("faiss_index_type","Index_Flat_L2")
+        mlflow.log_param("faiss_index_type",args.index_type)
         mlflow.log_param("embedding_file",EMBEDDING_FILE)
+        mlflow.log_param("train_size",args.train_size)
 
-        print("loading embeddings...")
+        dtype=stored_dtype(EMBEDDING_FILE)
+        mlflow.log_param("embedding_dtype",str(dtype))
+        mlflow.log_metric("embeddings_file_size_mb",os.path.getsize(EMBEDDING_FILE)/(1024*1024))
+
+        #stored codes stay memory-mapped; float32 is only produced block by block where a step needs it
+        print(f"opening embeddings ({dtype})...")
         t0=time.time()
-        emb=load_embeddings(EMBEDDING_FILE)
+        emb=StoredEmbeddings(EMBEDDING_FILE)
         load_time=time.time()-t0
-        print(f"Loaded embeddings shape: {emb.shape}")
+        print(f"Embeddings shape: {emb.shape}")
 
         num_vectors=int(emb.shape[0])
         embedding_dim=int(emb.shape[1])
+        nlist=args.nlist or default_nlist(num_vectors)
         mlflow.log_metric("num_vectors", num_vectors)
         mlflow.log_metric("embedding_dim", embedding_dim)
         mlflow.log_metric("embeddings_load_seconds", load_time)
-
-        print("Building FAISS index (IndexFlatL2)...")
+        if args.index_type!="flat":
+            mlflow.log_param("faiss_factory",index_factory_string(args.index_type,nlist,args.pq_m,args.pq_nbits,args.hnsw_m))
+
+        from_codes=SQ_CODE_DTYPES.get(args.index_type)==dtype
+        search_params=default_search_params(args.index_type,args.nprobe,args.ef_search,str(dtype))
+
+        #the served index (all rows) and, for the report, the same build on a subset of rows
+        def build_index(rows=None):
+            if from_codes:
+                index=build_sq_index_from_codes(EMBEDDING_FILE,rows)
+            else:
+                index=build_faiss_index(emb,args.index_type,nlist,args.train_size,args.pq_m,args.pq_nbits,
+                                        args.hnsw_m,args.ef_construction,rows)
+            return apply_search_params(index,search_params)
+
+        print(f"Building FAISS index ({args.index_type})...")
+        if from_codes:
+            print(f"Filling {args.index_type} directly from stored {dtype} codes")
         t1=time.time()
-        index=build_faiss_index(emb)
+        index=build_index()
         build_time=time.time()-t1
         mlflow.log_metric("index_build_seconds", build_time)
 
+        for name,value in search_params.items():
+            mlflow.log_param(f"search_{name}",value)
+
         print(f"Index trained: {num_vectors} vectors, dim={embedding_dim}")
         print("saving faiss index...")
 
         t2=time.time()
         save_faiss_index(index,FAISS_INDEX_FILE)
+        save_search_params(FAISS_INDEX_FILE,search_params)
         save_time=time.time()-t2
 
         #compute file size
-        index_size_bytes=os.path.getsize(FAISS_INDEX_FILE)
-        index_size_mb=index_size_bytes/(1024*1024)
+        file_size_bytes=os.path.getsize(FAISS_INDEX_FILE)
+        index_size_mb=file_size_bytes/(1024*1024)
         mlflow.log_metric("index_file_size_mb", index_size_mb)
         mlflow.log_metric("faiss_save_seconds", save_time)
 
 
         # Log the index file as an MLflow artifact
         mlflow.log_artifact(FAISS_INDEX_FILE)
+        mlflow.log_artifact(search_params_path(FAISS_INDEX_FILE))
+
+        if args.partitions:
+            if not store_exists(METADATA_STORE_DIR):
+                raise FileNotFoundError(f"--partitions needs the metadata store at {METADATA_STORE_DIR} (run the embedder first)")
+            print("Writing product partitions...")
+            num_partitions=write_partitions(emb,MetadataStore(METADATA_STORE_DIR).parent_asin_index(),PARTITION_DIR,
+                                            index_version(FAISS_INDEX_FILE))
+            mlflow.log_metric("num_partitions",num_partitions)
+            mlflow.log_metric("partitions_size_mb",sum(os.path.getsize(os.path.join(PARTITION_DIR,f)) for f in os.listdir(PARTITION_DIR))/(1024*1024))
+            print(f"Wrote {num_partitions} partitions → {PARTITION_DIR}")
+
+        if args.report_queries>0:
+            print("Measuring recall/latency against exact search (held-out queries, separate report index)...")
+            report=build_report(index,emb,args.index_type,build_index,args.report_queries,args.report_k)
+            if args.partitions:
+                print("Measuring product-scoped latency (partition vs global index)...")
+                report.update(partition_report(index,PartitionedIndex(PARTITION_DIR),args.report_queries,args.report_k))
+            for name,value in report.items():
+                if isinstance(value,(int,float)):
+                    mlflow.log_metric(f"report_{name}",value)
+            with open(INDEX_REPORT_FILE,"w") as f:
+                json.dump(report,f,indent=2)
+            mlflow.log_artifact(INDEX_REPORT_FILE)
+            print(json.dumps(report,indent=2))
 
         total_time=time.time()-t0
         mlflow.log_metric("total_time_seconds", total_time)
@@ -97,23 +431,3 @@ def main():
 
 if __name__=="__main__":
     main()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,208 @@
+"""
+Local stand-in for the LLM APIs the engines call, for load tests without API quota or a real model.
+    POST /v1/chat/completions   OpenAI chat completions (JSON, or SSE chunks + [DONE] with "stream": true)
+    POST /api/generate          Ollama generate (JSON, or one JSON object per line with "stream": true)
+    GET  /v1/models, /api/tags  what the clients probe; GET /stats counts served / failed / queued requests
+
+Latency model (per request): time to first token drawn from --distribution around --latency-ms, then
+--tokens tokens --token-ms apart (streamed as they are "generated"; a non-streaming response is sent
+after the last one). --max-concurrency generations run at once and the rest queue, like a local model;
+--error-rate answers with HTTP 500 instead. The answer cites the first [source:...] tag of the prompt.
+
+    python -m src.fake_llm_server --port 9001                                            # OpenAI stand-in
+    python -m src.fake_llm_server --port 11434 --latency-ms 3000 --max-concurrency 2      # Ollama stand-in
+Point the APIs at them with OPENAI_BASE_URL=http://127.0.0.1:9001/v1 OPENAI_API_KEY=fake and
+OLLAMA_URL=http://127.0.0.1:11434 (see load_test.py).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DISTRIBUTIONS=("fixed","uniform","lognormal","exponential")
+DEFAULT_LATENCY_MS=500.0
+DEFAULT_SIGMA=0.5
+DEFAULT_TOKEN_MS=15.0
+DEFAULT_TOKENS=60
+DEFAULT_MAX_CONCURRENCY=64
+SOURCE_RE=re.compile(r"\[source:[^\]]+\]")
+FILLER=("the reviews say it works well for most buyers although a few mention build quality issues and "
+        "battery life that is shorter than advertised").split()
+
+
+class LatencyModel:
+    """
+    Time to first token (ms) drawn around median_ms, then `tokens` tokens every token_ms.
+    uniform spreads +-sigma*median, lognormal uses sigma as the log-space spread,
+    exponential has mean median_ms.
+    """
+
+    def __init__(self,distribution="lognormal",median_ms=DEFAULT_LATENCY_MS,sigma=DEFAULT_SIGMA,
+                 token_ms=DEFAULT_TOKEN_MS,tokens=DEFAULT_TOKENS,error_rate=0.0,seed=None):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"unknown distribution: {distribution}")
+        self.distribution=distribution
+        self.median_ms=median_ms
+        self.sigma=sigma
+        self.token_ms=token_ms
+        self.tokens=tokens
+        self.error_rate=error_rate
+        self.rng=random.Random(seed)
+
+    def first_token_ms(self):
+        if self.distribution=="uniform":
+            return max(0.0,self.median_ms*self.rng.uniform(1-self.sigma,1+self.sigma))
+        if self.distribution=="lognormal":
+            return self.median_ms*self.rng.lognormvariate(0.0,self.sigma)
+        if self.distribution=="exponential":
+            return self.rng.expovariate(1/self.median_ms) if self.median_ms>0 else 0.0
+        return self.median_ms
+
+    def fails(self):
+        return self.rng.random()<self.error_rate
+
+
+def fake_answer(prompt,tokens):
+    source=SOURCE_RE.search(prompt or "")
+    words=[FILLER[i%len(FILLER)] for i in range(max(tokens-1,0))]
+    words.append(source.group(0) if source else "[source:unknown:unknown]")
+    return [w+" " for w in words[:-1]]+[words[-1]]
+
+
+#token generator of one request: waits for a generation slot, then paces tokens like a model would
+async def generate(state,prompt):
+    model=state["latency"]
+    state["queued"]+=1
+    async with state["slots"]:
+        state["queued"]-=1
+        await asyncio.sleep(model.first_token_ms()/1000)
+        for i,token in enumerate(fake_answer(prompt,model.tokens)):
+            if i:
+                await asyncio.sleep(model.token_ms/1000)
+            yield token
+
+
+def _openai_chunk(completion_id,model,created,delta,finish_reason=None):
+    return {"id":completion_id,"object":"chat.completion.chunk","created":created,"model":model,
+            "choices":[{"index":0,"delta":delta,"finish_reason":finish_reason}]}
+
+def _prompt_of(messages):
+    return "\n".join(m.get("content") or "" for m in messages or [])
+
+
+def create_app(latency=None,max_concurrency=DEFAULT_MAX_CONCURRENCY)->FastAPI:
+    app=FastAPI(title="Fake LLM server")
+    state={"latency":latency or LatencyModel(),"slots":asyncio.Semaphore(max_concurrency),
+           "served":0,"failed":0,"queued":0,"in_flight":0}
+
+    def failure(body):
+        state["failed"]+=1
+        return JSONResponse(status_code=500,content=body)
+
+    async def counted(tokens):
+        state["in_flight"]+=1
+        try:
+            async for token in tokens:
+                yield token
+            state["served"]+=1
+        finally:
+            state["in_flight"]-=1
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request:Request):
+        body=await request.json()
+        if state["latency"].fails():
+            return failure({"error":{"message":"injected failure","type":"server_error"}})
+        model=body.get("model","gpt-4o-mini")
+        completion_id=f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created=int(time.time())
+        tokens=counted(generate(state,_prompt_of(body.get("messages"))))
+
+        if body.get("stream"):
+            async def events():
+                yield f"data: {json.dumps(_openai_chunk(completion_id,model,created,{'role':'assistant','content':''}))}\n\n"
+                async for token in tokens:
+                    yield f"data: {json.dumps(_openai_chunk(completion_id,model,created,{'content':token}))}\n\n"
+                yield f"data: {json.dumps(_openai_chunk(completion_id,model,created,{},'stop'))}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(),media_type="text/event-stream")
+
+        text="".join([token async for token in tokens])
+        n=len(text.split())
+        return {"id":completion_id,"object":"chat.completion","created":created,"model":model,
+                "choices":[{"index":0,"message":{"role":"assistant","content":text},"finish_reason":"stop"}],
+                "usage":{"prompt_tokens":len(_prompt_of(body.get("messages")).split()),"completion_tokens":n,
+                         "total_tokens":len(_prompt_of(body.get("messages")).split())+n}}
+
+    @app.post("/api/generate")
+    async def ollama_generate(request:Request):
+        body=await request.json()
+        if state["latency"].fails():
+            return failure({"error":"injected failure"})
+        model=body.get("model","mistral")
+        start=time.perf_counter_ns()
+        tokens=counted(generate(state,body.get("prompt")))
+
+        def final(count):
+            return {"model":model,"created_at":time.strftime("%Y-%m-%dT%H:%M:%SZ",time.gmtime()),"response":"",
+                    "done":True,"done_reason":"stop","total_duration":time.perf_counter_ns()-start,"eval_count":count}
+
+        # Ollama streams by default
+        if body.get("stream",True):
+            async def lines():
+                count=0
+                async for token in tokens:
+                    count+=1
+                    yield json.dumps({"model":model,"created_at":time.strftime("%Y-%m-%dT%H:%M:%SZ",time.gmtime()),
+                                      "response":token,"done":False})+"\n"
+                yield json.dumps(final(count))+"\n"
+            return StreamingResponse(lines(),media_type="application/x-ndjson")
+
+        parts=[token async for token in tokens]
+        return {**final(len(parts)),"response":"".join(parts)}
+
+    @app.get("/v1/models")
+    def models():
+        return {"object":"list","data":[{"id":"gpt-4o-mini","object":"model","owned_by":"fake"}]}
+
+    @app.get("/api/tags")
+    def tags():
+        return {"models":[{"name":"mistral:latest","model":"mistral:latest"}]}
+
+    @app.get("/stats")
+    def stats():
+        return {k:v for k,v in state.items() if k not in ("latency","slots")}
+
+    return app
+
+
+def parse_args():
+    parser=argparse.ArgumentParser(description="Fake OpenAI / Ollama server with configurable latency")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,default=9001)
+    parser.add_argument("--distribution",choices=DISTRIBUTIONS,default="lognormal")
+    parser.add_argument("--latency-ms",type=float,default=DEFAULT_LATENCY_MS,help="median time to first token")
+    parser.add_argument("--sigma",type=float,default=DEFAULT_SIGMA,help="spread of the distribution")
+    parser.add_argument("--token-ms",type=float,default=DEFAULT_TOKEN_MS,help="time between tokens")
+    parser.add_argument("--tokens",type=int,default=DEFAULT_TOKENS,help="tokens per answer")
+    parser.add_argument("--error-rate",type=float,default=0.0)
+    parser.add_argument("--max-concurrency",type=int,default=DEFAULT_MAX_CONCURRENCY,help="generations at once")
+    parser.add_argument("--seed",type=int,default=None)
+    return parser.parse_args()
+
+def main():
+    import uvicorn
+    args=parse_args()
+    latency=LatencyModel(args.distribution,args.latency_ms,args.sigma,args.token_ms,args.tokens,args.error_rate,args.seed)
+    uvicorn.run(create_app(latency,args.max_concurrency),host=args.host,port=args.port,log_level="warning")
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Structured metadata filters for retrieval, e.g. {"verified_only": true, "max_rating": 2, "since": "2021"}.
+    Evaluated on the metadata store's numeric columns as numpy masks (no per-row dicts are decoded)
+    A parent_asin filter starts from the store's parent_asin -> ids index, so it only touches that product's rows
+    The result is handed to FAISS as an IDSelectorBitmap, so filtering happens inside the index search
+    and a filtered query still returns k hits whenever at least k rows match
+
+Supported keys:
+    verified_only   only verified purchases
+    min_rating      rating >= value
+    max_rating      rating <= value
+    since           timestamp >= value (inclusive)
+    until           timestamp < value (exclusive)
+    parent_asin     a single product id, or a list of them
+
+Dates may be epoch milliseconds (the dataset's unit), a year ("2021") or an ISO date ("2021-06-01").
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import faiss
+import numpy as np
+
+from src.metadata_store import COLUMN_DTYPE, MetadataStore, _encode_numeric, build_key_index, lookup_key_index
+
+FILTER_KEYS=("verified_only","min_rating","max_rating","since","until","parent_asin")
+#evaluated selections kept per process (repeated filters skip the column scan)
+SELECTION_CACHE_SIZE=32
+
+
+#epoch ms, a year or an ISO date -> epoch ms (UTC)
+def parse_timestamp(value):
+    if isinstance(value,(int,float)) and not isinstance(value,bool):
+        return int(value)
+    text=str(value).strip()
+    if text.isdigit() and len(text)>4:
+        return int(text)
+    if text.isdigit():
+        moment=datetime(int(text),1,1,tzinfo=timezone.utc)
+    else:
+        moment=datetime.fromisoformat(text)
+        if moment.tzinfo is None:
+            moment=moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp()*1000)
+
+def normalize_filters(filters):
+    """
+    Validate a filter dict and drop unset entries. Returns None when nothing is left to filter on.
+    Raises ValueError for unknown keys or unparseable values.
+    """
+    if not filters:
+        return None
+    unknown=set(filters)-set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {', '.join(sorted(unknown))}")
+
+    out={}
+    if filters.get("verified_only"):
+        out["verified_only"]=True
+    for key in ("min_rating","max_rating"):
+        if filters.get(key) is not None:
+            out[key]=float(filters[key])
+    for key in ("since","until"):
+        if filters.get(key) is not None:
+            out[key]=parse_timestamp(filters[key])
+    asins=filters.get("parent_asin")
+    if asins:
+        out["parent_asin"]=sorted({asins} if isinstance(asins,str) else set(asins))
+    return out or None
+
+#stable key for caches (e.g. the semantic answer cache namespace)
+def filters_key(filters):
+    filters=normalize_filters(filters)
+    return json.dumps(filters,sort_keys=True) if filters else ""
+
+
+class FilterSelection:
+    """
+    The rows allowed by one filter: a boolean mask over all FAISS ids plus the matching ids.
+    """
+
+    def __init__(self,mask):
+        self.mask=mask
+        self.ids=np.flatnonzero(mask)
+        self.count=len(self.ids)
+        # bit i of the bitmap = mask[i] (the layout faiss.IDSelectorBitmap reads)
+        self.bitmap=np.packbits(mask,bitorder="little")
+
+    #a new selector per search; it reads self.bitmap, which lives as long as this selection
+    def selector(self):
+        return faiss.IDSelectorBitmap(self.bitmap)
+
+    def contains(self,ids):
+        return self.mask[np.asarray(ids,dtype=np.int64)]
+
+
+class FilterColumns:
+    """
+    Filterable view of the chunk metadata: numeric columns and the parent_asin index.
+    Uses the store's memmapped arrays directly; a plain JSONL row list is converted once.
+    """
+
+    def __init__(self,metadata):
+        if isinstance(metadata,MetadataStore):
+            self.columns=metadata.columns
+            self._asin_index=metadata.parent_asin_index
+        else:
+            self.columns=np.array([_encode_numeric(row) for row in metadata],dtype=COLUMN_DTYPE)
+            index=build_key_index([row.get("parent_asin") for row in metadata])
+            self._asin_index=lambda:index
+        self.num_rows=len(self.columns)
+        self._verified=None
+        self._cache=OrderedDict()
+        self._lock=threading.Lock()
+
+    #precomputed bitmap of verified purchases (the most common filter)
+    def verified_mask(self):
+        if self._verified is None:
+            self._verified=np.asarray(self.columns["verified_purchase"])==1
+        return self._verified
+
+    def _row_mask(self,filters,rows=None):
+        columns=self.columns if rows is None else self.columns[rows]
+        mask=np.ones(len(columns),dtype=bool)
+        if filters.get("verified_only"):
+            mask&=self.verified_mask() if rows is None else self.verified_mask()[rows]
+        # NaN ratings / missing (-1) timestamps never satisfy a bound
+        if "min_rating" in filters:
+            mask&=np.asarray(columns["rating"])>=filters["min_rating"]
+        if "max_rating" in filters:
+            mask&=np.asarray(columns["rating"])<=filters["max_rating"]
+        if "since" in filters or "until" in filters:
+            timestamps=np.asarray(columns["timestamp"])
+            mask&=timestamps!=-1
+            if "since" in filters:
+                mask&=timestamps>=filters["since"]
+            if "until" in filters:
+                mask&=timestamps<filters["until"]
+        return mask
+
+    def _evaluate(self,filters):
+        if "parent_asin" in filters:
+            rows=np.unique(np.concatenate(
+                [lookup_key_index(self._asin_index(),asin) for asin in filters["parent_asin"]]
+            )).astype(np.int64)
+            mask=np.zeros(self.num_rows,dtype=bool)
+            mask[rows[self._row_mask(filters,rows)]]=True
+            return FilterSelection(mask)
+        return FilterSelection(self._row_mask(filters))
+
+    def select(self,filters):
+        """
+        Evaluate (normalized) filters -> FilterSelection. Recently used selections are cached.
+        """
+        key=json.dumps(filters,sort_keys=True)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        selection=self._evaluate(filters)
+        with self._lock:
+            self._cache[key]=selection
+            while len(self._cache)>SELECTION_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return selection
@@ -0,0 +1,261 @@
+"""
+One async RAG generation pipeline for every LLM backend.
+    retrieval (+ optional rerank) on the executor -> budgeted context -> completion through an LLMRouter
+    (llm_router.py), which picks the backend per request and fails over / hedges between backends
+
+The APIs keep one GenerationService per process so the router's latency statistics span requests;
+the engines' *_async functions wrap a single-backend service for scripts.
+"""
+
+import asyncio
+import time
+from typing import Dict, List
+
+from src.batching import DEFAULT_MAX_CONCURRENCY
+from src.context_builder import build_context
+from src.filters import filters_key
+from src.metrics import record_request_metrics
+from src.reranker import candidate_count
+from src.retriever import WARMUP_QUERY, get_default_retriever
+from src.tracing import annotate, record_span, run_in_executor, span
+
+DEFAULT_K=5
+SYSTEM_INSTRUCTIONS = (
+    "You are an assistant that answers product questions using ONLY the provided context.\n"
+    "Cite sources inline like [source:ASIN:chunk_id].\n"
+    "If the answer is not supported by the context, respond: \"I don't know based on the provided information.\"\n"
+    "Do NOT guess product names unless they appear in the context.\n"
+    "Keep answers short and factual. "
+    "Provide a short answer and then list sources used."
+)
+NO_ANSWER="I don't know based on the provided information."
+
+
+#Assembling the final prompt string that is passed to the LLM
+def build_prompt(question:str,context:str,system_instructions:str=SYSTEM_INSTRUCTIONS)->str:
+    header="Use the following retrieved review excerpts as factual context:\n\n"
+    prompt=f"{system_instructions}\n\n{header}{context}\n\nQuestion: {question}\nAnswer concisely and cite sources."
+    return prompt
+
+#source entries returned with every answer
+def build_sources(retrieved:List[Dict],distances)->List[Dict]:
+    sources=[]
+    for i,r in enumerate(retrieved):
+        source={"asin":r.get("asin"),
+                "chunk_id":r.get("chunk_id"),
+                "product_name": r.get("product_name"),
+                "distance":float(distances[i])}
+        if "rerank_score" in r:
+            source["rerank_score"]=r["rerank_score"]
+        sources.append(source)
+    return sources
+
+#prompt builder for the router: the context is packed to the budget of whichever model answers
+#(built once per model)
+def prompt_factory(question,retrieved):
+    prompts={}
+    def make_prompt(model):
+        if model not in prompts:
+            with span("context",model=model):
+                context=build_context(retrieved,model)
+            with span("prompt",model=model):
+                prompts[model]=build_prompt(question,context)
+                annotate(prompt_chars=len(prompts[model]))
+        return prompts[model]
+    return make_prompt
+
+
+class GenerationService:
+    """
+    Retrieval + generation over an LLMRouter. Request metrics go to the in-memory aggregates of
+    metrics.py (flushed to MLflow in the background); log_metrics=None turns recording off.
+    """
+
+    def __init__(self,router,retriever=None,executor=None,cache=None,reranker=None,log_metrics=record_request_metrics):
+        self.router=router
+        self.retriever=retriever
+        self.executor=executor
+        self.cache=cache
+        self.reranker=reranker
+        self.log_metrics=log_metrics
+
+    def _retriever(self):
+        return self.retriever if self.retriever is not None else get_default_retriever()
+
+    def _log(self,params,metrics):
+        if self.log_metrics is not None:
+            self.log_metrics(params,metrics)
+
+    def _namespace(self,k,filters):
+        namespace=f"{self.router.name}:k={k}:{filters_key(filters)}"
+        if self.reranker is not None:
+            namespace+=f":rerank={self.reranker.model_name}"
+        return namespace
+
+    #answer dict; "timings" carries this request's stage times in ms (retrieval, rerank, LLM, total)
+    async def answer(self,question:str,k=DEFAULT_K,filters=None)->Dict:
+        retriever=self._retriever()
+        reranker=self.reranker
+        loop=asyncio.get_running_loop()
+        params={"llm_model":self.router.name,"top_k":k}
+
+        total_start_time=time.time()
+        retrieval_start=time.time()
+        query_vector=await run_in_executor(loop,self.executor,retriever.embed_query,question)
+        # products named in the question become a parent_asin filter, so they are part of the cache key
+        filters,_=retriever.product_scope(question,filters)
+        namespace=self._namespace(k,filters)
+        if self.cache is not None:
+            with span("cache_lookup"):
+                cached=self.cache.lookup(query_vector,namespace,retriever.index_version)
+            if cached is not None:
+                metrics={"semantic_cache_hit":1,"total_response_time_ms":(time.time()-total_start_time)*1000}
+                self._log(params,metrics)
+                return {**cached,"question":question,"cached":True,"timings":metrics}
+        with span("retrieve"):
+            retrieved,distances,ids=await run_in_executor(loop,self.executor,retriever.retrieve_vector,query_vector,
+                                                          candidate_count(k,reranker),question,None,filters)
+        metrics={"retrieval_time_ms":(time.time()-retrieval_start)*1000}
+        if reranker is not None and retrieved:
+            with span("rerank",candidates=len(retrieved)):
+                retrieved,distances,ids,rerank_info=await run_in_executor(loop,self.executor,reranker.rerank,
+                                                                          question,retrieved,distances,ids,k)
+            metrics.update(rerank_info)
+        if self.cache is not None:
+            metrics["semantic_cache_hit"]=0
+
+        if not retrieved:
+            metrics["total_response_time_ms"]=(time.time()-total_start_time)*1000
+            self._log(params,metrics)
+            return {"question":question,"answer":NO_ANSWER,"sources":[],"prompt":"","timings":metrics}
+
+        make_prompt=prompt_factory(question,retrieved)
+        llm_start=time.time()
+        answer,llm_info=await self.router.complete(make_prompt)
+        metrics["llm_inference_time_ms"]=(time.time()-llm_start)*1000
+        metrics["llm_attempts"]=llm_info["llm_attempts"]
+        metrics["llm_hedged"]=llm_info["hedged"]
+        metrics["total_response_time_ms"]=(time.time()-total_start_time)*1000
+        params.update(llm_model=llm_info["llm_model"],llm_backend=llm_info["llm_backend"])
+        self._log(params,metrics)
+
+        result={"question":question,"answer":answer,"sources":build_sources(retrieved,distances),
+                "prompt":make_prompt(llm_info["llm_model"]),"llm_backend":llm_info["llm_backend"]}
+        if self.cache is not None:
+            with span("cache_store"):
+                self.cache.store(query_vector,namespace,retriever.index_version,result,[r.get("chunk_id") for r in retrieved])
+        return {**result,"timings":metrics}
+
+    #one batched retrieval on the executor, then at most max_concurrency completions in flight
+    #(each backend additionally enforces its own limit). Results keep the order of `questions`;
+    #a failed item carries an "error" instead of an answer.
+    async def answer_many(self,questions:List[str],k=DEFAULT_K,filters=None,
+                          max_concurrency=DEFAULT_MAX_CONCURRENCY)->List[Dict]:
+        retriever=self._retriever()
+        reranker=self.reranker
+        loop=asyncio.get_running_loop()
+        params={"llm_model":self.router.name,"top_k":k,"batch_size":len(questions)}
+
+        total_start_time=time.time()
+        retrieval_start=time.time()
+        with span("retrieve",batch=len(questions)):
+            batch=await run_in_executor(loop,self.executor,retriever.retrieve_many,questions,candidate_count(k,reranker),filters)
+        metrics={"retrieval_time_ms":(time.time()-retrieval_start)*1000}
+        if reranker is not None:
+            with span("rerank",batch=len(questions)):
+                batch,rerank_info=await run_in_executor(loop,self.executor,reranker.rerank_many,questions,batch,k)
+            metrics.update(rerank_info)
+
+        semaphore=asyncio.Semaphore(max_concurrency)
+
+        async def answer_one(question,retrieved,distances):
+            if not retrieved:
+                return {"question":question,"answer":NO_ANSWER,"sources":[],"prompt":""}
+            make_prompt=prompt_factory(question,retrieved)
+            async with semaphore:
+                answer,llm_info=await self.router.complete(make_prompt)
+            return {"question":question,"answer":answer,"sources":build_sources(retrieved,distances),
+                    "prompt":make_prompt(llm_info["llm_model"]),"llm_backend":llm_info["llm_backend"]}
+
+        llm_start=time.time()
+        outcomes=await asyncio.gather(*(answer_one(q,r,d) for q,(r,d,_) in zip(questions,batch)),return_exceptions=True)
+        metrics["llm_inference_time_ms"]=(time.time()-llm_start)*1000
+
+        results=[]
+        for question,value in zip(questions,outcomes):
+            results.append({"question":question,"error":f"{type(value).__name__}: {value}"} if isinstance(value,Exception) else value)
+        metrics["batch_errors"]=sum(1 for value in outcomes if isinstance(value,Exception))
+        metrics["total_response_time_ms"]=(time.time()-total_start_time)*1000
+        self._log(params,metrics)
+        return results
+
+    #async generator of (event, data) pairs: "sources" first, then one "token" event per LLM chunk,
+    #then "done" with timings (time_to_first_token_ms is logged next to llm_inference_time_ms)
+    async def stream(self,question:str,k=DEFAULT_K,filters=None):
+        retriever=self._retriever()
+        reranker=self.reranker
+        loop=asyncio.get_running_loop()
+        params={"llm_model":self.router.name,"top_k":k,"stream":True}
+
+        total_start_time=time.time()
+        retrieval_start=time.time()
+        with span("retrieve"):
+            retrieved,distances,ids=await run_in_executor(loop,self.executor,retriever.retrieve,question,candidate_count(k,reranker),filters)
+        metrics={"retrieval_time_ms":(time.time()-retrieval_start)*1000}
+        if reranker is not None and retrieved:
+            with span("rerank",candidates=len(retrieved)):
+                retrieved,distances,ids,rerank_info=await run_in_executor(loop,self.executor,reranker.rerank,
+                                                                          question,retrieved,distances,ids,k)
+            metrics.update(rerank_info)
+        yield "sources",{"question":question,"sources":build_sources(retrieved,distances)}
+
+        if not retrieved:
+            yield "token",{"text":NO_ANSWER}
+            metrics["total_response_time_ms"]=(time.time()-total_start_time)*1000
+            self._log(params,metrics)
+            yield "done",metrics
+            return
+
+        llm_info={}
+        llm_start=time.time()
+        llm_span_start=time.perf_counter()
+        try:
+            async for token in self.router.stream(prompt_factory(question,retrieved),llm_info):
+                if "time_to_first_token_ms" not in metrics:
+                    metrics["time_to_first_token_ms"]=(time.time()-llm_start)*1000
+                    record_span("llm_first_token",llm_span_start)
+                yield "token",{"text":token}
+        except Exception as e:
+            yield "error",{"error":f"{type(e).__name__}: {e}"}
+        finally:
+            record_span("llm",llm_span_start,backend=llm_info.get("llm_backend"),model=llm_info.get("llm_model"))
+            metrics["llm_inference_time_ms"]=(time.time()-llm_start)*1000
+            metrics["llm_attempts"]=llm_info.get("llm_attempts",0)
+            metrics["total_response_time_ms"]=(time.time()-total_start_time)*1000
+            if llm_info.get("llm_model"):
+                params.update(llm_model=llm_info["llm_model"],llm_backend=llm_info["llm_backend"])
+            self._log(params,metrics)
+        yield "done",{**metrics,"llm_backend":llm_info.get("llm_backend")}
+
+    def warm_up(self,question=WARMUP_QUERY):
+        """
+        Run the request path once up to the prompt (no LLM call, no metrics): encoder, index, metadata,
+        reranker and the context tokenizers of every backend's model -> ms per step.
+        Blocking; the API runs it on the executor before reporting ready.
+        """
+        retrieved,timings=self._retriever().warm_up(question)
+        if self.reranker is not None and retrieved:
+            start=time.perf_counter()
+            self.reranker.warm_up([(question,r.get("chunk_text") or "") for r in retrieved])
+            timings["reranker_warm_ms"]=(time.perf_counter()-start)*1000
+        start=time.perf_counter()
+        for model in dict.fromkeys(s.backend.model for s in self.router.states):
+            build_prompt(question,build_context(retrieved,model))
+        timings["context_warm_ms"]=(time.perf_counter()-start)*1000
+        return timings
+
+    def stats(self):
+        return self.router.stats()
+
+    async def aclose(self):
+        await self.router.aclose()
@@ -0,0 +1,282 @@
+"""
+Random access into a .jsonl.gz dump (e.g. electronics_full.jsonl.gz) without decompressing from the start.
+    A one-time pass writes an index next to the file (<file>.index/):
+        records.npy  uncompressed byte offset of every RECORD_STRIDE-th record (line)
+        seek points where decompression can restart:
+            zran.idx     with the optional indexed_gzip package: zlib checkpoints (32 KB window
+                         every CHECKPOINT_SPACING uncompressed bytes), works for any gzip file
+            members.npy  otherwise: (compressed, uncompressed) offset of every gzip member; a
+                         single-member file then only restarts at 0, so rewrite it once with
+                         `rechunk` (a multi-member .gz that gzip/zcat still read as one file)
+        meta.json    record count, stride, mode and the size of the indexed file
+    Reading records [start, stop) restarts at the closest seek point before the record's offset
+    and decompresses at most one stride / checkpoint interval it does not return
+
+    python -m src.gzip_index build data/raw/electronics_full.jsonl.gz
+    python -m src.gzip_index read data/raw/electronics_full.jsonl.gz --start 1000000 --stop 1000010
+    python -m src.gzip_index rechunk data/raw/electronics_full.jsonl.gz data/raw/electronics_full.blocked.jsonl.gz
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import zlib
+
+import numpy as np
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip=None
+
+RECORD_STRIDE=1000
+CHECKPOINT_SPACING=4*1024*1024
+READ_SIZE=1024*1024
+#uncompressed bytes per gzip member written by rechunk
+RECHUNK_MEMBER_BYTES=4*1024*1024
+RECHUNK_LEVEL=6
+
+
+def index_dir(path):
+    return path+".index"
+
+def index_exists(path):
+    meta_path=os.path.join(index_dir(path),"meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path,"r") as f:
+        return json.load(f).get("file_size")==os.path.getsize(path)
+
+
+class _RecordOffsets:
+    """
+    Collects the uncompressed offset of every stride-th line while the decompressed stream goes by.
+    """
+
+    def __init__(self,stride):
+        self.stride=stride
+        self.offsets=[0]
+        self.lines=0
+        self.position=0
+        self.last_byte=b"\n"
+
+    def feed(self,data):
+        if not data:
+            return
+        newlines=np.flatnonzero(np.frombuffer(data,dtype=np.uint8)==10)
+        # record number starting right after each newline
+        starts=np.arange(self.lines+1,self.lines+1+len(newlines))
+        hit=starts%self.stride==0
+        self.offsets.extend((self.position+newlines[hit]+1).tolist())
+        self.lines+=len(newlines)
+        self.position+=len(data)
+        self.last_byte=data[-1:]
+
+    #(record count, offsets) once the stream ended; an unterminated last line is a record too
+    def finish(self):
+        num_records=self.lines+(self.last_byte!=b"\n")
+        offsets=[o for o in self.offsets if o<self.position or o==0]
+        return num_records,np.asarray(offsets[:(num_records+self.stride-1)//self.stride] or [0],dtype=np.int64)
+
+
+#decompress a (multi-member) gzip file, feeding the output to `sink`; returns the member seek points
+def _scan_members(path,sink):
+    members=[(0,0)]
+    compressed=0
+    uncompressed=0
+    decompressor=zlib.decompressobj(31)
+    with open(path,"rb") as f:
+        while True:
+            data=f.read(READ_SIZE)
+            if not data:
+                break
+            while data:
+                out=decompressor.decompress(data)
+                sink.feed(out)
+                uncompressed+=len(out)
+                if not decompressor.eof:
+                    compressed+=len(data)
+                    break
+                compressed+=len(data)-len(decompressor.unused_data)
+                data=decompressor.unused_data
+                decompressor=zlib.decompressobj(31)
+                members.append((compressed,uncompressed))
+    # the last "member" starts at the end of the file
+    while len(members)>1 and members[-1][0]>=compressed:
+        members.pop()
+    return np.asarray(members,dtype=np.int64)
+
+
+def build_index(path,stride=RECORD_STRIDE,spacing=CHECKPOINT_SPACING):
+    """
+    Write <path>.index (one sequential decompression). Returns the meta dict.
+    """
+    out_dir=index_dir(path)
+    os.makedirs(out_dir,exist_ok=True)
+    offsets=_RecordOffsets(stride)
+    if indexed_gzip is not None:
+        mode="zran"
+        with indexed_gzip.IndexedGzipFile(path,spacing=spacing) as f:
+            while True:
+                data=f.read(READ_SIZE)
+                if not data:
+                    break
+                offsets.feed(data)
+            f.export_index(os.path.join(out_dir,"zran.idx"))
+        num_seek_points=None
+    else:
+        mode="members"
+        members=_scan_members(path,offsets)
+        np.save(os.path.join(out_dir,"members.npy"),members)
+        num_seek_points=len(members)
+        if len(members)==1 and offsets.position>CHECKPOINT_SPACING:
+            print(f"{path} is a single gzip member: reads restart at the beginning "
+                  f"(install indexed_gzip, or rewrite the file with `rechunk`)")
+    num_records,record_offsets=offsets.finish()
+    np.save(os.path.join(out_dir,"records.npy"),record_offsets)
+    meta={"num_records":int(num_records),"stride":stride,"mode":mode,"num_seek_points":num_seek_points,
+          "uncompressed_size":int(offsets.position),"file_size":os.path.getsize(path)}
+    with open(os.path.join(out_dir,"meta.json"),"w") as f:
+        json.dump(meta,f)
+    return meta
+
+
+class GzipRecordReader:
+    """
+    Reads record (line) ranges of an indexed .jsonl.gz. Lines are returned as bytes.
+    """
+
+    def __init__(self,path):
+        self.path=path
+        out_dir=index_dir(path)
+        with open(os.path.join(out_dir,"meta.json"),"r") as f:
+            self.meta=json.load(f)
+        if self.meta["file_size"]!=os.path.getsize(path):
+            raise ValueError(f"{out_dir} was built for another version of {path}; rebuild it")
+        self.stride=self.meta["stride"]
+        self.record_offsets=np.load(os.path.join(out_dir,"records.npy"))
+        if self.meta["mode"]=="zran":
+            if indexed_gzip is None:
+                raise RuntimeError("index was built with indexed_gzip, which is not installed")
+            self.zran_file=os.path.join(out_dir,"zran.idx")
+        else:
+            self.members=np.load(os.path.join(out_dir,"members.npy"))
+
+    def __len__(self):
+        return self.meta["num_records"]
+
+    #decompressed stream positioned at uncompressed byte `offset`, plus the raw file under it (None for zran)
+    #for the caller to close: GzipFile does not close a file object it was given
+    def _open_at(self,offset):
+        if self.meta["mode"]=="zran":
+            f=indexed_gzip.IndexedGzipFile(self.path,index_file=self.zran_file)
+            f.seek(offset)
+            return f,None
+        member=int(np.searchsorted(self.members[:,1],offset,side="right"))-1
+        raw=open(self.path,"rb")
+        try:
+            raw.seek(int(self.members[member,0]))
+            f=gzip.GzipFile(fileobj=raw,mode="rb")
+            skip=offset-int(self.members[member,1])
+            while skip>0:
+                skip-=len(f.read(min(skip,READ_SIZE)))
+        except BaseException:
+            raw.close()
+            raise
+        return f,raw
+
+    def read_range(self,start,stop=None):
+        """
+        Yield records start..stop-1 (stop=None: to the end).
+        """
+        stop=len(self) if stop is None else min(stop,len(self))
+        if start>=stop:
+            return
+        block=start//self.stride
+        f,raw=self._open_at(int(self.record_offsets[block]))
+        try:
+            for _ in range(start-block*self.stride):
+                f.readline()
+            for _ in range(stop-start):
+                line=f.readline()
+                if not line:
+                    break
+                yield line
+        finally:
+            f.close()
+            if raw is not None:
+                raw.close()
+
+    #records with the given numbers, in ascending order (one restart per stride block touched)
+    def read_records(self,record_numbers):
+        record_numbers=sorted(set(int(r) for r in record_numbers))
+        pos=0
+        while pos<len(record_numbers):
+            block=record_numbers[pos]//self.stride
+            end=pos
+            while end<len(record_numbers) and record_numbers[end]//self.stride==block:
+                end+=1
+            first=record_numbers[pos]
+            wanted=set(record_numbers[pos:end])
+            for number,line in enumerate(self.read_range(first,record_numbers[end-1]+1),start=first):
+                if number in wanted:
+                    yield number,line
+            pos=end
+
+
+def rechunk(src,dst,member_bytes=RECHUNK_MEMBER_BYTES,level=RECHUNK_LEVEL):
+    """
+    Rewrite a gzip file as independent gzip members of ~member_bytes, split at line ends.
+    Returns the number of members.
+    """
+    members=0
+    with gzip.open(src,"rb") as fin, open(dst,"wb") as fout:
+        block=[]
+        size=0
+        for line in fin:
+            block.append(line)
+            size+=len(line)
+            if size>=member_bytes:
+                fout.write(gzip.compress(b"".join(block),compresslevel=level))
+                members+=1
+                block,size=[],0
+        if block:
+            fout.write(gzip.compress(b"".join(block),compresslevel=level))
+            members+=1
+    return members
+
+
+def parse_args():
+    parser=argparse.ArgumentParser(description="Record index / random access for .jsonl.gz files")
+    sub=parser.add_subparsers(dest="command",required=True)
+    build=sub.add_parser("build")
+    build.add_argument("path")
+    build.add_argument("--stride",type=int,default=RECORD_STRIDE)
+    build.add_argument("--spacing",type=int,default=CHECKPOINT_SPACING,help="bytes between zran checkpoints")
+    read=sub.add_parser("read")
+    read.add_argument("path")
+    read.add_argument("--start",type=int,default=0)
+    read.add_argument("--stop",type=int,default=None)
+    re_chunk=sub.add_parser("rechunk")
+    re_chunk.add_argument("src")
+    re_chunk.add_argument("dst")
+    re_chunk.add_argument("--member-bytes",type=int,default=RECHUNK_MEMBER_BYTES)
+    return parser.parse_args()
+
+def main():
+    args=parse_args()
+    if args.command=="build":
+        meta=build_index(args.path,args.stride,args.spacing)
+        print(f"Indexed {meta['num_records']} records ({meta['mode']}) → {index_dir(args.path)}")
+    elif args.command=="read":
+        for line in GzipRecordReader(args.path).read_range(args.start,args.stop):
+            sys.stdout.buffer.write(line)
+    else:
+        members=rechunk(args.src,args.dst,args.member_bytes)
+        print(f"Wrote {members} gzip members → {args.dst}")
+
+
+if __name__=="__main__":
+    main()
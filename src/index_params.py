@@ -0,0 +1,59 @@
+"""
+Search-time settings that belong to a built FAISS index (nprobe, efSearch, ...).
+    faiss_builder writes them next to the index file
+    the retriever reads them back and applies them right after loading the index
+"""
+
+import json
+import os
+
+import faiss
+
+
+#data/faiss/electronics.index -> data/faiss/electronics.params.json
+def search_params_path(index_path):
+    return os.path.splitext(index_path)[0]+".params.json"
+
+def save_search_params(index_path,params):
+    with open(search_params_path(index_path),"w") as f:
+        json.dump(params,f,indent=2)
+
+#returns {} for indexes built before params were persisted (plain IndexFlatL2)
+def load_search_params(index_path):
+    path=search_params_path(index_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path,"r") as f:
+        return json.load(f)
+
+#identifies one build of the index file; cached answers are only valid for the version they were made with
+def index_version(index_path):
+    st=os.stat(index_path)
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+#apply nprobe / efSearch through faiss.ParameterSpace so wrapped indexes (OPQ, IDMap) work too
+def apply_search_params(index,params):
+    space=faiss.ParameterSpace()
+    for name in ("nprobe","efSearch"):
+        if params.get(name) is not None:
+            space.set_index_parameter(index,name,params[name])
+    return index
+
+def filtered_search_parameters(index,selector,widen=1):
+    """
+    faiss.SearchParameters carrying an id selector, keeping the index's own nprobe / efSearch
+    (times `widen`, used to retry a filtered search that came back short).
+    Returns (params, exhaustive): exhaustive is True when widening further cannot find more hits.
+    """
+    try:
+        ivf=faiss.extract_index_ivf(index)
+    except RuntimeError:
+        ivf=None
+    if ivf is not None:
+        nprobe=min(ivf.nprobe*widen,ivf.nlist)
+        return faiss.SearchParametersIVF(sel=selector,nprobe=nprobe),nprobe>=ivf.nlist
+    hnsw=getattr(faiss.downcast_index(index),"hnsw",None)
+    if hnsw is not None:
+        ef_search=min(hnsw.efSearch*widen,index.ntotal)
+        return faiss.SearchParametersHNSW(sel=selector,efSearch=ef_search),ef_search>=index.ntotal
+    return faiss.SearchParameters(sel=selector),True
@@ -0,0 +1,228 @@
+"""
+Streaming ingestion: raw reviews + product metadata -> chunk file, in one pass.
+    merge (product name) -> clean -> chunk are fused per review (dataset_merge.add_product_name,
+    preprocess.clean_review, chunker.chunk_document), so no intermediate JSONL is written
+    The reader hands batches of raw lines to a process pool (parse, merge, clean, chunk, serialise),
+    with at most MAX_PENDING_PER_WORKER batches per worker in flight, and writes the results back
+    in input order, so the output is identical for any number of workers
+    Product titles are read the same way (batched, in the pool) before the reviews, with the
+    join modes of dataset_merge.py (--join): by default only titles of ASINs the reviews mention
+    are kept, and with very many of those the titles go to SQLite and each worker looks up its batch
+    orjson is used for parsing/serialising when it is installed, json otherwise
+
+Reviews may be plain or gzipped JSONL (e.g. the full Electronics dump); --limit takes the first N
+reviews like extract_50k.py. The output is the chunk file the embedder reads (chunker.OUTPUT).
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from src.chunker import OUTPUT as CHUNK_FILE, chunk_document
+from src.dataset_merge import (JOIN_MODES, MAX_REFERENCED_ASINS, TITLE_DB, SqliteTitles, add_product_name,
+                               review_asins, title_entry, titles_for)
+from src.preprocess import clean_review
+
+try:
+    import orjson
+except ImportError:
+    orjson=None
+
+REVIEWS_FILE="data/raw/electronics_full.jsonl.gz"
+METADATA_FILE="data/raw/meta_Electronics.jsonl"
+#raw lines per task sent to a worker
+DEFAULT_BATCH_LINES=2000
+MAX_PENDING_PER_WORKER=4
+
+#worker state (set by _init_worker): product titles (a dict, or the path of a SqliteTitles db,
+#opened on first use in each worker) and the ASINs whose titles are kept while loading them
+_titles={}
+_wanted=None
+
+
+def loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+#one JSONL record as bytes (non-ASCII kept as UTF-8, like the chunker's ensure_ascii=False)
+def dumps_line(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)+b"\n"
+    return (json.dumps(obj,ensure_ascii=False)+"\n").encode("utf-8")
+
+def open_lines(path):
+    return gzip.open(path,"rb") if path.endswith(".gz") else open(path,"rb")
+
+def line_batches(lines,batch_lines):
+    lines=iter(lines)
+    while True:
+        batch=list(itertools.islice(lines,batch_lines))
+        if not batch:
+            return
+        yield batch
+
+
+#like executor.map, but submits lazily (at most max_pending tasks ahead of the consumer)
+def ordered_map(executor,fn,items,max_pending):
+    pending=deque()
+    for item in items:
+        pending.append(executor.submit(fn,item))
+        if len(pending)>=max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _asin_batch(lines):
+    asins=set()
+    for line in lines:
+        if line.strip():
+            asins.update(review_asins(loads(line)))
+    return asins
+
+def _title_batch(lines):
+    entries=[]
+    for line in lines:
+        if line.strip():
+            entry=title_entry(loads(line))
+            if entry and (_wanted is None or entry[0] in _wanted):
+                entries.append(entry)
+    return entries
+
+def _init_worker(titles=None,wanted=None):
+    global _titles,_wanted
+    _titles=titles
+    _wanted=wanted
+
+def _worker_titles():
+    global _titles
+    if isinstance(_titles,str):
+        _titles=SqliteTitles(_titles)
+    return _titles
+
+#merge + clean + chunk one batch of raw review lines -> (serialised chunks, reviews, kept, chunks)
+def _ingest_batch(lines):
+    reviews=[loads(line) for line in lines if line.strip()]
+    titles=titles_for(_worker_titles(),reviews)
+    out=[]
+    kept=chunks=0
+    for review in reviews:
+        cleaned=clean_review(add_product_name(review,titles))
+        if cleaned is None:
+            continue
+        kept+=1
+        for chunk in chunk_document(cleaned):
+            out.append(dumps_line(chunk))
+            chunks+=1
+    return b"".join(out),len(reviews),kept,chunks
+
+
+def _pool(workers,initargs=()):
+    # fork shares the titles / ASIN set with the workers without pickling them
+    method="fork" if "fork" in mp.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers,mp_context=mp.get_context(method),
+                               initializer=_init_worker,initargs=initargs)
+
+def _run(fn,batches,workers,initargs=()):
+    if workers<=1:
+        _init_worker(*initargs)
+        yield from map(fn,batches)
+        return
+    with _pool(workers,initargs) as pool:
+        yield from ordered_map(pool,fn,batches,workers*MAX_PENDING_PER_WORKER)
+
+
+#ASINs mentioned by the (first `limit`) reviews; None once there are more than max_asins
+def referenced_asins(reviews_file=REVIEWS_FILE,workers=1,batch_lines=DEFAULT_BATCH_LINES,limit=None,max_asins=None):
+    wanted=set()
+    with open_lines(reviews_file) as f:
+        lines=itertools.islice(f,limit) if limit else f
+        for asins in _run(_asin_batch,line_batches(lines,batch_lines),workers):
+            wanted|=asins
+            if max_asins is not None and len(wanted)>max_asins:
+                return None
+    return wanted
+
+def load_titles(metadata_file=METADATA_FILE,reviews_file=REVIEWS_FILE,join="auto",workers=1,
+                batch_lines=DEFAULT_BATCH_LINES,limit=None,db_path=TITLE_DB):
+    """
+    Product titles for the join mode (see dataset_merge.py): a dict, or the path of the SQLite title table.
+    """
+    if join not in JOIN_MODES:
+        raise ValueError(f"unknown join mode: {join}")
+    wanted=None
+    if join in ("auto","referenced"):
+        wanted=referenced_asins(reviews_file,workers,batch_lines,limit,MAX_REFERENCED_ASINS if join=="auto" else None)
+        if wanted is None:
+            print(f"reviews mention more than {MAX_REFERENCED_ASINS} ASINs; joining through SQLite")
+    with open_lines(metadata_file) as f:
+        batches=_run(_title_batch,line_batches(f,batch_lines),workers,(None,wanted))
+        if join=="all" or wanted is not None:
+            titles={}
+            for entries in batches:
+                titles.update(entries)
+            return titles
+        SqliteTitles.build(itertools.chain.from_iterable(batches),db_path).close()
+        return db_path
+
+def ingest(reviews_file=REVIEWS_FILE,metadata_file=METADATA_FILE,output_file=CHUNK_FILE,
+           workers=1,batch_lines=DEFAULT_BATCH_LINES,limit=None,join="auto"):
+    """
+    Write the chunk file for (the first `limit`) reviews; returns counts and timings.
+    The output is written to a temporary file and renamed when complete.
+    """
+    start=time.time()
+    titles=load_titles(metadata_file,reviews_file,join,workers,batch_lines,limit)
+    titles_seconds=time.time()-start
+
+    Path(output_file).parent.mkdir(parents=True,exist_ok=True)
+    tmp_file=output_file+".tmp"
+    stats={"reviews":0,"kept_reviews":0,"chunks":0}
+    with open_lines(reviews_file) as fin, open(tmp_file,"wb") as fout:
+        lines=itertools.islice(fin,limit) if limit else fin
+        for blob,reviews,kept,chunks in _run(_ingest_batch,line_batches(lines,batch_lines),workers,(titles,)):
+            fout.write(blob)
+            stats["reviews"]+=reviews
+            stats["kept_reviews"]+=kept
+            stats["chunks"]+=chunks
+    os.replace(tmp_file,output_file)
+
+    elapsed=time.time()-start
+    stats.update(products=len(titles) if isinstance(titles,dict) else None,join=join,titles_seconds=titles_seconds,total_seconds=elapsed,
+                 reviews_per_second=stats["reviews"]/max(elapsed-titles_seconds,1e-9))
+    return stats
+
+
+def parse_args():
+    parser=argparse.ArgumentParser(description="Merge, clean and chunk raw reviews into the chunk file")
+    parser.add_argument("--reviews",default=REVIEWS_FILE,help="raw reviews JSONL (optionally .gz)")
+    parser.add_argument("--metadata",default=METADATA_FILE,help="product metadata JSONL (optionally .gz)")
+    parser.add_argument("--output",default=CHUNK_FILE)
+    parser.add_argument("--workers",type=int,default=os.cpu_count() or 1,help="processes (1 = run in this process)")
+    parser.add_argument("--batch-lines",type=int,default=DEFAULT_BATCH_LINES)
+    parser.add_argument("--limit",type=int,default=None,help="only the first N reviews")
+    parser.add_argument("--join",choices=JOIN_MODES,default="auto",help="product title join (see dataset_merge.py)")
+    return parser.parse_args()
+
+def main():
+    args=parse_args()
+    print(f"JSON codec: {'orjson' if orjson is not None else 'json'}, workers: {args.workers}")
+    stats=ingest(args.reviews,args.metadata,args.output,args.workers,args.batch_lines,args.limit,args.join)
+    if stats["products"] is None:
+        print(f"Product titles in SQLite ({stats['titles_seconds']:.1f}s)")
+    else:
+        print(f"Products with titles: {stats['products']} ({stats['titles_seconds']:.1f}s)")
+    print(f"Reviews processed: {stats['reviews']}, kept: {stats['kept_reviews']}")
+    print(f"Chunks created: {stats['chunks']}")
+    print(f"Done in {stats['total_seconds']:.1f}s ({stats['reviews_per_second']:.0f} reviews/s)")
+    print(f"Saved → {args.output}")
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+BM25 lexical index over chunk_text + product_name, used next to FAISS for hybrid retrieval.
+    Built by bm25_builder.py, stored as flat numpy arrays (no Python dicts of postings)
+    Opened with mmap, so only the postings of the query terms are touched
+
+Index layout (a directory):
+    vocab.npy          sorted fixed-width bytes array of terms (term id = position, looked up with searchsorted)
+    term_offsets.npy   int64, postings of term t are [term_offsets[t], term_offsets[t+1])
+    postings_docs.npy  int32 doc ids (= FAISS ids), sorted by term then doc
+    postings_tf.npy    uint16 term frequencies, parallel to postings_docs
+    doc_len.npy        int32 number of tokens per doc
+    meta.json          num_docs, avgdl, k1, b, index_version (of the FAISS index the doc ids refer to)
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+LEXICAL_INDEX_DIR="data/lexical/electronics_bm25"
+
+BM25_K1=1.2
+BM25_B=0.75
+#longer tokens are dropped (keeps the fixed-width vocab array small)
+MAX_TOKEN_LEN=32
+
+TOKEN_RE=re.compile(r"[a-z0-9]+(?:[-_/.][a-z0-9]+)*")
+STOPWORDS=frozenset(
+    "a an and are as at be but by for from has have i in is it its of on or so that the this "
+    "to was were will with my me you your they them we our not no do does did can just very".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercased alphanumeric tokens. Compound tokens such as model numbers ("wh-1000xm4")
+    also emit their parts and the joined form ("wh", "1000xm4", "wh1000xm4").
+    """
+    tokens=[]
+    for match in TOKEN_RE.findall((text or "").lower()):
+        parts=re.split(r"[-_/.]",match)
+        if len(parts)>1:
+            tokens.extend(p for p in parts if p and p not in STOPWORDS)
+            tokens.append("".join(parts))
+        elif match not in STOPWORDS:
+            tokens.append(match)
+    return [t for t in tokens if len(t)<=MAX_TOKEN_LEN]
+
+#text indexed for one metadata row
+def document_text(row):
+    return f"{row.get('product_name') or ''} {row.get('chunk_text') or ''}"
+
+
+#doc ids are FAISS ids, so the postings are only used next to the index build (and row count) they were made for
+def lexical_index_exists(path=LEXICAL_INDEX_DIR,index_version=None,num_docs=None):
+    meta_path=os.path.join(path,"meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    if index_version is None and num_docs is None:
+        return True
+    with open(meta_path,"r") as f:
+        meta=json.load(f)
+    if index_version is not None and meta.get("index_version")!=index_version:
+        return False
+    return num_docs is None or meta.get("num_docs")==num_docs
+
+
+class LexicalIndex:
+    """
+    Read-only BM25 index over memory-mapped postings arrays.
+    """
+
+    def __init__(self,path=LEXICAL_INDEX_DIR):
+        self.path=path
+        with open(os.path.join(path,"meta.json"),"r") as f:
+            self.meta=json.load(f)
+        self.vocab=np.load(os.path.join(path,"vocab.npy"),mmap_mode="r")
+        self.term_offsets=np.load(os.path.join(path,"term_offsets.npy"),mmap_mode="r")
+        self.postings_docs=np.load(os.path.join(path,"postings_docs.npy"),mmap_mode="r")
+        self.postings_tf=np.load(os.path.join(path,"postings_tf.npy"),mmap_mode="r")
+        self.doc_len=np.load(os.path.join(path,"doc_len.npy"),mmap_mode="r")
+
+        self.num_docs=int(self.meta["num_docs"])
+        self.avgdl=float(self.meta["avgdl"])
+        self.k1=float(self.meta.get("k1",BM25_K1))
+        self.b=float(self.meta.get("b",BM25_B))
+
+    #term ids for the query tokens that exist in the vocabulary
+    def term_ids(self,tokens):
+        if not tokens:
+            return np.zeros(0,dtype=np.int64)
+        tokens=np.array(sorted({t.encode("ascii") for t in tokens}))
+        pos=np.searchsorted(self.vocab,tokens)
+        pos=np.minimum(pos,len(self.vocab)-1)
+        return pos[self.vocab[pos]==tokens]
+
+    def search(self,query,k=10,allowed=None):
+        """
+        BM25 top-k for a query string -> (scores, doc ids), best first.
+        `allowed` is an optional boolean mask over doc ids (metadata filters); other docs are skipped.
+        """
+        doc_parts=[]
+        score_parts=[]
+        for t in self.term_ids(tokenize(query)):
+            start,end=int(self.term_offsets[t]),int(self.term_offsets[t+1])
+            docs=np.asarray(self.postings_docs[start:end])
+            tf=np.asarray(self.postings_tf[start:end],dtype=np.float32)
+            df=end-start
+            idf=np.log(1.0+(self.num_docs-df+0.5)/(df+0.5))
+            norm=self.k1*(1.0-self.b+self.b*np.asarray(self.doc_len[docs],dtype=np.float32)/self.avgdl)
+            doc_parts.append(docs)
+            score_parts.append(idf*tf*(self.k1+1.0)/(tf+norm))
+
+        if not doc_parts:
+            return np.zeros(0,dtype=np.float32),np.zeros(0,dtype=np.int64)
+
+        docs=np.concatenate(doc_parts)
+        scores=np.concatenate(score_parts)
+        unique_docs,inverse=np.unique(docs,return_inverse=True)
+        totals=np.bincount(inverse,weights=scores).astype(np.float32)
+        if allowed is not None:
+            keep=allowed[unique_docs]
+            unique_docs,totals=unique_docs[keep],totals[keep]
+            if len(unique_docs)==0:
+                return np.zeros(0,dtype=np.float32),np.zeros(0,dtype=np.int64)
+
+        k=min(k,len(unique_docs))
+        top=np.argpartition(-totals,k-1)[:k]
+        top=top[np.argsort(-totals[top])]
+        return totals[top],unique_docs[top].astype(np.int64)
+
+
+def reciprocal_rank_fusion(rankings,k,rrf_k=60):
+    """
+    Fuse several ranked id lists: score(d) = sum over lists of 1/(rrf_k + rank).
+    Returns (fused scores, ids) for the top k, best first.
+    """
+    fused={}
+    for ids in rankings:
+        for rank,id_ in enumerate(ids):
+            id_=int(id_)
+            fused[id_]=fused.get(id_,0.0)+1.0/(rrf_k+rank+1)
+    best=sorted(fused.items(),key=lambda item:-item[1])[:k]
+    return np.array([s for _,s in best],dtype=np.float32),np.array([i for i,_ in best],dtype=np.int64)
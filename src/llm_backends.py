@@ -0,0 +1,238 @@
+"""
+Pluggable LLM backends for the generation service (see generation.py).
+    A backend has a name, a model (which picks the context tokenizer/budget), a concurrency limit,
+    a latency prior (used for routing until real samples exist), an async `complete(prompt)`
+    and an async-generator `stream(prompt)`
+    OpenAIBackend wraps a shared AsyncOpenAI client, OllamaBackend a shared keep-alive httpx client
+    FakeBackend answers locally with configurable latency / errors, for tests and load experiments
+
+The client helpers (create_openai_client, call_llm_openai_async, ...) are also used directly by the engines.
+"""
+
+import asyncio
+import json
+import os
+import random
+
+import httpx
+
+MODEL_NAME = "gpt-4o-mini"
+MAX_RESPONSE_TOKENS = 512
+OPENAI_TIMEOUT_SECONDS = 60
+OPENAI_MAX_CONCURRENCY = 32
+#expected completion latency before any request has been measured
+OPENAI_EXPECTED_LATENCY_MS = 2000
+
+OLLAMA_MODEL = "mistral"
+#OLLAMA_URL overrides it (e.g. a fake_llm_server.py instance); the OpenAI SDK reads OPENAI_BASE_URL itself
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_TIMEOUT_SECONDS = 120
+OLLAMA_MAX_CONNECTIONS = 32
+#a local model serves few generations at once; more just queue inside Ollama
+OLLAMA_MAX_CONCURRENCY = 4
+OLLAMA_EXPECTED_LATENCY_MS = 8000
+
+
+#shared async OpenAI client (create once per process, e.g. in the API lifespan hook);
+#it keeps a pooled keep-alive HTTP connection pool internally
+def create_openai_client():
+    from openai import AsyncOpenAI
+    api_key=os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY not set in env")
+    return AsyncOpenAI(api_key=api_key,timeout=OPENAI_TIMEOUT_SECONDS)
+
+#blocking OpenAI client for the sync engine path (thread-safe, pooled connections; create once and share)
+def create_openai_sync_client():
+    from openai import OpenAI
+    api_key=os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY not set in env")
+    return OpenAI(api_key=api_key,timeout=OPENAI_TIMEOUT_SECONDS)
+
+def _openai_messages(prompt):
+    return [
+        {"role":"system","content":"You are a helpful assistant"},
+        {"role":"user","content":prompt}
+    ]
+
+def call_llm_openai_sync(prompt:str,client,model=MODEL_NAME)->str:
+    response=client.chat.completions.create(
+        model=model,
+        messages=_openai_messages(prompt),
+        temperature=0,
+        max_tokens=MAX_RESPONSE_TOKENS
+        )
+    return response.choices[0].message.content.strip()
+
+#calling llm without blocking the event loop
+async def call_llm_openai_async(prompt:str,client,model=MODEL_NAME)->str:
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY not set in env")
+    response=await client.chat.completions.create(
+        model=model,
+        messages=_openai_messages(prompt),
+        temperature=0,
+        max_tokens=MAX_RESPONSE_TOKENS
+        )
+    return response.choices[0].message.content.strip()
+
+#stream completion tokens from the async OpenAI client
+async def stream_llm_openai(prompt:str,client,model=MODEL_NAME):
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY not set in env")
+    stream=await client.chat.completions.create(
+        model=model,
+        messages=_openai_messages(prompt),
+        temperature=0,
+        max_tokens=MAX_RESPONSE_TOKENS,
+        stream=True
+        )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+#shared keep-alive client for Ollama (create once per process, e.g. in the API lifespan hook).
+#pool=None: requests wait for a free connection instead of failing when all are busy
+def create_ollama_client(max_connections=OLLAMA_MAX_CONNECTIONS,base_url=OLLAMA_URL)->httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        timeout=httpx.Timeout(OLLAMA_TIMEOUT_SECONDS,connect=5.0,pool=None),
+        limits=httpx.Limits(max_connections=max_connections,max_keepalive_connections=max_connections),
+    )
+
+#calling ollama llm without blocking the event loop
+async def call_llm_ollama_async(prompt:str,client:httpx.AsyncClient,model=OLLAMA_MODEL)->str:
+    response=await client.post("/api/generate",json={"model": model,"prompt": prompt,"stream": False})
+    response.raise_for_status()
+    return response.json()["response"].strip()
+
+#stream tokens from Ollama ("stream": true returns one JSON object per line)
+async def stream_llm_ollama(prompt:str,client:httpx.AsyncClient,model=OLLAMA_MODEL):
+    async with client.stream("POST","/api/generate",json={"model": model,"prompt": prompt,"stream": True}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            part=json.loads(line)
+            if part.get("response"):
+                yield part["response"]
+            if part.get("done"):
+                break
+
+
+class LLMBackend:
+    """
+    Interface of a generation backend. Subclasses implement complete() and stream().
+    timeout_seconds is the hard upper bound; the router tightens it from observed latency.
+    """
+
+    name="backend"
+
+    def __init__(self,model,max_concurrency=4,timeout_seconds=60,expected_latency_ms=1000.0):
+        self.model=model
+        self.max_concurrency=max_concurrency
+        self.timeout_seconds=timeout_seconds
+        self.expected_latency_ms=expected_latency_ms
+
+    async def complete(self,prompt:str)->str:
+        raise NotImplementedError
+
+    async def stream(self,prompt:str):
+        raise NotImplementedError
+        yield
+
+    async def aclose(self):
+        pass
+
+
+#client=None (no API key) is accepted: every call then fails and the router moves on
+class OpenAIBackend(LLMBackend):
+    name="openai"
+
+    def __init__(self,client=None,model=MODEL_NAME,max_concurrency=OPENAI_MAX_CONCURRENCY,
+                 timeout_seconds=OPENAI_TIMEOUT_SECONDS,expected_latency_ms=OPENAI_EXPECTED_LATENCY_MS):
+        super().__init__(model,max_concurrency,timeout_seconds,expected_latency_ms)
+        self.client=client
+
+    async def complete(self,prompt):
+        return await call_llm_openai_async(prompt,self.client,model=self.model)
+
+    async def stream(self,prompt):
+        async for token in stream_llm_openai(prompt,self.client,model=self.model):
+            yield token
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.close()
+
+
+class OllamaBackend(LLMBackend):
+    name="ollama"
+
+    def __init__(self,client=None,model=OLLAMA_MODEL,max_concurrency=OLLAMA_MAX_CONCURRENCY,
+                 timeout_seconds=OLLAMA_TIMEOUT_SECONDS,expected_latency_ms=OLLAMA_EXPECTED_LATENCY_MS):
+        super().__init__(model,max_concurrency,timeout_seconds,expected_latency_ms)
+        self.client=client if client is not None else create_ollama_client()
+
+    async def complete(self,prompt):
+        return await call_llm_ollama_async(prompt,self.client,model=self.model)
+
+    async def stream(self,prompt):
+        async for token in stream_llm_ollama(prompt,self.client,model=self.model):
+            yield token
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class FakeBackend(LLMBackend):
+    """
+    In-process backend for tests: sleeps latency_ms (+ uniform jitter), fails with probability error_rate,
+    and answers with `answer` split into tokens when streaming.
+    """
+
+    def __init__(self,name="fake",model=MODEL_NAME,latency_ms=50.0,jitter_ms=0.0,error_rate=0.0,
+                 answer="fake answer",max_concurrency=8,timeout_seconds=30,seed=None):
+        super().__init__(model,max_concurrency,timeout_seconds,expected_latency_ms=latency_ms)
+        self.name=name
+        self.latency_ms=latency_ms
+        self.jitter_ms=jitter_ms
+        self.error_rate=error_rate
+        self.answer=answer
+        self.calls=0
+        self._rng=random.Random(seed)
+
+    async def _wait(self):
+        self.calls+=1
+        await asyncio.sleep((self.latency_ms+self._rng.uniform(0,self.jitter_ms))/1000)
+        if self._rng.random()<self.error_rate:
+            raise RuntimeError(f"{self.name}: injected failure")
+
+    async def complete(self,prompt):
+        await self._wait()
+        return self.answer
+
+    async def stream(self,prompt):
+        await self._wait()
+        for token in self.answer.split(" "):
+            yield token+" "
+
+
+#backends by name ("openai", "ollama"), in the given (routing preference) order
+def create_backends(names):
+    backends=[]
+    for name in names:
+        if name=="openai":
+            try:
+                client=create_openai_client()
+            except RuntimeError:
+                # missing OPENAI_API_KEY: keep the backend so requests report the error
+                client=None
+            backends.append(OpenAIBackend(client))
+        elif name=="ollama":
+            backends.append(OllamaBackend(create_ollama_client()))
+        else:
+            raise ValueError(f"unknown LLM backend: {name}")
+    return backends
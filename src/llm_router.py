@@ -0,0 +1,256 @@
+"""
+Latency-aware routing over several LLM backends (see llm_backends.py).
+    Each backend keeps a rolling window of completion latencies and outcomes
+    A request goes to the healthy backend with the lowest rolling p50 (its latency prior until
+    MIN_LATENCY_SAMPLES exist); backends at their concurrency limit rank after free ones
+    A failed or timed-out call fails over to the next backend in that order
+    EJECT_AFTER_ERRORS consecutive errors take a backend out of rotation for EJECT_COOLDOWN_SECONDS
+    (it is still tried as a last resort when every other backend failed)
+    Per-call timeout follows live latency: TIMEOUT_P99_MULTIPLIER x rolling p99, between
+    MIN_TIMEOUT_SECONDS and the backend's own timeout_seconds
+    With hedge=True, a completion still running after its backend's p95 gets a second request
+    (next backend with a free slot, or the same one when it is the only backend); the first answer wins
+
+Streams are routed the same way but never hedged, and fail over only before the first token.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+from src.tracing import annotate, span
+
+LATENCY_WINDOW=200
+MIN_LATENCY_SAMPLES=20
+EJECT_AFTER_ERRORS=3
+EJECT_COOLDOWN_SECONDS=30
+TIMEOUT_P99_MULTIPLIER=3
+MIN_TIMEOUT_SECONDS=10
+
+
+class LLMUnavailableError(RuntimeError):
+    pass
+
+
+class BackendState:
+    """
+    Rolling latency/error statistics, health and concurrency limit of one backend.
+    """
+
+    def __init__(self,backend,window=LATENCY_WINDOW):
+        self.backend=backend
+        self.latencies=deque(maxlen=window)
+        self.outcomes=deque(maxlen=window)
+        self.semaphore=asyncio.Semaphore(backend.max_concurrency)
+        self.in_flight=0
+        self.consecutive_errors=0
+        self.ejected_until=0.0
+
+    def percentile(self,q):
+        if len(self.latencies)<MIN_LATENCY_SAMPLES:
+            return None
+        return float(np.percentile(self.latencies,q))
+
+    def expected_ms(self):
+        p50=self.percentile(50)
+        return self.backend.expected_latency_ms if p50 is None else p50
+
+    def healthy(self,now=None):
+        return (time.monotonic() if now is None else now)>=self.ejected_until
+
+    def saturated(self):
+        return self.in_flight>=self.backend.max_concurrency
+
+    #seconds allowed for one call
+    def timeout(self):
+        p99=self.percentile(99)
+        if p99 is None:
+            return self.backend.timeout_seconds
+        return min(self.backend.timeout_seconds,max(MIN_TIMEOUT_SECONDS,TIMEOUT_P99_MULTIPLIER*p99/1000))
+
+    def record_success(self,latency_ms):
+        self.latencies.append(latency_ms)
+        self.outcomes.append(True)
+        self.consecutive_errors=0
+        self.ejected_until=0.0
+
+    def record_error(self):
+        self.outcomes.append(False)
+        self.consecutive_errors+=1
+        if self.consecutive_errors>=EJECT_AFTER_ERRORS:
+            self.ejected_until=time.monotonic()+EJECT_COOLDOWN_SECONDS
+
+    def stats(self):
+        return {
+            "backend":self.backend.name,
+            "model":self.backend.model,
+            "healthy":self.healthy(),
+            "in_flight":self.in_flight,
+            "max_concurrency":self.backend.max_concurrency,
+            "samples":len(self.latencies),
+            "p50_ms":self.percentile(50),
+            "p95_ms":self.percentile(95),
+            "p99_ms":self.percentile(99),
+            "error_rate":(self.outcomes.count(False)/len(self.outcomes)) if self.outcomes else 0.0,
+            "timeout_s":self.timeout(),
+        }
+
+
+class LLMRouter:
+    """
+    Routes completions over a list of backends (given in preference order, which breaks ties).
+    complete()/stream() take make_prompt(model) -> prompt, because the context budget depends
+    on the model that ends up answering (it is called again for every attempt, so it should cache).
+    """
+
+    def __init__(self,backends,hedge=False,window=LATENCY_WINDOW):
+        self.states=[BackendState(b,window) for b in backends]
+        self.hedge=hedge
+        self.hedges=0
+        self.hedge_wins=0
+
+    #cache namespace / metrics label: the models that can answer
+    @property
+    def name(self):
+        return "+".join(dict.fromkeys(s.backend.model for s in self.states))
+
+    #routing order: healthy backends (free before saturated, then fastest), then ejected ones
+    def ranked(self):
+        now=time.monotonic()
+        order={id(s):i for i,s in enumerate(self.states)}
+        healthy=[s for s in self.states if s.healthy(now)]
+        ejected=[s for s in self.states if not s.healthy(now)]
+        healthy.sort(key=lambda s:(s.saturated(),s.expected_ms(),order[id(s)]))
+        ejected.sort(key=lambda s:s.ejected_until)
+        return healthy+ejected
+
+    async def _call(self,state,prompt):
+        state.in_flight+=1
+        try:
+            with span("llm",backend=state.backend.name,model=state.backend.model):
+                queued=time.perf_counter()
+                async with state.semaphore:
+                    start=time.perf_counter()
+                    annotate(queue_ms=round((start-queued)*1000,3))
+                    try:
+                        text=await asyncio.wait_for(state.backend.complete(prompt),state.timeout())
+                    except Exception:
+                        state.record_error()
+                        raise
+                    state.record_success((time.perf_counter()-start)*1000)
+                    return text
+        finally:
+            state.in_flight-=1
+
+    #where a hedge for `primary` goes: another backend with a free slot, else primary itself if it is alone
+    def _hedge_target(self,primary,queue):
+        for state in queue:
+            if state is not primary and state.healthy() and not state.saturated():
+                return state
+        if len(self.states)==1 and not primary.saturated():
+            return primary
+        return None
+
+    async def complete(self,make_prompt):
+        """
+        Returns (text, info) where info has llm_backend, llm_model, llm_attempts and hedged.
+        Raises LLMUnavailableError when every backend failed.
+        """
+        queue=self.ranked()
+        if not queue:
+            raise LLMUnavailableError("no LLM backends configured")
+        info={"llm_backend":None,"llm_model":None,"llm_attempts":0,"hedged":0}
+        pending={}
+        errors=[]
+
+        def launch(state,hedge=False):
+            if state in queue:
+                queue.remove(state)
+            info["llm_attempts"]+=1
+            pending[asyncio.ensure_future(self._call(state,make_prompt(state.backend.model)))]=(state,hedge)
+
+        primary=queue[0]
+        launch(primary)
+        p95=primary.percentile(95)
+        hedge_at=time.monotonic()+p95/1000 if self.hedge and p95 is not None else None
+        try:
+            while pending:
+                wait=None
+                if hedge_at is not None and not info["hedged"]:
+                    wait=max(0.0,hedge_at-time.monotonic())
+                done,_=await asyncio.wait(pending,timeout=wait,return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # slower than the backend's p95: send a second request, keep the first running
+                    target=self._hedge_target(primary,queue)
+                    info["hedged"]=1
+                    if target is not None:
+                        self.hedges+=1
+                        launch(target,hedge=True)
+                    continue
+                for task in done:
+                    state,hedge=pending.pop(task)
+                    if task.exception() is None:
+                        if hedge:
+                            self.hedge_wins+=1
+                        info["llm_backend"]=state.backend.name
+                        info["llm_model"]=state.backend.model
+                        return task.result(),info
+                    e=task.exception()
+                    errors.append(f"{state.backend.name}: {type(e).__name__}: {e}")
+                if not pending and queue:
+                    launch(queue[0])
+            raise LLMUnavailableError("all LLM backends failed ("+"; ".join(errors)+")")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self,make_prompt,info):
+        """
+        Async generator of tokens from the first backend that produces one; `info` is filled
+        with llm_backend, llm_model and llm_attempts. Raises LLMUnavailableError when none does.
+        """
+        info.update({"llm_backend":None,"llm_model":None,"llm_attempts":0})
+        errors=[]
+        for state in self.ranked():
+            model=state.backend.model
+            info["llm_attempts"]+=1
+            state.in_flight+=1
+            try:
+                async with state.semaphore:
+                    start=time.perf_counter()
+                    tokens=state.backend.stream(make_prompt(model))
+                    try:
+                        first=await asyncio.wait_for(tokens.__anext__(),state.timeout())
+                    except StopAsyncIteration:
+                        first=None
+                    except Exception as e:
+                        state.record_error()
+                        errors.append(f"{state.backend.name}: {type(e).__name__}: {e}")
+                        await tokens.aclose()
+                        continue
+                    info["llm_backend"]=state.backend.name
+                    info["llm_model"]=model
+                    try:
+                        if first is not None:
+                            yield first
+                            async for token in tokens:
+                                yield token
+                    except Exception:
+                        state.record_error()
+                        raise
+                    state.record_success((time.perf_counter()-start)*1000)
+                    return
+            finally:
+                state.in_flight-=1
+        raise LLMUnavailableError("all LLM backends failed ("+"; ".join(errors)+")" if errors
+                                  else "no LLM backends configured")
+
+    def stats(self):
+        return {"hedge":self.hedge,"hedges":self.hedges,"hedge_wins":self.hedge_wins,
+                "backends":[s.stats() for s in self.states]}
+
+    async def aclose(self):
+        for state in self.states:
+            await state.backend.aclose()
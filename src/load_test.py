@@ -0,0 +1,362 @@
+"""
+HTTP load driver for the FastAPI apps (api.py / api_ollama.py).
+    Replays a question mix (--questions: one question per line, or JSONL with "question" and optional
+    "weight" / "filters") at a target rate: open-loop arrivals (--arrival poisson|constant at --rps), so a
+    slow server builds a queue instead of slowing the driver down; at most --max-in-flight requests are
+    outstanding, arrivals beyond that are shed and counted
+    --mix splits requests over /ask, /ask/stream and /ask/batch (e.g. ask=0.7,stream=0.3)
+    Reports achieved throughput, latency percentiles per endpoint (time to first token for streams),
+    error rates by kind, and where the time went: the server's own stage timings (retrieval, rerank,
+    LLM, first token; from /ask "timings" and the stream's "done" event) and the part of the client-side
+    latency spent outside the handler (queueing, network, serialisation). The /backends snapshot
+    taken at the end is included, and so is the app's startup report from /health (time of each
+    warm-up step, first request latency) with, under --launch, how long the app took to become ready.
+
+Everything runs on one box against fake_llm_server.py:
+    python -m src.fake_llm_server --port 9001 &
+    python -m src.fake_llm_server --port 9002 --latency-ms 3000 --max-concurrency 2 &
+    OPENAI_BASE_URL=http://127.0.0.1:9001/v1 OPENAI_API_KEY=fake OLLAMA_URL=http://127.0.0.1:9002 \\
+        uvicorn src.api:app --port 8000 &
+    python -m src.load_test --url http://127.0.0.1:8000 --rps 20 --duration 60 --mix ask=0.7,stream=0.3
+or let the driver start (and stop) the fake servers and the app itself:
+    python -m src.load_test --launch --app src.api:app --rps 20 --duration 60
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
+
+import httpx
+import numpy as np
+
+DEFAULT_URL="http://127.0.0.1:8000"
+DEFAULT_RPS=10.0
+DEFAULT_DURATION=30.0
+DEFAULT_TIMEOUT=120.0
+DEFAULT_MAX_IN_FLIGHT=256
+DEFAULT_BATCH_SIZE=8
+ENDPOINTS={"ask":"/ask","stream":"/ask/stream","batch":"/ask/batch"}
+ARRIVALS=("poisson","constant")
+#server-side stage timings reported by the generation service
+SERVER_TIMINGS=("retrieval_time_ms","rerank_time_ms","time_to_first_token_ms","llm_inference_time_ms",
+                "total_response_time_ms")
+DEFAULT_QUESTIONS=(
+    "Which wireless earbuds have the best battery life?",
+    "Do reviewers say the noise cancelling headphones are comfortable for long flights?",
+    "Is the USB-C charger fast enough for a laptop?",
+    "What do people complain about with this smartwatch strap?",
+    "Are the budget webcams good in low light?",
+    "Does the portable SSD get hot during long transfers?",
+    "Which HDMI cable works reliably with 4K at 120Hz?",
+    "How loud is the bluetooth speaker outdoors?",
+    "Do buyers recommend this keyboard for programming?",
+    "Is the power bank able to charge a phone more than twice?",
+)
+FAKE_OPENAI_PORT=9001
+FAKE_OLLAMA_PORT=9002
+READY_TIMEOUT_SECONDS=300
+
+
+def load_questions(path=None):
+    """
+    [(question, filters, weight)] from a .txt (one per line) or .jsonl file; the built-in mix without a path.
+    """
+    if path is None:
+        return [(q,None,1.0) for q in DEFAULT_QUESTIONS]
+    questions=[]
+    with open(path,"r") as f:
+        for line in f:
+            line=line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                item=json.loads(line)
+                questions.append((item["question"],item.get("filters"),float(item.get("weight",1.0))))
+            else:
+                questions.append((line,None,1.0))
+    if not questions:
+        raise ValueError(f"no questions in {path}")
+    return questions
+
+#"ask=0.7,stream=0.3" -> {"ask": 0.7, "stream": 0.3}
+def parse_mix(text):
+    mix={}
+    for part in text.split(","):
+        name,_,weight=part.partition("=")
+        name=name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint in mix: {name} (choose from {', '.join(ENDPOINTS)})")
+        mix[name]=float(weight or 1.0)
+    return mix
+
+#send times (seconds from start) of every request in the run
+def arrival_times(rps,duration,arrival,rng):
+    if arrival=="constant":
+        return [i/rps for i in range(int(rps*duration))]
+    times=[]
+    t=rng.expovariate(rps)
+    while t<duration:
+        times.append(t)
+        t+=rng.expovariate(rps)
+    return times
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values=np.asarray(values,dtype=np.float64)
+    p50,p95,p99=np.percentile(values,[50,95,99])
+    return {"count":len(values),"p50_ms":float(p50),"p95_ms":float(p95),"p99_ms":float(p99),
+            "mean_ms":float(values.mean()),"max_ms":float(values.max())}
+
+
+async def _ask(client,question,filters):
+    response=await client.post(ENDPOINTS["ask"],json={"question":question,"filters":filters})
+    response.raise_for_status()
+    body=response.json()
+    return {"server":body.get("timings") or {},"llm_backend":body.get("llm_backend"),"cached":bool(body.get("cached"))}
+
+async def _batch(client,questions,filters):
+    response=await client.post(ENDPOINTS["batch"],json={"questions":questions,"filters":filters})
+    response.raise_for_status()
+    results=response.json()["results"]
+    failed=sum(1 for r in results if "error" in r)
+    if failed:
+        raise RuntimeError(f"{failed}/{len(results)} batch items failed")
+    return {"server":{}}
+
+#one SSE request: time to the first token event, the "done" timings, "error" events raised
+async def _stream(client,question,filters,start):
+    out={"server":{}}
+    event=None
+    async with client.stream("POST",ENDPOINTS["stream"],json={"question":question,"filters":filters}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                event=line[6:].strip()
+            elif line.startswith("data:"):
+                if event=="token" and "ttft_ms" not in out:
+                    out["ttft_ms"]=(time.perf_counter()-start)*1000
+                elif event=="done":
+                    data=json.loads(line[5:])
+                    out["llm_backend"]=data.pop("llm_backend",None)
+                    out["server"]=data
+                elif event=="error":
+                    raise RuntimeError(json.loads(line[5:]).get("error"))
+    return out
+
+async def send(client,endpoint,questions,filters):
+    start=time.perf_counter()
+    record={"endpoint":endpoint}
+    try:
+        if endpoint=="ask":
+            record.update(await _ask(client,questions[0],filters))
+        elif endpoint=="stream":
+            record.update(await _stream(client,questions[0],filters,start))
+        else:
+            record.update(await _batch(client,questions,filters))
+        record["status"]="ok"
+    except httpx.HTTPStatusError as e:
+        record["status"]=f"http_{e.response.status_code}"
+    except Exception as e:
+        record["status"]=type(e).__name__
+    record["latency_ms"]=(time.perf_counter()-start)*1000
+    return record
+
+
+async def run_load(url,questions,mix,rps,duration,arrival="poisson",batch_size=DEFAULT_BATCH_SIZE,
+                   max_in_flight=DEFAULT_MAX_IN_FLIGHT,timeout=DEFAULT_TIMEOUT,seed=0):
+    """
+    Drive the app for `duration` seconds; returns (per-request records, shed count, wall seconds, /backends).
+    """
+    rng=random.Random(seed)
+    texts=[q for q,_,_ in questions]
+    weights=[w for _,_,w in questions]
+    endpoints=list(mix)
+    limits=httpx.Limits(max_connections=max_in_flight,max_keepalive_connections=max_in_flight)
+    records=[]
+    shed=0
+    in_flight=set()
+
+    async with httpx.AsyncClient(base_url=url,timeout=timeout,limits=limits) as client:
+        loop_start=time.perf_counter()
+        for send_at in arrival_times(rps,duration,arrival,rng):
+            delay=send_at-(time.perf_counter()-loop_start)
+            if delay>0:
+                await asyncio.sleep(delay)
+            endpoint=rng.choices(endpoints,[mix[e] for e in endpoints])[0]
+            picked=rng.choices(range(len(texts)),weights,k=batch_size if endpoint=="batch" else 1)
+            if len(in_flight)>=max_in_flight:
+                shed+=1
+                continue
+            lag_ms=(time.perf_counter()-loop_start-send_at)*1000
+
+            async def one(picked=picked,endpoint=endpoint,lag_ms=lag_ms):
+                record=await send(client,endpoint,[texts[i] for i in picked],questions[picked[0]][1])
+                record["lag_ms"]=lag_ms
+                records.append(record)
+
+            task=asyncio.create_task(one())
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        wall=time.perf_counter()-loop_start
+        try:
+            backends=(await client.get("/backends")).json()
+        except (httpx.HTTPError,ValueError):
+            backends=None
+    return records,shed,wall,backends
+
+
+def report(records,shed,wall,backends,config):
+    ok=[r for r in records if r["status"]=="ok"]
+    errors=Counter(r["status"] for r in records if r["status"]!="ok")
+    endpoints={}
+    for endpoint in sorted({r["endpoint"] for r in records}):
+        rows=[r for r in records if r["endpoint"]==endpoint]
+        good=[r for r in rows if r["status"]=="ok"]
+        endpoints[endpoint]={"requests":len(rows),"errors":len(rows)-len(good),
+                             "error_rate":(len(rows)-len(good))/len(rows),
+                             "latency":percentiles([r["latency_ms"] for r in good]),
+                             "time_to_first_token":percentiles([r["ttft_ms"] for r in good if "ttft_ms" in r])}
+
+    breakdown={}
+    stage_values=defaultdict(list)
+    outside=[]
+    for r in ok:
+        server=r.get("server") or {}
+        for name in SERVER_TIMINGS:
+            if server.get(name) is not None:
+                stage_values[name].append(server[name])
+        if server.get("total_response_time_ms") is not None:
+            outside.append(r["latency_ms"]-server["total_response_time_ms"])
+    for name in SERVER_TIMINGS:
+        if stage_values[name]:
+            breakdown[name]=percentiles(stage_values[name])
+    if outside:
+        breakdown["outside_handler_ms"]=percentiles(outside)
+
+    return {"config":config,"wall_seconds":wall,"sent":len(records),"shed":shed,"completed":len(ok),
+            "throughput_rps":len(ok)/wall if wall>0 else None,
+            "error_rate":(len(records)-len(ok))/len(records) if records else None,"errors":dict(errors),
+            "endpoints":endpoints,"time_breakdown":breakdown,
+            "llm_backends":dict(Counter(r.get("llm_backend") for r in ok if r.get("llm_backend"))),
+            "cache_hits":sum(1 for r in ok if r.get("cached")),
+            "driver_lag":percentiles([r["lag_ms"] for r in records]),"backends":backends}
+
+def print_summary(result):
+    print(f"sent {result['sent']} (shed {result['shed']}) in {result['wall_seconds']:.1f}s: "
+          f"{result['throughput_rps'] or 0:.1f} ok/s, error rate {(result['error_rate'] or 0):.1%} {result['errors'] or ''}",
+          file=sys.stderr)
+    for endpoint,stats in result["endpoints"].items():
+        latency=stats["latency"]
+        if latency:
+            line=f"{endpoint:7s} p50 {latency['p50_ms']:8.1f}  p95 {latency['p95_ms']:8.1f}  p99 {latency['p99_ms']:8.1f} ms"
+            if stats["time_to_first_token"]:
+                line+=f"  ttft p50 {stats['time_to_first_token']['p50_ms']:.1f} ms"
+            print(line,file=sys.stderr)
+    for name,stats in result["time_breakdown"].items():
+        print(f"  {name:24s} mean {stats['mean_ms']:8.1f}  p95 {stats['p95_ms']:8.1f} ms",file=sys.stderr)
+    startup=result.get("startup") or {}
+    if startup.get("startup"):
+        line=f"startup: warm-up {startup['startup'].get('warmup_ms') or 0:.0f} ms"
+        if startup["ready_seconds"] is not None:
+            line+=f", ready {startup['ready_seconds']:.1f}s after launch"
+        if startup.get("first_request"):
+            line+=f", first request {startup['first_request']['total_ms']:.1f} ms"
+        print(line,file=sys.stderr)
+
+
+#start the fake LLM servers and the app (configured to use them) as subprocesses
+def launch(app,url,fake_args):
+    port=urlparse(url).port or 80
+    env={**os.environ,"OPENAI_BASE_URL":f"http://127.0.0.1:{FAKE_OPENAI_PORT}/v1",
+         "OPENAI_API_KEY":os.environ.get("OPENAI_API_KEY","fake"),
+         "OLLAMA_URL":f"http://127.0.0.1:{FAKE_OLLAMA_PORT}"}
+    procs=[subprocess.Popen([sys.executable,"-m","src.fake_llm_server","--port",str(p)]+shlex.split(fake_args))
+           for p in (FAKE_OPENAI_PORT,FAKE_OLLAMA_PORT)]
+    started=time.time()
+    procs.append(subprocess.Popen([sys.executable,"-m","uvicorn",app,"--port",str(port),"--log-level","warning"],env=env))
+    checks=[f"http://127.0.0.1:{FAKE_OPENAI_PORT}/v1/models",f"http://127.0.0.1:{FAKE_OLLAMA_PORT}/api/tags",url+"/health"]
+    deadline=time.time()+READY_TIMEOUT_SECONDS
+    for check in checks:
+        while True:
+            try:
+                if httpx.get(check,timeout=2).status_code==200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.time()>deadline or any(p.poll() is not None for p in procs):
+                stop(procs)
+                raise SystemExit(f"not ready: {check}")
+            time.sleep(0.5)
+    return procs,time.time()-started
+
+#the app's /health startup report, plus how long --launch waited for it to become ready (None otherwise)
+def startup_report(url,ready_seconds=None):
+    try:
+        health=httpx.get(url+"/health",timeout=5).json()
+    except (httpx.HTTPError,ValueError):
+        health={}
+    return {"ready_seconds":ready_seconds,"startup":health.get("startup"),"first_request":health.get("first_request")}
+
+def stop(procs):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.wait()
+
+
+def parse_args():
+    parser=argparse.ArgumentParser(description="Open-loop HTTP load test of the RAG API")
+    parser.add_argument("--url",default=DEFAULT_URL)
+    parser.add_argument("--questions",default=None,help=".txt (one per line) or .jsonl question mix")
+    parser.add_argument("--mix",default="ask=1",help="endpoint weights, e.g. ask=0.7,stream=0.2,batch=0.1")
+    parser.add_argument("--rps",type=float,default=DEFAULT_RPS)
+    parser.add_argument("--duration",type=float,default=DEFAULT_DURATION,help="seconds of arrivals")
+    parser.add_argument("--arrival",choices=ARRIVALS,default="poisson")
+    parser.add_argument("--batch-size",type=int,default=DEFAULT_BATCH_SIZE,help="questions per /ask/batch request")
+    parser.add_argument("--max-in-flight",type=int,default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument("--timeout",type=float,default=DEFAULT_TIMEOUT)
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--output",default=None,help="results JSON (default: stdout)")
+    parser.add_argument("--launch",action="store_true",help="start fake LLM servers and the app first")
+    parser.add_argument("--app",default="src.api:app",help="app started by --launch")
+    parser.add_argument("--fake-args",default="",help="extra fake_llm_server.py arguments for --launch")
+    return parser.parse_args()
+
+def main():
+    args=parse_args()
+    questions=load_questions(args.questions)
+    mix=parse_mix(args.mix)
+    procs,ready_seconds=launch(args.app,args.url,args.fake_args) if args.launch else ([],None)
+    try:
+        records,shed,wall,backends=asyncio.run(run_load(args.url,questions,mix,args.rps,args.duration,args.arrival,
+                                                        args.batch_size,args.max_in_flight,args.timeout,args.seed))
+        startup=startup_report(args.url,ready_seconds)
+    finally:
+        stop(procs)
+    config={"url":args.url,"rps":args.rps,"duration":args.duration,"arrival":args.arrival,"mix":mix,
+            "questions":len(questions),"max_in_flight":args.max_in_flight,"seed":args.seed}
+    result=report(records,shed,wall,backends,config)
+    result["startup"]=startup
+    print_summary(result)
+    if args.output is not None:
+        with open(args.output,"w") as f:
+            json.dump(result,f,indent=2)
+        print(f"Saved → {args.output}",file=sys.stderr)
+    else:
+        print(json.dumps(result,indent=2))
+
+
+if __name__=="__main__":
+    main()
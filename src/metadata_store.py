@@ -0,0 +1,293 @@
+"""
+Compact on-disk metadata store used to map FAISS ids to review chunk metadata.
+    Numeric fields are kept in fixed-width columns (one numpy structured array)
+    String fields are concatenated into a single UTF-8 blob addressed by an offsets array
+    Everything is opened with mmap, so looking up k ids only touches those k rows
+
+Store layout (a directory):
+    columns.npy   structured array, one row per FAISS id
+    offsets.npy   int64 array of len(rows)*len(STRING_FIELDS)+1 byte offsets into strings.bin
+    strings.bin   UTF-8 blob with every string field of every row
+    parent_asin_keys.npy / parent_asin_offsets.npy / parent_asin_ids.npy
+                  sorted parent_asin values and the row ids of each one (for product filters)
+    token_counts.npy / token_offsets.npy / token_offsets_index.npy
+                  optional: context-piece token counts and offsets per tokenizer (see context_builder.py)
+    meta.json     field names, row count and tokenizer names
+
+Can also be run as a script to convert an existing metadata JSONL into a store.
+"""
+
+import json
+import mmap
+import os
+from array import array
+
+import numpy as np
+
+METADATA_FILE="data/embeddings/electronics_metadata.jsonl"
+METADATA_STORE_DIR="data/embeddings/electronics_metadata_store"
+
+COLUMNS_FILE="columns.npy"
+OFFSETS_FILE="offsets.npy"
+STRINGS_FILE="strings.bin"
+META_FILE="meta.json"
+PARENT_ASIN_KEYS_FILE="parent_asin_keys.npy"
+PARENT_ASIN_OFFSETS_FILE="parent_asin_offsets.npy"
+PARENT_ASIN_IDS_FILE="parent_asin_ids.npy"
+TOKEN_COUNTS_FILE="token_counts.npy"
+TOKEN_OFFSETS_FILE="token_offsets.npy"
+TOKEN_OFFSETS_INDEX_FILE="token_offsets_index.npy"
+
+#order of keys in the dicts handed back to callers (same as the embedder's metadata rows)
+FIELD_ORDER=[
+    "chunk_id","asin","parent_asin","product_name","review_title",
+    "rating","timestamp","helpful_vote","verified_purchase",
+    "start_word","end_word","chunk_text",
+]
+STRING_FIELDS=["chunk_id","asin","parent_asin","product_name","review_title","chunk_text"]
+
+#fixed-width numeric columns; null_mask has bit j set when STRING_FIELDS[j] is None
+COLUMN_DTYPE=np.dtype([
+    ("rating",np.float32),
+    ("timestamp",np.int64),
+    ("helpful_vote",np.int32),
+    ("verified_purchase",np.int8),
+    ("start_word",np.int32),
+    ("end_word",np.int32),
+    ("null_mask",np.uint8),
+])
+
+#sentinels used for missing numeric values
+MISSING_INT=-1
+
+
+def _encode_numeric(row):
+    rating=row.get("rating")
+    verified=row.get("verified_purchase")
+    null_mask=0
+    for j,field in enumerate(STRING_FIELDS):
+        if row.get(field) is None:
+            null_mask|=1<<j
+    return (
+        np.nan if rating is None else float(rating),
+        MISSING_INT if row.get("timestamp") is None else int(row["timestamp"]),
+        MISSING_INT if row.get("helpful_vote") is None else int(row["helpful_vote"]),
+        MISSING_INT if verified is None else int(bool(verified)),
+        MISSING_INT if row.get("start_word") is None else int(row["start_word"]),
+        MISSING_INT if row.get("end_word") is None else int(row["end_word"]),
+        null_mask,
+    )
+
+
+def build_key_index(values):
+    """
+    Group row ids by a string key -> (sorted keys as bytes, offsets, ids).
+    Rows of keys[i] are ids[offsets[i]:offsets[i+1]], ascending. None keys are skipped.
+    """
+    encoded=np.array([b"" if v is None else str(v).encode("utf-8") for v in values])
+    present=np.flatnonzero(np.array([v is not None for v in values],dtype=bool))
+    if len(present)==0:
+        return np.zeros(0,dtype="S1"),np.zeros(1,dtype=np.int64),np.zeros(0,dtype=np.int64)
+    order=present[np.argsort(encoded[present],kind="stable")]
+    keys,starts=np.unique(encoded[order],return_index=True)
+    offsets=np.concatenate([starts,[len(order)]]).astype(np.int64)
+    return keys,offsets,order.astype(np.int64)
+
+#row ids for one key of a (keys, offsets, ids) index
+def lookup_key_index(key_index,value):
+    keys,offsets,ids=key_index
+    if len(keys)==0:
+        return np.zeros(0,dtype=np.int64)
+    key=str(value).encode("utf-8")
+    pos=int(np.searchsorted(keys,key))
+    if pos>=len(keys) or keys[pos]!=key:
+        return np.zeros(0,dtype=np.int64)
+    return np.asarray(ids[offsets[pos]:offsets[pos+1]])
+
+
+def write_metadata_store(rows,path=METADATA_STORE_DIR):
+    """
+    Write an iterable of metadata dicts (in FAISS id order) to a store directory.
+    Strings are streamed straight to the blob file; only the numeric rows and offsets are buffered.
+    """
+    os.makedirs(path,exist_ok=True)
+    numeric=[]
+    parent_asins=[]
+    offsets=array("q",[0])
+    pos=0
+    # token counts/offsets per tokenizer, for rows produced with context_builder.precompute_token_info
+    tokenizers=None
+    token_counts=array("i")
+    token_offsets=array("i")
+    token_index=array("q",[0])
+
+    with open(os.path.join(path,STRINGS_FILE),"wb") as blob:
+        for row in rows:
+            numeric.append(_encode_numeric(row))
+            parent_asins.append(row.get("parent_asin"))
+            if tokenizers is None:
+                tokenizers=sorted(row.get("token_counts") or {})
+            counts=row.get("token_counts") or {}
+            row_offsets=row.get("token_offsets") or {}
+            for name in tokenizers:
+                token_counts.append(counts.get(name,MISSING_INT))
+                token_offsets.extend(row_offsets.get(name,()))
+                token_index.append(len(token_offsets))
+            for field in STRING_FIELDS:
+                value=row.get(field)
+                data=b"" if value is None else str(value).encode("utf-8")
+                blob.write(data)
+                pos+=len(data)
+                offsets.append(pos)
+
+    columns=np.array(numeric,dtype=COLUMN_DTYPE)
+    np.save(os.path.join(path,COLUMNS_FILE),columns)
+    np.save(os.path.join(path,OFFSETS_FILE),np.frombuffer(offsets,dtype=np.int64))
+
+    keys,key_offsets,key_ids=build_key_index(parent_asins)
+    np.save(os.path.join(path,PARENT_ASIN_KEYS_FILE),keys)
+    np.save(os.path.join(path,PARENT_ASIN_OFFSETS_FILE),key_offsets)
+    np.save(os.path.join(path,PARENT_ASIN_IDS_FILE),key_ids)
+
+    if tokenizers:
+        np.save(os.path.join(path,TOKEN_COUNTS_FILE),np.frombuffer(token_counts,dtype=np.int32).reshape(len(columns),len(tokenizers)))
+        np.save(os.path.join(path,TOKEN_OFFSETS_FILE),np.frombuffer(token_offsets,dtype=np.int32))
+        np.save(os.path.join(path,TOKEN_OFFSETS_INDEX_FILE),np.frombuffer(token_index,dtype=np.int64))
+
+    with open(os.path.join(path,META_FILE),"w") as f:
+        json.dump({"num_rows":len(columns),"string_fields":STRING_FIELDS,"columns":list(COLUMN_DTYPE.names),
+                   "tokenizers":tokenizers or []},f)
+
+    return len(columns)
+
+
+def store_exists(path=METADATA_STORE_DIR):
+    return os.path.exists(os.path.join(path,META_FILE))
+
+
+class MetadataStore:
+    """
+    Read-only, memory-mapped view over a metadata store directory.
+    Row lookups decode only the requested rows and always return fresh dicts.
+    """
+
+    def __init__(self,path=METADATA_STORE_DIR):
+        self.path=path
+        with open(os.path.join(path,META_FILE),"r") as f:
+            self.meta=json.load(f)
+        if self.meta["string_fields"]!=STRING_FIELDS:
+            raise ValueError(f"Unsupported metadata store layout in {path}")
+
+        self.columns=np.load(os.path.join(path,COLUMNS_FILE),mmap_mode="r")
+        self.offsets=np.load(os.path.join(path,OFFSETS_FILE),mmap_mode="r")
+
+        self._parent_asin_index=None
+
+        self.tokenizers=self.meta.get("tokenizers") or []
+        if self.tokenizers:
+            self.token_counts=np.load(os.path.join(path,TOKEN_COUNTS_FILE),mmap_mode="r")
+            self.token_offsets=np.load(os.path.join(path,TOKEN_OFFSETS_FILE),mmap_mode="r")
+            self.token_index=np.load(os.path.join(path,TOKEN_OFFSETS_INDEX_FILE),mmap_mode="r")
+
+        self._blob_file=open(os.path.join(path,STRINGS_FILE),"rb")
+        if os.fstat(self._blob_file.fileno()).st_size>0:
+            self.blob=mmap.mmap(self._blob_file.fileno(),0,access=mmap.ACCESS_READ)
+        else:
+            self.blob=b""
+
+    def __len__(self):
+        return int(self.meta["num_rows"])
+
+    def __getitem__(self,id_):
+        return self.get(id_)
+
+    #numeric column as a read-only memmapped array (e.g. for filtering)
+    def column(self,name):
+        return self.columns[name]
+
+    #(keys, offsets, ids) grouping of row ids by parent_asin; rebuilt by scanning for older stores
+    def parent_asin_index(self):
+        if self._parent_asin_index is None:
+            keys_path=os.path.join(self.path,PARENT_ASIN_KEYS_FILE)
+            if os.path.exists(keys_path):
+                self._parent_asin_index=(
+                    np.load(keys_path,mmap_mode="r"),
+                    np.load(os.path.join(self.path,PARENT_ASIN_OFFSETS_FILE),mmap_mode="r"),
+                    np.load(os.path.join(self.path,PARENT_ASIN_IDS_FILE),mmap_mode="r"),
+                )
+            else:
+                self._parent_asin_index=build_key_index([self.get_string(i,"parent_asin") for i in range(len(self))])
+        return self._parent_asin_index
+
+    def ids_for_parent_asin(self,parent_asin):
+        return lookup_key_index(self.parent_asin_index(),parent_asin)
+
+    def get_string(self,id_,field):
+        j=STRING_FIELDS.index(field)
+        if int(self.columns[id_]["null_mask"])>>j & 1:
+            return None
+        base=id_*len(STRING_FIELDS)+j
+        start,end=int(self.offsets[base]),int(self.offsets[base+1])
+        return self.blob[start:end].decode("utf-8")
+
+    def get(self,id_):
+        id_=int(id_)
+        if id_<0 or id_>=len(self):
+            raise IndexError(f"metadata id {id_} out of range")
+
+        num=self.columns[id_]
+        null_mask=int(num["null_mask"])
+        base=id_*len(STRING_FIELDS)
+        bounds=self.offsets[base:base+len(STRING_FIELDS)+1]
+
+        row={}
+        for j,field in enumerate(STRING_FIELDS):
+            if null_mask>>j & 1:
+                row[field]=None
+            else:
+                row[field]=self.blob[int(bounds[j]):int(bounds[j+1])].decode("utf-8")
+
+        rating=float(num["rating"])
+        row["rating"]=None if np.isnan(rating) else rating
+        for field in ("timestamp","helpful_vote","start_word","end_word"):
+            value=int(num[field])
+            row[field]=None if value==MISSING_INT else value
+        verified=int(num["verified_purchase"])
+        row["verified_purchase"]=None if verified==MISSING_INT else bool(verified)
+
+        out={field:row[field] for field in FIELD_ORDER}
+        if self.tokenizers:
+            out.update(self._token_info(id_))
+        return out
+
+    def _token_info(self,id_):
+        counts={}
+        offsets={}
+        base=id_*len(self.tokenizers)
+        for j,name in enumerate(self.tokenizers):
+            count=int(self.token_counts[id_,j])
+            if count==MISSING_INT:
+                continue
+            counts[name]=count
+            offsets[name]=self.token_offsets[int(self.token_index[base+j]):int(self.token_index[base+j+1])].tolist()
+        return {"token_counts":counts,"token_offsets":offsets}
+
+    def get_many(self,ids):
+        return [self.get(id_) for id_ in ids]
+
+    def close(self):
+        if isinstance(self.blob,mmap.mmap):
+            self.blob.close()
+        self._blob_file.close()
+
+
+#stream rows from a metadata JSONL file without building a list
+def iter_metadata_jsonl(path=METADATA_FILE):
+    with open(path,"r") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+if __name__=="__main__":
+    n=write_metadata_store(iter_metadata_jsonl(METADATA_FILE),METADATA_STORE_DIR)
+    print(f"Wrote {n} rows → {METADATA_STORE_DIR}")
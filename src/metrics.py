@@ -0,0 +1,227 @@
+"""
+Request metrics shared by the RAG engines and the API, kept off the request path.
+    record_request_metrics(params, metrics) adds one request's numbers to in-memory aggregates,
+    labelled by request kind (answer / batch / stream) and LLM backend ("cache" for semantic cache hits):
+        *_ms values go to histograms with fixed log-spaced buckets (LATENCY_BUCKETS_MS)
+        other values (cache hits, attempts, hedges, batch errors, ...) are summed into counters
+    which costs a lock and a few list increments (microseconds), no I/O
+    A daemon thread, started by the first record, flushes every FLUSH_INTERVAL_SECONDS: the window's
+    aggregates become one MLflow run (count, mean, p50/p95/p99 estimated from the buckets, max per
+    metric) instead of one run per request; stop() flushes what is left
+    The cumulative aggregates are rendered in the Prometheus text format for the API's /metrics
+"""
+
+import atexit
+import bisect
+import re
+import threading
+import time
+
+EXPERIMENT_NAME="amazon-rag-latency"
+FLUSH_INTERVAL_SECONDS=60
+#bucket upper bounds in ms: 0.1 ms .. ~150 s, x1.5 apart
+LATENCY_BUCKETS_MS=tuple(float(f"{0.1*1.5**i:.3g}") for i in range(36))
+QUANTILES=(0.5,0.95,0.99)
+PROMETHEUS_PREFIX="rag_"
+LABEL_NAMES=("kind","backend")
+
+_NAME_RE=re.compile(r"[^a-zA-Z0-9_]")
+
+
+class Histogram:
+    def __init__(self,bounds=LATENCY_BUCKETS_MS):
+        self.bounds=bounds
+        self.counts=[0]*(len(bounds)+1)
+        self.count=0
+        self.sum=0.0
+        self.max=0.0
+
+    def observe(self,value):
+        self.counts[bisect.bisect_left(self.bounds,value)]+=1
+        self.count+=1
+        self.sum+=value
+        if value>self.max:
+            self.max=value
+
+    #value below which a fraction q of the observations fall, interpolated inside its bucket
+    def quantile(self,q):
+        if self.count==0:
+            return None
+        rank=q*self.count
+        seen=0
+        for i,n in enumerate(self.counts):
+            if n and seen+n>=rank:
+                lower=self.bounds[i-1] if i>0 else 0.0
+                upper=self.bounds[i] if i<len(self.bounds) else self.max
+                return min(lower+(upper-lower)*(rank-seen)/n,self.max)
+            seen+=n
+        return self.max
+
+    def summary(self):
+        out={"count":self.count,"mean":self.sum/self.count if self.count else 0.0,"max":self.max}
+        for q in QUANTILES:
+            out[f"p{int(q*100)}"]=self.quantile(q)
+        return out
+
+
+def request_labels(params,metrics):
+    if params.get("stream"):
+        kind="stream"
+    elif "batch_size" in params:
+        kind="batch"
+    else:
+        kind="answer"
+    backend="cache" if metrics.get("semantic_cache_hit") else params.get("llm_backend") or "none"
+    return kind,backend
+
+
+class _Aggregates:
+    def __init__(self):
+        self.histograms={}
+        self.counters={}
+        self.started=time.time()
+
+    def add(self,labels,metrics):
+        key=("requests",labels)
+        self.counters[key]=self.counters.get(key,0)+1
+        for name,value in metrics.items():
+            if value is None:
+                continue
+            key=(name,labels)
+            if name.endswith("_ms"):
+                histogram=self.histograms.get(key)
+                if histogram is None:
+                    histogram=self.histograms[key]=Histogram()
+                histogram.observe(float(value))
+            else:
+                self.counters[key]=self.counters.get(key,0)+float(value)
+
+
+class MetricsRegistry:
+    """
+    Cumulative aggregates (for /metrics) plus the current flush window (for MLflow).
+    """
+
+    def __init__(self,flush_interval=FLUSH_INTERVAL_SECONDS,experiment=EXPERIMENT_NAME):
+        self.flush_interval=flush_interval
+        self.experiment=experiment
+        self.total=_Aggregates()
+        self.window=_Aggregates()
+        self.gauges={}
+        self.flushes=0
+        self._lock=threading.Lock()
+        self._thread=None
+        self._stopped=threading.Event()
+
+    def record(self,params,metrics):
+        labels=request_labels(params,metrics)
+        with self._lock:
+            self.total.add(labels,metrics)
+            self.window.add(labels,metrics)
+        if self._thread is None:
+            self.start()
+
+    def set_gauge(self,name,labels,value):
+        self.gauges[(name,tuple(sorted(labels.items())))]=value
+
+    #background flushing (idempotent); also registered to run once more at interpreter exit
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread=threading.Thread(target=self._run,name="metrics-flush",daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        thread=self._thread
+        if thread is None:
+            return
+        self._stopped.set()
+        thread.join()
+        self._thread=None
+        self.flush()
+
+    #take the window and start a new one
+    def _swap_window(self):
+        with self._lock:
+            window,self.window=self.window,_Aggregates()
+        return window
+
+    def window_metrics(self,window):
+        out={}
+        for (name,labels),histogram in window.histograms.items():
+            for stat,value in histogram.summary().items():
+                if value is not None:
+                    out[".".join((name,)+labels+(stat,))]=value
+        for (name,labels),value in window.counters.items():
+            out[".".join((name,)+labels)]=value
+        return out
+
+    def flush(self):
+        """
+        Log the window's aggregates as one MLflow run (nothing when no request was recorded).
+        """
+        window=self._swap_window()
+        if not window.counters:
+            return None
+        metrics=self.window_metrics(window)
+        try:
+            import mlflow
+            mlflow.set_experiment(self.experiment)
+            with mlflow.start_run(run_name="request-metrics"):
+                mlflow.log_params({"window_start":time.strftime("%Y-%m-%dT%H:%M:%S",time.localtime(window.started)),
+                                   "window_seconds":round(time.time()-window.started,1)})
+                mlflow.log_metrics(metrics)
+        except Exception as e:
+            print(f"metrics flush failed: {type(e).__name__}: {e}")
+            return None
+        self.flushes+=1
+        return metrics
+
+    def render_prometheus(self):
+        with self._lock:
+            histograms={key:(list(h.counts),h.count,h.sum,h.bounds) for key,h in self.total.histograms.items()}
+            counters=dict(self.total.counters)
+        lines=[]
+        typed=set()
+
+        def header(metric,kind):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+
+        for (name,labels),(counts,count,total,bounds) in sorted(histograms.items()):
+            metric=PROMETHEUS_PREFIX+_NAME_RE.sub("_",name)
+            header(metric,"histogram")
+            label_text=",".join(f'{n}="{v}"' for n,v in zip(LABEL_NAMES,labels))
+            cumulative=0
+            for bound,n in zip(bounds,counts):
+                cumulative+=n
+                lines.append(f'{metric}_bucket{{{label_text},le="{bound:g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum{{{label_text}}} {total}")
+            lines.append(f"{metric}_count{{{label_text}}} {count}")
+        for (name,labels),value in sorted(counters.items()):
+            metric=PROMETHEUS_PREFIX+_NAME_RE.sub("_",name)+"_total"
+            header(metric,"counter")
+            label_text=",".join(f'{n}="{v}"' for n,v in zip(LABEL_NAMES,labels))
+            lines.append(f"{metric}{{{label_text}}} {value:g}")
+        for (name,labels),value in sorted(self.gauges.items()):
+            metric=PROMETHEUS_PREFIX+_NAME_RE.sub("_",name)
+            header(metric,"gauge")
+            label_text=",".join(f'{n}="{v}"' for n,v in labels)
+            lines.append(f"{metric}{{{label_text}}} {value:g}")
+        return "\n".join(lines)+"\n"
+
+
+#process-wide registry used by the engines and the API
+REGISTRY=MetricsRegistry()
+
+def record_request_metrics(params,metrics):
+    REGISTRY.record(params,metrics)
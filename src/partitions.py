@@ -0,0 +1,122 @@
+"""
+Product-partitioned vectors for product-scoped questions.
+    faiss_builder.py --partitions copies the embeddings into one file ordered by parent_asin,
+    so every product is a contiguous block, plus a small routing table (parent_asin -> block)
+    A product-scoped query searches only its blocks (exact L2 over a few hundred rows)
+    instead of the global index; everything else still goes to the global index
+
+Partition layout (a directory):
+    vectors.npy    float32 embeddings grouped by parent_asin
+    ids.npy        int64 global FAISS id of each row of vectors.npy
+    keys.npy       sorted parent_asin values (routing table, looked up with searchsorted)
+    offsets.npy    int64, rows of keys[i] are [offsets[i], offsets[i+1])
+    meta.json      num_rows, num_partitions, dim and the version of the index file they were built with
+"""
+
+import json
+import os
+import re
+
+import faiss
+import numpy as np
+
+PARTITION_DIR="data/faiss/electronics_partitions"
+#product ids that can appear in a question (Amazon ASINs, e.g. B08N5WRWNW)
+ASIN_RE=re.compile(r"\b[A-Z0-9]{10}\b")
+#rows copied per step when writing vectors.npy
+PARTITION_COPY_BATCH=50000
+
+
+#partitions are only used next to the index build they were written with (a rebuilt index makes them stale)
+def partitions_exist(path=PARTITION_DIR,index_version=None):
+    meta_path=os.path.join(path,"meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    if index_version is None:
+        return True
+    with open(meta_path,"r") as f:
+        return json.load(f).get("index_version")==index_version
+
+def write_partitions(embeddings,key_index,path=PARTITION_DIR,index_version=None):
+    """
+    Write embeddings grouped by the (keys, offsets, ids) parent_asin index of the metadata store.
+    Rows without a parent_asin are left out (they are only reachable through the global index).
+    Returns the number of partitions.
+    """
+    keys,offsets,ids=(np.asarray(a) for a in key_index)
+    os.makedirs(path,exist_ok=True)
+    vectors=np.lib.format.open_memmap(os.path.join(path,"vectors.npy"),mode="w+",
+                                      dtype=np.float32,shape=(len(ids),embeddings.shape[1]))
+    for s in range(0,len(ids),PARTITION_COPY_BATCH):
+        vectors[s:s+PARTITION_COPY_BATCH]=embeddings[ids[s:s+PARTITION_COPY_BATCH]]
+    vectors.flush()
+    del vectors
+    np.save(os.path.join(path,"ids.npy"),ids.astype(np.int64))
+    np.save(os.path.join(path,"keys.npy"),keys)
+    np.save(os.path.join(path,"offsets.npy"),offsets.astype(np.int64))
+    with open(os.path.join(path,"meta.json"),"w") as f:
+        json.dump({"num_rows":int(len(ids)),"num_partitions":int(len(keys)),"dim":int(embeddings.shape[1]),
+                   "index_version":index_version},f)
+    return len(keys)
+
+
+class PartitionedIndex:
+    """
+    Read-only, memory-mapped partitions; a search only touches the blocks of the requested products.
+    """
+
+    def __init__(self,path=PARTITION_DIR):
+        self.path=path
+        with open(os.path.join(path,"meta.json"),"r") as f:
+            self.meta=json.load(f)
+        self.vectors=np.load(os.path.join(path,"vectors.npy"),mmap_mode="r")
+        self.ids=np.load(os.path.join(path,"ids.npy"),mmap_mode="r")
+        self.keys=np.load(os.path.join(path,"keys.npy"))
+        self.offsets=np.load(os.path.join(path,"offsets.npy"))
+
+    def __len__(self):
+        return len(self.keys)
+
+    #block position of each parent_asin, None for unknown products
+    def lookup(self,parent_asins):
+        out=[]
+        for asin in parent_asins:
+            key=str(asin).encode("utf-8")
+            pos=int(np.searchsorted(self.keys,key))
+            out.append(pos if pos<len(self.keys) and self.keys[pos]==key else None)
+        return out
+
+    def covers(self,parent_asins):
+        return bool(parent_asins) and None not in self.lookup(parent_asins)
+
+    #parent_asins from the routing table mentioned in a question
+    def detect(self,query):
+        candidates=sorted(set(ASIN_RE.findall(query or "")))
+        return [asin for asin,pos in zip(candidates,self.lookup(candidates)) if pos is not None]
+
+    def search(self,query_vectors,k,parent_asins,allowed=None):
+        """
+        Exact L2 top-k within the given products -> (distances, global ids), shaped like index.search.
+        `allowed` is an optional boolean mask over global ids (other metadata filters).
+        """
+        query_vectors=np.ascontiguousarray(query_vectors,dtype=np.float32).reshape(-1,self.vectors.shape[1])
+        blocks=[(int(self.offsets[p]),int(self.offsets[p+1])) for p in self.lookup(parent_asins) if p is not None]
+        if len(blocks)==1:
+            start,end=blocks[0]
+            ids,vectors=np.asarray(self.ids[start:end]),np.asarray(self.vectors[start:end])
+        elif blocks:
+            ids=np.concatenate([self.ids[s:e] for s,e in blocks])
+            vectors=np.concatenate([self.vectors[s:e] for s,e in blocks])
+        else:
+            ids,vectors=np.zeros(0,dtype=np.int64),np.zeros((0,self.vectors.shape[1]),dtype=np.float32)
+        if allowed is not None:
+            keep=allowed[ids]
+            ids,vectors=ids[keep],vectors[keep]
+
+        distances=np.full((len(query_vectors),k),np.inf,dtype=np.float32)
+        labels=np.full((len(query_vectors),k),-1,dtype=np.int64)
+        if len(ids):
+            found_d,found_i=faiss.knn(query_vectors,np.ascontiguousarray(vectors),min(k,len(ids)))
+            distances[:,:found_d.shape[1]]=found_d
+            labels[:,:found_i.shape[1]]=ids[found_i]
+        return distances,labels
@@ -1,6 +1,7 @@
 """
 Cleans  Amazon review text before chunking and embedding in the RAG pipeline.
 
+`clean_review` is also used per record by the streaming ingestion command (src/ingest.py).
 """
 import json
 import re
@@ -8,39 +9,57 @@ import re
 input_path = "data/raw/electronics_50k_with_product_name.jsonl"
 output_path = "data/processed/electronics_50k_clean.jsonl"
 
+#reviews with less text than this are dropped
+MIN_TEXT_CHARS = 30
+
+HTML_TAG_RE = re.compile(r"<.*?>")
+WHITESPACE_RE = re.compile(r"\s+")
+
 
 def clean_text(text:str)->str:
     text = text or ""
-    text = re.sub(r"<.*?>","", text) #Find anything that starts with < and ends with >, but stop at the first > for removing html tags
+    text = HTML_TAG_RE.sub("", text) #Find anything that starts with < and ends with >, but stop at the first > for removing html tags
     text = text.replace("\n"," ") #remove newlines
-    text = re.sub(r"\s+"," ",text) #Replace any amount of whitespace with a single space.
+    text = WHITESPACE_RE.sub(" ",text) #Replace any amount of whitespace with a single space.
     return text.strip()
 
 
-with open(input_path, "r", encoding="utf-8") as infile, \
-     open(output_path,"w",encoding="utf-8") as outfile:
+#the fields we keep from a review (text fields cleaned), or None when the review text is too short
+def clean_review(review):
+    #extracting fields we want
+    cleaned_review = {
+        "asin": review.get("asin"),
+        "parent_asin": review.get("parent_asin"), 
+        "user_id": review.get("user_id"),
+        "product_name": clean_text(review.get("product_name", "")),  
+        "rating": review.get("rating"),
+        "title": clean_text(review.get("title", "")),
+        "text": clean_text(review.get("text", "")),
+        "timestamp": review.get("timestamp"),
+        "helpful_vote": review.get("helpful_vote"),
+        "verified_purchase": review.get("verified_purchase"),
+        
+        }
     
-    for line in infile:
-        review = json.loads(line)
-
-        #extracting fields we want
-        cleaned_review = {
-            "asin": review.get("asin"),
-            "parent_asin": review.get("parent_asin"), 
-            "product_name": clean_text(review.get("product_name", "")),  
-            "rating": review.get("rating"),
-            "title": clean_text(review.get("title", "")),
-            "text": clean_text(review.get("text", "")),
-            "timestamp": review.get("timestamp"),
-            "helpful_vote": review.get("helpful_vote"),
-            "verified_purchase": review.get("verified_purchase"),
-            
-            }
+    if len(cleaned_review["text"])<MIN_TEXT_CHARS:
+        return None
+    return cleaned_review
+
+
+def main():
+    with open(input_path, "r", encoding="utf-8") as infile, \
+         open(output_path,"w",encoding="utf-8") as outfile:
         
-        if len(cleaned_review["text"])<30:
-            continue
+        for line in infile:
+            cleaned_review = clean_review(json.loads(line))
+            if cleaned_review is None:
+                continue
+
+            outfile.write(json.dumps(cleaned_review)+"\n")
+
 
-        outfile.write(json.dumps(cleaned_review)+"\n")
+    print(f" Preprocessing complete!\nSaved cleaned data → {output_path}")        
 
 
-print(f" Preprocessing complete!\nSaved cleaned data → {output_path}")        
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Reduced-precision storage for chunk embeddings (float16 or int8 scalar quantization).
+    float16 halves the embeddings file, int8 quarters it
+    int8 uses a per-dimension offset (min) and scale ((max-min)/255), stored in a small .npz beside the .npy
+    The int8 codes follow FAISS's 8-bit scalar quantizer convention, so SQ8 indexes
+    can be filled straight from the stored codes without re-encoding
+"""
+
+import os
+
+import numpy as np
+
+EMBEDDING_DTYPES=["float32","float16","int8"]
+
+#rows processed per step when converting files (keeps memory bounded)
+CONVERT_BATCH=50000
+
+
+#data/embeddings/electronics_embeddings.npy -> data/embeddings/electronics_embeddings.quant.npz
+def quant_params_path(embedding_path):
+    return os.path.splitext(embedding_path)[0]+".quant.npz"
+
+def save_quant_params(embedding_path,offset,scale):
+    np.savez(quant_params_path(embedding_path),offset=offset.astype(np.float32),scale=scale.astype(np.float32))
+
+def load_quant_params(embedding_path):
+    params=np.load(quant_params_path(embedding_path))
+    return params["offset"],params["scale"]
+
+
+#per-dimension min/max over a (possibly memmapped) matrix, one batch at a time
+def column_min_max(embeddings):
+    vmin=np.full(embeddings.shape[1],np.inf,dtype=np.float32)
+    vmax=np.full(embeddings.shape[1],-np.inf,dtype=np.float32)
+    for s in range(0,embeddings.shape[0],CONVERT_BATCH):
+        block=np.asarray(embeddings[s:s+CONVERT_BATCH],dtype=np.float32)
+        vmin=np.minimum(vmin,block.min(axis=0))
+        vmax=np.maximum(vmax,block.max(axis=0))
+    return vmin,vmax
+
+def int8_params(embeddings):
+    vmin,vmax=column_min_max(embeddings)
+    scale=np.maximum(vmax-vmin,1e-12)/255.0
+    return vmin,scale.astype(np.float32)
+
+# uint8 code c = floor((x-offset)/scale) in [0,255], stored shifted to int8 (c-128)
+def quantize_int8(block,offset,scale):
+    codes=np.clip(np.floor((block-offset)/scale),0,255)
+    return (codes-128).astype(np.int8)
+
+#FAISS-compatible uint8 codes from the stored int8 values
+def int8_to_sq8_codes(block):
+    return (block.astype(np.int16)+128).astype(np.uint8)
+
+def dequantize_int8(block,offset,scale):
+    return ((block.astype(np.float32)+128.5)*scale+offset).astype(np.float32)
+
+
+def convert_embeddings_file(src_path,dst_path,dtype):
+    """
+    Rewrite a float32 .npy embeddings file as float16 or int8 (batch by batch).
+    int8 also writes the per-dimension offset/scale file next to dst_path.
+    """
+    src=np.load(src_path,mmap_mode="r")
+    dst=np.lib.format.open_memmap(dst_path,mode="w+",dtype=np.dtype(dtype),shape=src.shape)
+
+    if dtype=="int8":
+        offset,scale=int8_params(src)
+        save_quant_params(dst_path,offset,scale)
+
+    for s in range(0,src.shape[0],CONVERT_BATCH):
+        block=np.asarray(src[s:s+CONVERT_BATCH],dtype=np.float32)
+        if dtype=="int8":
+            dst[s:s+CONVERT_BATCH]=quantize_int8(block,offset,scale)
+        else:
+            dst[s:s+CONVERT_BATCH]=block.astype(dtype)
+    dst.flush()
+    del dst
+
+
+#load any stored embedding format back as float32 (int8 is dequantized)
+def to_float32(embeddings,embedding_path):
+    if embeddings.dtype==np.int8:
+        offset,scale=load_quant_params(embedding_path)
+        out=np.empty(embeddings.shape,dtype=np.float32)
+        for s in range(0,embeddings.shape[0],CONVERT_BATCH):
+            out[s:s+CONVERT_BATCH]=dequantize_int8(embeddings[s:s+CONVERT_BATCH],offset,scale)
+        return out
+    return np.asarray(embeddings,dtype=np.float32)
+
+
+def _brute_force_topk(base,queries,k):
+    dists=(queries**2).sum(1)[:,None]-2*queries@base.T+(base**2).sum(1)[None,:]
+    return np.argsort(dists,axis=1)[:,:k]
+
+def precision_report(original,reduced,embedding_path,dtype,sample_size=20000,num_queries=200,k=10,seed=42):
+    """
+    Memory and recall delta of the reduced file vs float32, measured with exact search
+    on a random sample of rows (queries are the float32 originals).
+    """
+    n=original.shape[0]
+    rng=np.random.default_rng(seed)
+    rows=np.sort(rng.choice(n,size=min(sample_size,n),replace=False))
+    base=np.asarray(original[rows],dtype=np.float32)
+    approx=to_float32(np.asarray(reduced[rows]),embedding_path)
+    queries=base[rng.choice(len(rows),size=min(num_queries,len(rows)),replace=False)]
+
+    exact_ids=_brute_force_topk(base,queries,k)
+    approx_ids=_brute_force_topk(approx,queries,k)
+    recall=sum(len(set(a)&set(e)) for a,e in zip(approx_ids,exact_ids))/(len(queries)*k)
+
+    float32_bytes=n*original.shape[1]*4
+    reduced_bytes=reduced.nbytes
+    return {
+        "embedding_dtype":dtype,
+        f"recall_at_{k}_vs_float32":recall,
+        "float32_mb":float32_bytes/(1024*1024),
+        "stored_mb":reduced_bytes/(1024*1024),
+        "memory_ratio":reduced_bytes/float32_bytes,
+        "max_abs_error":float(np.abs(approx-base).max()),
+    }
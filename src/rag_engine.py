@@ -1,164 +1,158 @@
 """
 Implements the RAG answer generation logic using OpenAI (GPT-4o-mini) while keeping the retrieved context within a token limit.
+
+The async path (`generate_answer_async`) runs the shared pipeline of src/generation.py with the OpenAI
+backend: retrieval on a dedicated executor, the completion awaited on a shared `AsyncOpenAI` client.
 """
 
-import re
+import functools
 import textwrap
-import os
 
-# from retriever import retrieve
-from src.retriever import retrieve
+from src.batching import DEFAULT_MAX_CONCURRENCY, map_bounded
+from src.context_builder import build_context as build_budgeted_context, count_tokens as shared_count_tokens, tokenizer_for_model
+from src.generation import DEFAULT_K, GenerationService, build_prompt, build_sources
+from src.llm_backends import MODEL_NAME, OpenAIBackend, call_llm_openai_sync, create_openai_sync_client
+from src.llm_router import LLMRouter
+from src.metrics import record_request_metrics
+from src.reranker import candidate_count
+from src.retriever import get_default_retriever
 
 from typing import List, Dict
-import tiktoken 
 import time
-import mlflow
-
-
-
-#config
-MAX_CONTEXT_TOKENS = 3000   
 
-DEFAULT_K=5
-SYSTEM_INSTRUCTIONS = (
-    "You are an assistant that answers product questions using ONLY the provided context.\n"
-    "Cite sources inline like [source:ASIN:chunk_id].\n"
-    "If the answer is not supported by the context, respond: \"I don't know based on the provided information.\"\n"
-    "Do NOT guess product names unless they appear in the context.\n"   
-    "Keep answers short and factual. "
-    "Provide a short answer and then list sources used."
-)
-MODEL_NAME = "gpt-4o-mini"
-MAX_RESPONSE_TOKENS = 512
-mlflow.set_experiment("amazon-rag-latency")
 
-
-#count no:of tokens
-tokenizer=tiktoken.encoding_for_model(MODEL_NAME)
+#count no:of tokens (with the tokenizer of MODEL_NAME)
 def count_tokens(text:str)->int:
-    return len(tokenizer.encode(text))
-
-
-#clean the retrived text before passing to llm
-def clean_text(text:str)->str:
-    text = re.sub(r"\[\[(VIDEOID|ASIN)[^\]]*\]\]", "", text)
-    text = re.sub(r"\s+"," ",text).strip()
-    return text
-
-#Turn retrieved metadata dicts into a single context string.
-def build_context(retrieved:List[Dict],max_tokens: int=MAX_CONTEXT_TOKENS)->str:
-    ctx_parts=[]
-    total_tokens=0
-    for r in retrieved:
-        product = r.get("product_name", "Unknown Product")     
-        #to make a tag so that i can trace source : so that i know its factual
-        provenance=f"[source:{r.get('asin','unknown')}:{r.get('chunk_id','unknown')}]"
-        
-        #clean chunk text
-        txt=clean_text(r.get("chunk_text",""))
-
-        #Combine provenance tag +product name  + cleaned text
-        piece=(
-            f"{provenance}\n"
-            f"Product: {product}\n"             
-            f"{txt}\n"
-               )
-        piece_tokens=count_tokens(piece)
-
-        #tokens budget check
-        if total_tokens + piece_tokens > max_tokens:
-            remaining=max_tokens - total_tokens
-
-             # allow partial chunk if meaningful
-            if remaining > 50:
-                truncated_tokens=tokenizer.encode(piece)[:remaining]
-                truncated=tokenizer.decode(truncated_tokens) + "....\n"
-                ctx_parts.append(truncated)
-            break
-
-        ctx_parts.append(piece)  
-        total_tokens+=piece_tokens
-    context="\n".join(ctx_parts)
-    return context 
+    return shared_count_tokens(text,tokenizer_for_model(MODEL_NAME))
+
+#Turn retrieved metadata dicts into a single context string,
+#packed to the model's token budget from the token counts stored at embed time (see context_builder.py)
+def build_context(retrieved:List[Dict],max_tokens:int=None,model:str=MODEL_NAME)->str:
+    return build_budgeted_context(retrieved,model,max_tokens)
     
 
-#Assembling the final prompt string that is passed to the LLM
-def build_prompt(question:str,context:str,system_instructions:str=SYSTEM_INSTRUCTIONS)->str:
-    header="Use the following retrieved review excerpts as factual context:\n\n"
-    prompt=f"{system_instructions}\n\n{header}{context}\n\nQuestion: {question}\nAnswer concisely and cite sources."
-    return prompt
+#one blocking client per process, created on first use
+@functools.lru_cache(maxsize=None)
+def get_openai_client():
+    return create_openai_sync_client()
 
 #calling llm
 def call_llm_openai(prompt:str,model=MODEL_NAME)->str:
-    import openai
-    api_key=os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY not set in env")
-    openai.api_key=api_key
-    response = openai.ChatCompletion.create(
-
-        model=model,
-        messages=[
-            {"role":"system","content":"You are a helpful assistant"},
-            {"role":"user","content":prompt}
-                  ],
-        temperature=0,
-        max_tokens=MAX_RESPONSE_TOKENS
-        )
-    
-    return response["choices"][0]["message"]["content"].strip()
+    return call_llm_openai_sync(prompt,get_openai_client(),model=model)
 
 
 #generate ans by retrieving chunks, building context and prompt, calling the LLM, 
 #returning the final answer with source metadata.
-def generate_answer(question:str,k=DEFAULT_K,llm_model="gpt-4o-mini")->Dict:
+#`retriever` is the shared Retriever created at app startup (falls back to the process default).
+def generate_answer(question:str,k=DEFAULT_K,llm_model="gpt-4o-mini",retriever=None,filters=None,reranker=None)->Dict:
+    if retriever is None:
+        retriever=get_default_retriever()
 
     #reponse time start
     total_start_time= time.time()
-    with mlflow.start_run(nested=True):
-        mlflow.log_param("llm_model",llm_model)
-        mlflow.log_param("top_k",k)
-
-        #retrieval time
-        retrieval_start=time.time()
-        retrieved, distances,ids=retrieve(question,k=k)
-        retrieval_time=time.time()-retrieval_start
-        mlflow.log_metric("retrieval_time_ms",retrieval_time*1000)
-
+    params={"llm_model":llm_model,"top_k":k,"llm_backend":"openai"}
+
+    #retrieval time
+    retrieval_start=time.time()
+    retrieved, distances,ids=retriever.retrieve(question,k=candidate_count(k,reranker),filters=filters)
+    retrieval_time=time.time()-retrieval_start
+    metrics={"retrieval_time_ms":retrieval_time*1000}
+    if reranker is not None and retrieved:
+        retrieved,distances,ids,rerank_info=reranker.rerank(question,retrieved,distances,ids,k)
+        metrics.update(rerank_info)
+
+    if not retrieved:
+        metrics["total_response_time_ms"]=(time.time()-total_start_time)*1000
+        record_request_metrics(params,metrics)
+        return {
+        "question": question,
+        "answer": "I don't know based on the provided information.",
+        "sources": [],
+        "prompt": ""
+    }
+    context=build_context(retrieved,model=llm_model)
+    prompt=build_prompt(question,context)
+
+    #llm inference timing
+    llm_start=time.time()
+    answer=call_llm_openai(prompt,model=llm_model)
+    llm_time=time.time()-llm_start
+
+    metrics["llm_inference_time_ms"]=llm_time*1000
+
+    #total response time
+    total_time=time.time()-total_start_time
+    metrics["total_response_time_ms"]=total_time*1000
+    record_request_metrics(params,metrics)
+
+
+    print("ANSWER TOKENS:", shared_count_tokens(answer,tokenizer_for_model(llm_model)))
+    sources=build_sources(retrieved,distances)
+    return {"question":question,"answer":answer,"sources":sources,"prompt":prompt}
+
+
+
+#answer many questions: one batched retrieval (single encode + single index search),
+#then LLM calls with at most max_concurrency in flight.
+#Results keep the order of `questions`; a failed item carries an "error" instead of an answer.
+def generate_answers(questions:List[str],k=DEFAULT_K,llm_model="gpt-4o-mini",retriever=None,filters=None,
+                     max_concurrency=DEFAULT_MAX_CONCURRENCY,reranker=None)->List[Dict]:
+    if retriever is None:
+        retriever=get_default_retriever()
+
+    total_start_time=time.time()
+    params={"llm_model":llm_model,"top_k":k,"batch_size":len(questions),"llm_backend":"openai"}
+
+    retrieval_start=time.time()
+    batch=retriever.retrieve_many(questions,k=candidate_count(k,reranker),filters=filters)
+    metrics={"retrieval_time_ms":(time.time()-retrieval_start)*1000}
+    if reranker is not None:
+        batch,rerank_info=reranker.rerank_many(questions,batch,k)
+        metrics.update(rerank_info)
+
+    def answer_one(item):
+        question,(retrieved,distances,ids)=item
         if not retrieved:
-            mlflow.log_metric("total_response_time_ms",(time.time()-total_start_time)*1000)
-            return {
-            "question": question,
-            "answer": "I don't know based on the provided information.",
-            "sources": [],
-            "prompt": ""
-        }
-        context=build_context(retrieved)
+            return {"question":question,"answer":"I don't know based on the provided information.","sources":[],"prompt":""}
+        context=build_context(retrieved,model=llm_model)
         prompt=build_prompt(question,context)
-        
-        #llm inference timing
-        llm_start=time.time()
         answer=call_llm_openai(prompt,model=llm_model)
-        llm_time=time.time()-llm_start
+        sources=build_sources(retrieved,distances)
+        return {"question":question,"answer":answer,"sources":sources,"prompt":prompt}
 
-        mlflow.log_metric("llm_inference_time_ms",llm_time*1000)
+    llm_start=time.time()
+    outcomes=map_bounded(answer_one,zip(questions,batch),max_concurrency)
+    metrics["llm_inference_time_ms"]=(time.time()-llm_start)*1000
 
-        #total response time
-        total_time=time.time()-total_start_time
-        mlflow.log_metric("total_response_time_ms",total_time*1000)
+    results=[]
+    for question,(ok,value) in zip(questions,outcomes):
+        results.append(value if ok else {"question":question,"error":f"{type(value).__name__}: {value}"})
+    metrics["batch_errors"]=sum(1 for ok,_ in outcomes if not ok)
+    metrics["total_response_time_ms"]=(time.time()-total_start_time)*1000
+    record_request_metrics(params,metrics)
+    return results
 
 
-        enc = tiktoken.encoding_for_model(llm_model)
-        print("ANSWER TOKENS:", len(enc.encode(answer)))
-        sources=[
-        {"asin":r.get("asin"),
-         "chunk_id":r.get("chunk_id"),
-         "product_name": r.get("product_name"),      
-         "distance":float(distances[i])}
-            for i,r in enumerate(retrieved)
-        ]
-        return {"question":question,"answer":answer,"sources":sources,"prompt":prompt}
 
+#async versions used by scripts: the shared generation pipeline (src/generation.py) with the OpenAI backend only.
+#The API keeps one long-lived GenerationService instead, so backend latency stats span requests.
+def _service(llm_model,retriever,client,executor,cache=None,reranker=None):
+    return GenerationService(LLMRouter([OpenAIBackend(client,llm_model)]),retriever,executor,cache,reranker)
+
+async def generate_answer_async(question:str,k=DEFAULT_K,llm_model="gpt-4o-mini",retriever=None,client=None,executor=None,cache=None,filters=None,reranker=None)->Dict:
+    return await _service(llm_model,retriever,client,executor,cache,reranker).answer(question,k,filters)
+
+#async batch: one batched retrieval on the executor, then at most max_concurrency completions in flight.
+#Results keep the order of `questions`; a failed item carries an "error" instead of an answer.
+async def generate_answers_async(questions:List[str],k=DEFAULT_K,llm_model="gpt-4o-mini",retriever=None,client=None,
+                                 executor=None,max_concurrency=DEFAULT_MAX_CONCURRENCY,filters=None,reranker=None)->List[Dict]:
+    return await _service(llm_model,retriever,client,executor,reranker=reranker).answer_many(questions,k,filters,max_concurrency)
+
+#streaming version of generate_answer_async: an async generator of (event, data) pairs
+#("sources", then "token" per LLM chunk, then "done" with timings)
+async def stream_answer(question:str,k=DEFAULT_K,llm_model="gpt-4o-mini",retriever=None,client=None,executor=None,filters=None,reranker=None):
+    async for event in _service(llm_model,retriever,client,executor,reranker=reranker).stream(question,k,filters):
+        yield event
 
 
 def format_result(result:Dict)->str:
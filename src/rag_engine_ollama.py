@@ -1,75 +1,37 @@
 """
 Implements the RAG answer generation logic using Ollama by combining retrieval results with an LLM prompt.
 
+The async path (`generate_answer_async`) runs the shared pipeline of src/generation.py with the Ollama
+backend: retrieval on a dedicated executor, the Ollama call through a shared keep-alive `httpx.AsyncClient`.
 """
 
-import re
 import textwrap
 import os
 import requests
-import mlflow
 import time     
 
-# from retriever import retrieve
-
-from src.retriever import retrieve
+from src.batching import DEFAULT_MAX_CONCURRENCY, map_bounded
+from src.context_builder import build_context as build_budgeted_context
+from src.generation import DEFAULT_K, GenerationService, build_prompt, build_sources
+from src.llm_backends import OLLAMA_MODEL, OLLAMA_TIMEOUT_SECONDS, OLLAMA_URL, OllamaBackend, create_ollama_client
+from src.llm_router import LLMRouter
+from src.metrics import record_request_metrics
+from src.reranker import candidate_count
+from src.retriever import get_default_retriever
 from typing import List, Dict
 
 
-#config
- 
-DEFAULT_K=5
-SYSTEM_INSTRUCTIONS = (
-    "You are an assistant that answers product questions using ONLY the provided context.\n"
-    "Cite sources inline like [source:ASIN:chunk_id].\n"
-    "If the answer is not supported by the context, respond: \"I don't know based on the provided information.\"\n"
-    "Do NOT guess product names unless they appear in the context.\n"   
-    "Keep answers short and factual. "
-    "Provide a short answer and then list sources used."
-)
-OLLAMA_MODEL = "mistral"
-mlflow.set_experiment("amazon-rag-latency")
-
-
-#clean the retrived text before passing to llm
-def clean_text(text:str)->str:
-    text = re.sub(r"\[\[(VIDEOID|ASIN)[^\]]*\]\]", "", text)
-    text = re.sub(r"\s+"," ",text).strip()
-    return text
-
-#Turn retrieved metadata dicts into a single context string.
-def build_context(retrieved:List[Dict])->str:
-    ctx_parts=[]
-    
-    for r in retrieved:
-        product = r.get("product_name", "Unknown Product")     
-        provenance=f"[source:{r.get('asin','unknown')}:{r.get('chunk_id','unknown')}]"
-        
-        #clean chunk text
-        txt=clean_text(r.get("chunk_text",""))
-
-        #Combine provenance tag +product name  + cleaned text
-        piece=(
-            f"{provenance}\n"
-            f"Product: {product}\n"             
-            f"{txt}\n"
-               )
-        ctx_parts.append(piece)
-        context="\n".join(ctx_parts)
-    return context 
+#Turn retrieved metadata dicts into a single context string,
+#packed to the model's token budget (mistral tokenizer counts stored at embed time, see context_builder.py)
+def build_context(retrieved:List[Dict],max_tokens:int=None,model:str=OLLAMA_MODEL)->str:
+    return build_budgeted_context(retrieved,model,max_tokens)
     
 
-#Assembling the final prompt string that is passed to the LLM
-def build_prompt(question:str,context:str,system_instructions:str=SYSTEM_INSTRUCTIONS)->str:
-    header="Use the following retrieved review excerpts as factual context:\n\n"
-    prompt=f"{system_instructions}\n\n{header}{context}\n\nQuestion: {question}\nAnswer concisely and cite sources."
-    return prompt
-
 #calling ollama llm
 def call_llm_ollama(prompt:str,model=OLLAMA_MODEL)->str:
-    response=requests.post("http://localhost:11434/api/generate",
+    response=requests.post(f"{OLLAMA_URL}/api/generate",
                            json={"model": model,"prompt": prompt,"stream": False},
-                           timeout=120
+                           timeout=OLLAMA_TIMEOUT_SECONDS
 
     )
     response.raise_for_status()
@@ -78,46 +40,126 @@ def call_llm_ollama(prompt:str,model=OLLAMA_MODEL)->str:
 
 #generate ans by retrieving chunks, building context and prompt, calling the LLM, 
 #returning the final answer with source metadata.
-def generate_answer(question:str,k=DEFAULT_K)->Dict:
+#`retriever` is the shared Retriever created at app startup (falls back to the process default).
+def generate_answer(question:str,k=DEFAULT_K,retriever=None,filters=None,reranker=None)->Dict:
+    if retriever is None:
+        retriever=get_default_retriever()
 
     total_start_time = time.time()
-    with mlflow.start_run(nested=True):
-        mlflow.log_param("llm_model", OLLAMA_MODEL)
-        mlflow.log_param("top_k", k) 
-
-        retrieval_start = time.time()
-        retrieved, distances,ids=retrieve(question,k=k)
-        retrieval_time = time.time() - retrieval_start
-        mlflow.log_metric("retrieval_time_ms", retrieval_time * 1000)
-
+    params={"llm_model": OLLAMA_MODEL, "top_k": k, "llm_backend": "ollama"}
+
+    retrieval_start = time.time()
+    retrieved, distances,ids=retriever.retrieve(question,k=candidate_count(k,reranker),filters=filters)
+    retrieval_time = time.time() - retrieval_start
+    metrics={"retrieval_time_ms": retrieval_time * 1000}
+    if reranker is not None and retrieved:
+        retrieved,distances,ids,rerank_info=reranker.rerank(question,retrieved,distances,ids,k)
+        metrics.update(rerank_info)
+
+    if not retrieved:
+        metrics["total_response_time_ms"]=(time.time() - total_start_time) * 1000
+        record_request_metrics(params,metrics)
+        return {
+        "question": question,
+        "answer": "I don't know based on the provided information.",
+        "sources": []
+        }
+    context=build_context(retrieved)
+    prompt=build_prompt(question,context)
+
+    llm_start = time.time()
+
+    answer=call_llm_ollama(prompt)
+
+    llm_time = time.time() - llm_start
+    metrics["llm_inference_time_ms"]=llm_time * 1000
+    total_time = time.time() - total_start_time
+    metrics["total_response_time_ms"]=total_time * 1000
+    record_request_metrics(params,metrics)
+
+    sources=build_sources(retrieved,distances)
+    return {"question":question,"answer":answer,"sources":sources,"prompt":prompt}
+
+
+
+#answer many questions: one batched retrieval (single encode + single index search),
+#then LLM calls with at most max_concurrency in flight.
+#Results keep the order of `questions`; a failed item carries an "error" instead of an answer.
+def generate_answers(questions:List[str],k=DEFAULT_K,retriever=None,filters=None,
+                     max_concurrency=DEFAULT_MAX_CONCURRENCY,reranker=None)->List[Dict]:
+    if retriever is None:
+        retriever=get_default_retriever()
+
+    total_start_time=time.time()
+    params={"llm_model":OLLAMA_MODEL,"top_k":k,"batch_size":len(questions),"llm_backend":"ollama"}
+
+    retrieval_start=time.time()
+    batch=retriever.retrieve_many(questions,k=candidate_count(k,reranker),filters=filters)
+    metrics={"retrieval_time_ms":(time.time()-retrieval_start)*1000}
+    if reranker is not None:
+        batch,rerank_info=reranker.rerank_many(questions,batch,k)
+        metrics.update(rerank_info)
+
+    def answer_one(item):
+        question,(retrieved,distances,ids)=item
         if not retrieved:
-            mlflow.log_metric("total_response_time_ms",(time.time() - total_start_time) * 1000)
-            return {
-            "question": question,
-            "answer": "I don't know based on the provided information.",
-            "sources": []
-            }
+            return {"question":question,"answer":"I don't know based on the provided information.","sources":[]}
         context=build_context(retrieved)
         prompt=build_prompt(question,context)
-    
-        llm_start = time.time()
-
         answer=call_llm_ollama(prompt)
-
-        llm_time = time.time() - llm_start  
-        mlflow.log_metric("llm_inference_time_ms", llm_time * 1000) 
-        total_time = time.time() - total_start_time  
-        mlflow.log_metric("total_response_time_ms", total_time * 1000) 
-
-        sources=[
-            {"asin":r.get("asin"),
-            "chunk_id":r.get("chunk_id"),
-            "product_name": r.get("product_name"),      
-            "distance":float(distances[i])}
-            for i,r in enumerate(retrieved)
-            ]
+        sources=build_sources(retrieved,distances)
         return {"question":question,"answer":answer,"sources":sources,"prompt":prompt}
 
+    llm_start=time.time()
+    outcomes=map_bounded(answer_one,zip(questions,batch),max_concurrency)
+    metrics["llm_inference_time_ms"]=(time.time()-llm_start)*1000
+
+    results=[]
+    for question,(ok,value) in zip(questions,outcomes):
+        results.append(value if ok else {"question":question,"error":f"{type(value).__name__}: {value}"})
+    metrics["batch_errors"]=sum(1 for ok,_ in outcomes if not ok)
+    metrics["total_response_time_ms"]=(time.time()-total_start_time)*1000
+    record_request_metrics(params,metrics)
+    return results
+
+
+
+#async versions used by scripts: the shared generation pipeline (src/generation.py) with the Ollama backend only.
+#The API keeps one long-lived GenerationService instead, so backend latency stats span requests.
+#Without a shared `client` each call opens (and closes) its own.
+def _service(client,retriever,executor,cache=None,reranker=None):
+    router=LLMRouter([OllamaBackend(client if client is not None else create_ollama_client())])
+    return GenerationService(router,retriever,executor,cache,reranker)
+
+async def generate_answer_async(question:str,k=DEFAULT_K,retriever=None,client=None,executor=None,cache=None,filters=None,reranker=None)->Dict:
+    service=_service(client,retriever,executor,cache,reranker)
+    try:
+        return await service.answer(question,k,filters)
+    finally:
+        if client is None:
+            await service.aclose()
+
+#async batch: one batched retrieval on the executor, then at most max_concurrency LLM calls in flight.
+#Results keep the order of `questions`; a failed item carries an "error" instead of an answer.
+async def generate_answers_async(questions:List[str],k=DEFAULT_K,retriever=None,client=None,executor=None,
+                                 max_concurrency=DEFAULT_MAX_CONCURRENCY,filters=None,reranker=None)->List[Dict]:
+    service=_service(client,retriever,executor,reranker=reranker)
+    try:
+        return await service.answer_many(questions,k,filters,max_concurrency)
+    finally:
+        if client is None:
+            await service.aclose()
+
+#streaming version of generate_answer_async: an async generator of (event, data) pairs
+#("sources", then "token" per LLM chunk, then "done" with timings)
+async def stream_answer(question:str,k=DEFAULT_K,retriever=None,client=None,executor=None,filters=None,reranker=None):
+    service=_service(client,retriever,executor,reranker=reranker)
+    try:
+        async for event in service.stream(question,k,filters):
+            yield event
+    finally:
+        if client is None:
+            await service.aclose()
 
 
 def format_result(result:Dict)->str:
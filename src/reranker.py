@@ -0,0 +1,134 @@
+"""
+Optional cross-encoder rerank stage between retrieval and context building.
+    The retriever returns the top `candidates` chunks by vector (or hybrid) rank
+    A cross-encoder scores every (question, chunk) pair in one batched forward pass
+    The best k by cross-encoder score go into the prompt
+
+The forward pass runs on a dedicated thread and is given a millisecond budget: when it does
+not finish in time the caller keeps the first k candidates in retrieval order instead of waiting.
+Concurrent requests take turns on the model, and the wait for a turn counts against the budget.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+RERANK_MODEL="cross-encoder/ms-marco-MiniLM-L-6-v2"
+#chunks retrieved per question when reranking (the cross-encoder picks k of these)
+DEFAULT_RERANK_CANDIDATES=20
+DEFAULT_RERANK_BUDGET_MS=150
+RERANK_BATCH_SIZE=64
+#cross-encoder input length in tokens (question + chunk)
+RERANK_MAX_LENGTH=256
+
+
+#how many chunks to retrieve so the reranker has something to choose from
+def candidate_count(k,reranker=None):
+    return k if reranker is None else max(k,reranker.candidates)
+
+#keep the first k of a (results, distances, ids) triple in their current order
+def truncate(retrieved,distances,ids,k):
+    return retrieved[:k],distances[:k],ids[:k]
+
+
+class Reranker:
+    """
+    Cross-encoder reranker with a latency budget. Create one per process and share it.
+    """
+
+    def __init__(self,model_name=RERANK_MODEL,candidates=DEFAULT_RERANK_CANDIDATES,
+                 budget_ms=DEFAULT_RERANK_BUDGET_MS,batch_size=RERANK_BATCH_SIZE,max_length=RERANK_MAX_LENGTH):
+        self.model_name=model_name
+        self.candidates=candidates
+        self.budget_ms=budget_ms
+        self.batch_size=batch_size
+        from sentence_transformers import CrossEncoder
+        self.model=CrossEncoder(model_name,max_length=max_length)
+        # one forward pass at a time: concurrent callers queue for the model within their own budget;
+        # a pass that blew its budget keeps running here while its caller moves on
+        self._pool=ThreadPoolExecutor(max_workers=1,thread_name_prefix="rerank")
+        self._model_slot=threading.BoundedSemaphore(1)
+        self._lock=threading.Lock()
+        self._overran=0
+
+    #one untimed forward pass so the first request does not pay for lazy initialisation
+    def warm_up(self,pairs):
+        self.model.predict(pairs,batch_size=self.batch_size,convert_to_numpy=True)
+
+    def _score(self,pairs):
+        try:
+            return np.asarray(self.model.predict(pairs,batch_size=self.batch_size,convert_to_numpy=True),dtype=np.float32)
+        finally:
+            self._model_slot.release()
+
+    def _overran_pass_finished(self,future):
+        with self._lock:
+            self._overran-=1
+
+    def score(self,pairs,budget_ms=None):
+        """
+        Cross-encoder scores for (question, text) pairs, or None when the budget ran out: waiting for
+        the model (other requests' passes) and the pass itself share the budget. Returns None at once
+        while a pass that overran its own budget is still occupying the model.
+        """
+        budget_ms=self.budget_ms if budget_ms is None else budget_ms
+        deadline=None if budget_ms is None else time.perf_counter()+budget_ms/1000
+
+        def remaining():
+            return None if deadline is None else max(deadline-time.perf_counter(),0.0)
+
+        with self._lock:
+            if self._overran:
+                return None
+        if not self._model_slot.acquire(timeout=remaining()):
+            return None
+        if remaining()==0.0:
+            self._model_slot.release()
+            return None
+        future=self._pool.submit(self._score,pairs)
+        try:
+            return future.result(timeout=remaining())
+        except FutureTimeoutError:
+            with self._lock:
+                self._overran+=1
+            # runs right away when the pass finished in the meantime
+            future.add_done_callback(self._overran_pass_finished)
+            return None
+
+    def rerank_many(self,questions,batch,k,budget_ms=None):
+        """
+        Rerank every question's (results, distances, ids) candidates with a single forward pass.
+        Returns (reranked batch, info) where info has rerank_time_ms and rerank_fallback (1 when
+        the budget ran out and the retrieval order was kept). Reranked results carry a rerank_score.
+        """
+        start=time.time()
+        pairs=[]
+        for question,(retrieved,_,_) in zip(questions,batch):
+            pairs.extend((question,r.get("chunk_text") or "") for r in retrieved)
+        scores=self.score(pairs,budget_ms) if pairs else np.zeros(0,dtype=np.float32)
+
+        out=[]
+        pos=0
+        for retrieved,distances,ids in batch:
+            if scores is None:
+                out.append(truncate(retrieved,distances,ids,k))
+                continue
+            own=scores[pos:pos+len(retrieved)]
+            pos+=len(retrieved)
+            order=np.argsort(-own,kind="stable")[:k]
+            reranked=[]
+            for i in order:
+                result=dict(retrieved[i])
+                result["rerank_score"]=float(own[i])
+                reranked.append(result)
+            out.append((reranked,np.asarray(distances)[order],np.asarray(ids)[order]))
+
+        info={"rerank_time_ms":(time.time()-start)*1000,"rerank_fallback":int(scores is None)}
+        return out,info
+
+    def rerank(self,question,retrieved,distances,ids,k,budget_ms=None):
+        (result,),info=self.rerank_many([question],[(retrieved,distances,ids)],k,budget_ms)
+        return (*result,info)
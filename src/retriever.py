@@ -1,23 +1,72 @@
 """
 Uses a FAISS index to retrieve the most relevant review chunks for a user query.
-    Loads FAISS index and associated metadata    
+    Loads FAISS index and associated metadata
     Embeds the user query using a sentence transformer
     Retrieves the top k most similar review chunks
     Returns matched chunks with distance scores
+
+The index, metadata and encoder are loaded once by a `Retriever` object and reused
+for every query. The module level `retrieve()` is a thin wrapper over a default instance.
+
+When a BM25 index built for this FAISS index exists (bm25_builder.py) retrieval is hybrid: the
+lexical search runs in parallel with the vector search and both rankings are fused with reciprocal
+rank fusion.
+
+Every retrieve call accepts optional metadata `filters` (see filters.py); they are applied inside
+the FAISS search through an id selector, so filtered queries still return k hits when k rows match.
+
+When product partitions exist (faiss_builder.py --partitions), a query scoped to products (a
+parent_asin filter, or an ASIN from the routing table named in the question) searches only
+those products' vectors; all other queries use the global index.
+
+The FAISS index is opened with IO_FLAG_MMAP_IFC where faiss has it: the stored vector codes (flat,
+SQ, HNSW storage, IVF lists) stay in the mapped file and are paged in on use instead of being copied
+into process memory; graph links and quantizers are still read normally. sentence_transformers is only imported when an encoder is loaded; warm_up()
+runs a dummy query so the first request does not pay for lazy initialisation.
 """
 import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from src.filters import FilterColumns, normalize_filters
+from src.index_params import apply_search_params, filtered_search_parameters, index_version, load_search_params
+from src.lexical_index import LEXICAL_INDEX_DIR, LexicalIndex, lexical_index_exists, reciprocal_rank_fusion
+from src.metadata_store import METADATA_STORE_DIR, MetadataStore, store_exists
+from src.partitions import PARTITION_DIR, PartitionedIndex, partitions_exist
+from src.tracing import span
+
+logger=logging.getLogger(__name__)
 
 FAISS_INDEX_FILE="data/faiss/electronics.index"
 METADATA_FILE="data/embeddings/electronics_metadata.jsonl"
+EMBEDDING_MODEL="sentence-transformers/all-mpnet-base-v2"
+
+#hybrid retrieval: each side returns k*HYBRID_DEPTH candidates before fusion
+HYBRID_DEPTH=4
+RRF_K=60
+#map the index's vector codes from the file instead of copying them into memory
+FAISS_MMAP=True
+WARMUP_QUERY="Is this product worth the price?"
 
-#LOAD FAISS INDEX
-def load_faiss_index(path=FAISS_INDEX_FILE):
-    return faiss.read_index(path)
+#LOAD FAISS INDEX (and apply the nprobe/efSearch it was built with)
+#(faiss builds without IO_FLAG_MMAP_IFC, and indexes it cannot map, are read normally)
+def load_faiss_index(path=FAISS_INDEX_FILE,mmap=FAISS_MMAP):
+    index=None
+    flag=getattr(faiss,"IO_FLAG_MMAP_IFC",None)
+    if mmap and flag is not None:
+        try:
+            index=faiss.read_index(path,flag)
+        except RuntimeError:
+            index=None
+    if index is None:
+        index=faiss.read_index(path)
+    return apply_search_params(index,load_search_params(path))
 
-#load metadata
+#load metadata (full parse of the JSONL; prefer open_metadata for serving)
 def load_metadata(path=METADATA_FILE):
     metadata=[]
     with open(path,"r") as f:
@@ -25,39 +74,299 @@ def load_metadata(path=METADATA_FILE):
             metadata.append(json.loads(line))
     return metadata
 
+#open the mmap metadata store when it exists, otherwise fall back to parsing the JSONL
+def open_metadata(store_path=METADATA_STORE_DIR,jsonl_path=METADATA_FILE):
+    if store_exists(store_path):
+        return MetadataStore(store_path)
+    return load_metadata(jsonl_path)
+
+#load the sentence transformer used for queries
+#(imported here: sentence_transformers pulls in torch, which dominates import time)
+def load_encoder(model_name=EMBEDDING_MODEL):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
 
-#embed user query
-def embed_query(query):
-    model=SentenceTransformer("sentence-transformers/all-mpnet-base-v2")
+
+#embed user query (pass a loaded model to avoid constructing a new one per call)
+def embed_query(query,model=None):
+    if model is None:
+        model=load_encoder()
     emb=model.encode(query,convert_to_numpy=True)
     return emb.astype(np.float32).reshape(1,-1)
 
+#embed many queries in one encode call -> (n,dim) float32 matrix
+def embed_queries(queries,model=None):
+    if model is None:
+        model=load_encoder()
+    emb=model.encode(list(queries),convert_to_numpy=True)
+    return np.ascontiguousarray(emb,dtype=np.float32).reshape(len(queries),-1)
+
 #search faiss
 def search_faiss(index,query_vector,k=5):
     distances, ids =index.search(query_vector,k)
     return distances[0],ids[0]
 
+#search faiss with a whole query matrix at once -> one (distances, ids) row per query
+def search_faiss_many(index,query_vectors,k=5):
+    distances, ids =index.search(query_vectors,k)
+    return list(zip(distances,ids))
+
+#search faiss restricted to a FilterSelection; when an approximate index comes back short
+#(too few matching vectors in the probed lists / visited nodes) nprobe or efSearch is widened and the search retried
+def search_faiss_filtered(index,query_vectors,k,selection):
+    expected=min(k,selection.count)
+    widen=1
+    while True:
+        params,exhaustive=filtered_search_parameters(index,selection.selector(),widen)
+        distances, ids =index.search(query_vectors,k,params=params)
+        if exhaustive or (ids>=0).sum(axis=1).min()>=expected:
+            return distances,ids
+        widen*=4
+
+#faiss pads with id -1 when fewer than k vectors match
+def drop_missing(distances,ids):
+    keep=ids>=0
+    return distances[keep],ids[keep]
+
+#IVF indexes need a direct map before vectors can be reconstructed by id
+def enable_reconstruct(index):
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass
+    return index
+
 # Map FAISS IDs to metadata rows
+# (rows are copied so the shared metadata is never mutated)
 def get_results(ids, metadata):
     results = []
     for id_ in ids:
-        result = metadata[id_]   
-        result["product_name"] = result.get("product_name", "Unknown Product")
+        result = dict(metadata[int(id_)])
+        result["product_name"] = result.get("product_name") or "Unknown Product"
         result["parent_asin"] = result.get("parent_asin", None)
-        result["review_title"] = result.get("review_title", "")
+        result["review_title"] = result.get("review_title") or ""
 
         results.append(result)
 
     return results
 
+
+class Retriever:
+    """
+    Holds the FAISS index, chunk metadata and query encoder for the lifetime of the process.
+    Create one per process (e.g. in the FastAPI lifespan hook) and share it across requests.
+    """
+
+    def __init__(self,index_path=FAISS_INDEX_FILE,metadata_path=METADATA_FILE,model_name=EMBEDDING_MODEL,
+                 metadata_store_path=METADATA_STORE_DIR,lexical_path=LEXICAL_INDEX_DIR,hybrid=True,
+                 partition_path=PARTITION_DIR,model=None):
+        self.index_path=index_path
+        self.metadata_path=metadata_path
+        self.metadata_store_path=metadata_store_path
+        self.model_name=model_name
+
+        #ms spent on each loading step (reported by the API's /health)
+        self.load_timings={}
+        start=time.perf_counter()
+        self.index=load_faiss_index(index_path)
+        self.index_version=index_version(index_path)
+        self.load_timings["index_load_ms"]=(time.perf_counter()-start)*1000
+        start=time.perf_counter()
+        self.metadata=open_metadata(metadata_store_path,metadata_path)
+        self.load_timings["metadata_open_ms"]=(time.perf_counter()-start)*1000
+        # an already loaded encoder (anything with SentenceTransformer's encode) skips loading model_name
+        start=time.perf_counter()
+        self.model=model if model is not None else load_encoder(model_name)
+        self.load_timings["encoder_load_ms"]=(time.perf_counter()-start)*1000
+
+        self._filter_columns=None
+        self.partitions=None
+        if partitions_exist(partition_path,self.index_version):
+            self.partitions=PartitionedIndex(partition_path)
+
+        self.lexical=None
+        if hybrid and lexical_index_exists(lexical_path,self.index_version,self.index.ntotal):
+            self.lexical=LexicalIndex(lexical_path)
+            enable_reconstruct(self.index)
+            # BM25 lookups run here while the calling thread embeds + searches FAISS
+            self._lexical_pool=ThreadPoolExecutor(max_workers=2,thread_name_prefix="bm25")
+        elif hybrid and lexical_index_exists(lexical_path):
+            # postings of another index build would be fused onto the wrong chunks
+            logger.warning("BM25 index %s was built for another FAISS index; using vector search only (rerun bm25_builder)",lexical_path)
+
+    def warm_up(self,query=WARMUP_QUERY):
+        """
+        Dummy encode (first forward pass: kernels, allocator, tokenizer) and a full retrieval (index pages,
+        lexical pool, metadata) -> (results, ms per step).
+        """
+        timings={}
+        start=time.perf_counter()
+        self.embed_query(query)
+        timings["encoder_warm_ms"]=(time.perf_counter()-start)*1000
+        start=time.perf_counter()
+        results,_,_=self.retrieve(query)
+        timings["retrieval_warm_ms"]=(time.perf_counter()-start)*1000
+        return results,timings
+
+    def embed_query(self,query):
+        with span("encode"):
+            return embed_query(query,model=self.model)
+
+    #FilterSelection for a filter dict, or None when it filters nothing
+    def filter_selection(self,filters):
+        filters=normalize_filters(filters)
+        if filters is None:
+            return None
+        if self._filter_columns is None:
+            self._filter_columns=FilterColumns(self.metadata)
+        return self._filter_columns.select(filters)
+
+    def product_scope(self,query,filters):
+        """
+        Resolve which products a query is about -> (filters, parent_asins or None).
+        An explicit parent_asin filter wins; otherwise ASINs named in the question are added to the filters.
+        parent_asins is only returned when every product has a partition to search.
+        """
+        filters=normalize_filters(filters)
+        if self.partitions is None:
+            return filters,None
+        asins=(filters or {}).get("parent_asin")
+        if not asins and query:
+            asins=self.partitions.detect(query)
+            if asins:
+                filters={**(filters or {}),"parent_asin":asins}
+        return filters,(asins if asins and self.partitions.covers(asins) else None)
+
+    def search(self,query_vector,k=5,selection=None,scope=None):
+        with span("search",k=k,filtered=selection is not None,partitioned=scope is not None):
+            return self._search(query_vector,k,selection,scope)
+
+    def _search(self,query_vector,k,selection,scope):
+        if scope is not None:
+            distances,ids=self.partitions.search(query_vector,k,scope,None if selection is None else selection.mask)
+            return drop_missing(distances[0],ids[0])
+        if selection is None:
+            return drop_missing(*search_faiss(self.index,query_vector,k))
+        distances,ids=search_faiss_filtered(self.index,query_vector,k,selection)
+        return drop_missing(distances[0],ids[0])
+
+    def _submit_lexical(self,query,depth,selection):
+        return self._lexical_pool.submit(self.lexical.search,query,depth,None if selection is None else selection.mask)
+
+    #L2 distances for fused ids: reuse the FAISS ones, reconstruct vectors for lexical-only hits
+    def _fused_distances(self,query_vector,ids,vector_distances):
+        known=dict(zip(vector_distances[1].tolist(),vector_distances[0].tolist()))
+        out=np.array([known.get(int(i),np.nan) for i in ids],dtype=np.float32)
+        missing=np.flatnonzero(np.isnan(out))
+        if len(missing):
+            try:
+                vectors=self.index.reconstruct_batch(ids[missing].astype(np.int64))
+                out[missing]=((vectors-query_vector.reshape(1,-1))**2).sum(axis=1)
+            except RuntimeError:
+                # index cannot reconstruct: lexical-only hits get the worst vector distance seen
+                out[missing]=max(known.values(),default=0.0)
+        return out
+
+    #fuse one query's vector and lexical rankings with RRF
+    def _fuse(self,query_vector,k,distances,ids,lexical_ids):
+        _,fused_ids=reciprocal_rank_fusion([ids,lexical_ids],k,RRF_K)
+        return fused_ids,self._fused_distances(query_vector,fused_ids,(distances,ids))
+
+    #search + metadata lookup for an already embedded query
+    #(pass the query text as well to get hybrid BM25 + vector results when a lexical index is loaded)
+    def retrieve_vector(self,query_vector,k=5,query=None,lexical_future=None,filters=None):
+        filters,scope=self.product_scope(query,filters)
+        selection=self.filter_selection(filters)
+        if selection is not None and selection.count==0:
+            return [],np.zeros(0,dtype=np.float32),np.zeros(0,dtype=np.int64)
+        if self.lexical is None or query is None:
+            distances,ids=self.search(query_vector,k,selection,scope)
+        else:
+            depth=k*HYBRID_DEPTH
+            if lexical_future is None:
+                lexical_future=self._submit_lexical(query,depth,selection)
+            distances,ids=self.search(query_vector,depth,selection,scope)
+            with span("bm25_wait"):
+                _,lexical_ids=lexical_future.result()
+            with span("fusion"):
+                ids,distances=self._fuse(query_vector,k,distances,ids,lexical_ids)
+        with span("metadata",rows=len(ids)):
+            results=get_results(ids,self.metadata)
+        return results, distances, ids
+
+    #Full retrieval pipeline
+    def retrieve(self,query,k=5,filters=None):
+        lexical_future=None
+        if self.lexical is not None:
+            scoped_filters,_=self.product_scope(query,filters)
+            lexical_future=self._submit_lexical(query,k*HYBRID_DEPTH,self.filter_selection(scoped_filters))
+        return self.retrieve_vector(self.embed_query(query),k,query=query,lexical_future=lexical_future,filters=filters)
+
+    #batched retrieval: one encode call and one matrix search for all queries (results keep query order)
+    #the same filters apply to every query; product-scoped queries are searched in their partitions
+    def retrieve_many(self,queries,k=5,filters=None):
+        if not queries:
+            return []
+        scoped=[self.product_scope(q,filters) for q in queries]
+        selections=[self.filter_selection(f) for f,_ in scoped]
+        depth=k if self.lexical is None else k*HYBRID_DEPTH
+        lexical_futures=[]
+        if self.lexical is not None:
+            lexical_futures=[self._submit_lexical(q,depth,sel) for q,sel in zip(queries,selections)]
+        with span("encode",batch=len(queries)):
+            query_vectors=embed_queries(queries,model=self.model)
+
+        rows=[None]*len(queries)
+        unscoped=[i for i,(_,scope) in enumerate(scoped) if scope is None]
+        if unscoped:
+            # unscoped queries share the filters, so one matrix search covers them all
+            selection=selections[unscoped[0]]
+            with span("search",k=depth,batch=len(unscoped),filtered=selection is not None):
+                if selection is None:
+                    found=search_faiss_many(self.index,query_vectors[unscoped],depth)
+                else:
+                    found=list(zip(*search_faiss_filtered(self.index,query_vectors[unscoped],depth,selection)))
+            for i,row in zip(unscoped,found):
+                rows[i]=drop_missing(*row)
+        for i,(_,scope) in enumerate(scoped):
+            if scope is not None:
+                rows[i]=self.search(query_vectors[i:i+1],depth,selections[i],scope)
+
+        batch=[]
+        with span("metadata",batch=len(queries)):
+            for i,(distances,ids) in enumerate(rows):
+                if lexical_futures:
+                    _,lexical_ids=lexical_futures[i].result()
+                    ids,distances=self._fuse(query_vectors[i],k,distances,ids,lexical_ids)
+                batch.append((get_results(ids,self.metadata),distances,ids))
+        return batch
+
+
+_default_retriever=None
+_default_lock=threading.Lock()
+
+#lazily build the process wide retriever the first time it is needed
+def get_default_retriever():
+    global _default_retriever
+    if _default_retriever is None:
+        with _default_lock:
+            if _default_retriever is None:
+                _default_retriever=Retriever()
+    return _default_retriever
+
+#install an already constructed retriever as the process wide default (used by the API lifespan hook)
+def set_default_retriever(retriever):
+    global _default_retriever
+    _default_retriever=retriever
+
+
 #Full retrieval pipeline
-def retrieve(query,k=5):
-    index=load_faiss_index()
-    metadata=load_metadata()
-    query_vector=embed_query(query)  
-    distances,ids=search_faiss(index,query_vector,k)
-    results=get_results(ids,metadata)  
-    return results, distances, ids
+def retrieve(query,k=5,filters=None):
+    return get_default_retriever().retrieve(query,k=k,filters=filters)
+
+#batched retrieval pipeline -> [(results, distances, ids)] in query order
+def retrieve_many(queries,k=5,filters=None):
+    return get_default_retriever().retrieve_many(queries,k=k,filters=filters)
 
 
 if __name__ == "__main__":
@@ -68,11 +377,5 @@ if __name__ == "__main__":
     print("\nTop Results:")
     for r, d in zip(results, distances):
         print("\nDistance:", d)
-        print("Product:", r["product_name"])              
+        print("Product:", r["product_name"])
         print("Chunk text:", r["chunk_text"][:200], "...")
-
-
-
-
-
-
@@ -0,0 +1,216 @@
+"""
+Representative review subsets of any size in one pass over a (gzipped) JSONL dump.
+    --by none          uniform reservoir sample (Algorithm L: skipped lines are not even parsed)
+    --by rating|year|parent_asin
+                       stratified, in two passes: the first counts every stratum and splits the sample
+                       size across strata (proportional to their size, or equal shares) by largest
+                       remainder, a stratum smaller than its share giving the rest to the others; the
+                       second fills one reservoir per stratum sized to its share. Memory is the sample
+                       plus one counter per stratum
+    --per-stratum m    at most m records per stratum (e.g. at most m reviews per product with --by parent_asin)
+    --start/--stop     sample only records [start, stop) of an indexed dump (see gzip_index.py)
+
+The sample is written in the dump's order and depends only on the input and --seed.
+Replaces taking the first 50,000 lines (extract_50k.py) for building the dev corpus.
+"""
+
+import argparse
+import gzip
+import math
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from src.gzip_index import GzipRecordReader, index_exists
+from src.ingest import loads, open_lines
+
+RAW_FILE="data/raw/electronics_full.jsonl.gz"
+SAMPLE_FILE="data/raw/electronics_sample.jsonl"
+DEFAULT_SAMPLE_SIZE=50000
+STRATA=("none","rating","year","parent_asin")
+ALLOCATIONS=("proportional","equal")
+
+
+#stratum of a review (timestamps are epoch milliseconds)
+def stratum_key(by):
+    if by=="rating":
+        return lambda review: review.get("rating")
+    if by=="year":
+        return lambda review: time.gmtime(review["timestamp"]/1000).tm_year if review.get("timestamp") else None
+    if by=="parent_asin":
+        return lambda review: review.get("parent_asin")
+    raise ValueError(f"unknown stratum: {by}")
+
+
+def reservoir_sample(items,n,rng):
+    """
+    Uniform sample of n items from an iterable of unknown length (Algorithm L), as (position, item)
+    pairs; items between sampled positions are skipped without being looked at.
+    """
+    if n<=0:
+        return []
+    reservoir=[]
+    items=iter(items)
+    for position,item in enumerate(items):
+        reservoir.append((position,item))
+        if len(reservoir)==n:
+            break
+    if len(reservoir)<n:
+        return reservoir
+    w=math.exp(math.log(rng.random())/n)
+    position=n-1
+    while True:
+        skip=int(math.log(rng.random())/math.log(1-w))
+        position+=skip+1
+        for _ in range(skip):
+            if next(items,None) is None:
+                return reservoir
+        item=next(items,None)
+        if item is None:
+            return reservoir
+        reservoir[rng.randrange(n)]=(position,item)
+        w*=math.exp(math.log(rng.random())/n)
+
+
+class Reservoir:
+    """
+    Uniform sample of at most `capacity` items of one stratum (Algorithm R).
+    """
+
+    def __init__(self,capacity,rng):
+        self.capacity=capacity
+        self.rng=rng
+        self.items=[]
+        self.seen=0
+
+    def add(self,item):
+        self.seen+=1
+        if len(self.items)<self.capacity:
+            self.items.append(item)
+            return
+        j=self.rng.randrange(self.seen)
+        if j<self.capacity:
+            self.items[j]=item
+
+
+def allocate(sizes,available,n,allocation="proportional"):
+    """
+    Records to take from each stratum: sizes are the stratum sizes, available what each can give.
+    Shares are split by largest remainder; shares a stratum cannot fill go to the others.
+    """
+    quota={s:0 for s in sizes}
+    remaining=min(n,sum(available.values()))
+    while remaining>0:
+        open_strata=[s for s in sizes if quota[s]<available[s]]
+        weights={s:(sizes[s] if allocation=="proportional" else 1) for s in open_strata}
+        total=sum(weights.values())
+        exact={s:remaining*weights[s]/total for s in open_strata}
+        share={s:min(int(exact[s]),available[s]-quota[s]) for s in open_strata}
+        leftover=remaining-sum(share.values())
+        for s in sorted(open_strata,key=lambda s:(exact[s]-int(exact[s]),weights[s]),reverse=True):
+            if leftover==0:
+                break
+            if share[s]<available[s]-quota[s]:
+                share[s]+=1
+                leftover-=1
+        for s in open_strata:
+            quota[s]+=share[s]
+        given=sum(share.values())
+        if given==0:
+            break
+        remaining-=given
+    return quota
+
+
+#first pass: records per stratum
+def stratum_sizes(lines,by):
+    key=stratum_key(by)
+    return Counter(key(loads(line)) for line in lines)
+
+def stratified_sample(lines,quota,by,rng):
+    """
+    Second pass: (position, line) pairs of a uniform sample of quota[stratum] records from every stratum.
+    """
+    key=stratum_key(by)
+    reservoirs={s:Reservoir(q,rng) for s,q in quota.items() if q>0}
+    for position,line in enumerate(lines):
+        reservoir=reservoirs.get(key(loads(line)))
+        if reservoir is not None:
+            reservoir.add((position,line))
+    return [item for reservoir in reservoirs.values() for item in reservoir.items]
+
+
+#the dump's lines, or records [start, stop) through the gzip index
+@contextmanager
+def open_records(path,start=0,stop=None):
+    if start>0 or stop is not None:
+        yield GzipRecordReader(path).read_range(start,stop)
+    else:
+        with open_lines(path) as f:
+            yield f
+
+
+def sample_file(path=RAW_FILE,output=SAMPLE_FILE,n=DEFAULT_SAMPLE_SIZE,by="none",allocation="proportional",
+                per_stratum=None,seed=0,start=0,stop=None):
+    """
+    Write a sample of `path` (records [start, stop) when given, through the gzip index) to `output`.
+    Stratified samples read the input twice (count, then sample).
+    Returns {stratum: (size, taken)} (one "all" stratum for --by none).
+    """
+    rng=random.Random(seed)
+    if (start>0 or stop is not None) and not index_exists(path):
+        raise ValueError(f"sampling a record range needs an index: python -m src.gzip_index build {path}")
+    if by=="none":
+        with open_records(path,start,stop) as lines:
+            sample=reservoir_sample(lines,n,rng)
+        summary=None
+    else:
+        with open_records(path,start,stop) as lines:
+            sizes=stratum_sizes(lines,by)
+        available={s:size if per_stratum is None else min(size,per_stratum) for s,size in sizes.items()}
+        quota=allocate(sizes,available,n,allocation)
+        with open_records(path,start,stop) as lines:
+            sample=stratified_sample(lines,quota,by,rng)
+        summary={s:(sizes[s],quota[s]) for s in sizes}
+    sample.sort(key=lambda item:item[0])
+
+    opener=gzip.open if output.endswith(".gz") else open
+    with opener(output,"wb") as out:
+        for _,line in sample:
+            out.write(line if line.endswith(b"\n") else line+b"\n")
+    if summary is None:
+        summary={"all":(None,len(sample))}
+    return summary
+
+
+def parse_args():
+    parser=argparse.ArgumentParser(description="Reservoir / stratified sample of a JSONL(.gz) review dump")
+    parser.add_argument("--input",default=RAW_FILE)
+    parser.add_argument("--output",default=SAMPLE_FILE)
+    parser.add_argument("--size",type=int,default=DEFAULT_SAMPLE_SIZE)
+    parser.add_argument("--by",choices=STRATA,default="none")
+    parser.add_argument("--allocation",choices=ALLOCATIONS,default="proportional")
+    parser.add_argument("--per-stratum",type=int,default=None,help="at most this many records per stratum")
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--start",type=int,default=0,help="first record (needs the gzip index)")
+    parser.add_argument("--stop",type=int,default=None,help="end record, exclusive (needs the gzip index)")
+    args=parser.parse_args()
+    if args.size<0:
+        parser.error("--size must be >= 0")
+    return args
+
+def main():
+    args=parse_args()
+    t0=time.time()
+    summary=sample_file(args.input,args.output,args.size,args.by,args.allocation,args.per_stratum,
+                        args.seed,args.start,args.stop)
+    taken=sum(t for _,t in summary.values())
+    print(f"Sampled {taken} records in {time.time()-t0:.1f}s → {args.output}")
+    if args.by!="none":
+        counts=Counter({s:t for s,(_,t) in summary.items()})
+        print(f"{len(summary)} strata; largest: "+", ".join(f"{s}: {summary[s][1]}/{summary[s][0]}" for s,_ in counts.most_common(10)))
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+Server-Sent Events helpers for the streaming answer endpoints.
+    Each event is written as `event: <name>` + `data: <json>` followed by a blank line
+    Events emitted by the engines: sources, token (many), done (timings) or error
+"""
+
+import json
+
+from fastapi.responses import StreamingResponse
+
+
+def format_sse(event:str,data)->str:
+    return f"event: {event}\ndata: {json.dumps(data,ensure_ascii=False)}\n\n"
+
+
+#wrap an async generator of (event, data) pairs into a text/event-stream response
+def sse_response(events)->StreamingResponse:
+    async def body():
+        async for event,data in events:
+            yield format_sse(event,data)
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        # disable proxy buffering so tokens reach the client as they are produced
+        headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"},
+    )
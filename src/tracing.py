@@ -0,0 +1,225 @@
+"""
+Per-request span tracing for the generation pipeline.
+    The API opens a Trace per request (start_trace); code on the request path wraps its stages in
+    `with span("name"):` (encode, search, metadata, context, tokenize, prompt, llm, serialize, ...)
+    The current trace/span live in context variables, so spans nest by themselves, and calls handed to
+    the retrieval executor through run_in_executor keep the request's trace; outside a request
+    (scripts, benchmarks) span() does nothing
+    A finished trace gives the span tree (the API's optional "debug" field), per-stage totals
+    (the Server-Timing header) and is written to a rotating JSONL trace log when the request took at
+    least SLOW_REQUEST_MS (and for a TRACE_SAMPLE_RATE fraction of all requests); log records go
+    through a queue, so the file write happens on a listener thread
+"""
+
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+SLOW_REQUEST_MS=3000
+#fraction of all requests whose trace is logged regardless of latency
+TRACE_SAMPLE_RATE=0.0
+TRACE_LOG_FILE="logs/slow_requests.jsonl"
+TRACE_LOG_MAX_BYTES=10*1024*1024
+TRACE_LOG_BACKUPS=5
+
+_current_trace=contextvars.ContextVar("rag_trace",default=None)
+_current_span=contextvars.ContextVar("rag_span",default=None)
+_span_ids=itertools.count(1)
+
+
+class Span:
+    __slots__=("id","name","parent","start","end","attrs")
+
+    def __init__(self,name,parent,start,attrs):
+        self.id=next(_span_ids)
+        self.name=name
+        self.parent=parent
+        self.start=start
+        self.end=None
+        self.attrs=attrs
+
+
+class Trace:
+    def __init__(self,name,**attrs):
+        self.name=name
+        self.attrs=attrs
+        self.spans=[]
+        self.start=time.perf_counter()
+        self.end=None
+
+    def finish(self):
+        if self.end is None:
+            self.end=time.perf_counter()
+
+    @property
+    def total_ms(self):
+        return ((self.end or time.perf_counter())-self.start)*1000
+
+    def tree(self):
+        nodes={}
+        roots=[]
+        for s in sorted(self.spans,key=lambda s:s.start):
+            node={"name":s.name,"start_ms":round((s.start-self.start)*1000,3),
+                  "duration_ms":round(((s.end or time.perf_counter())-s.start)*1000,3),**s.attrs,"children":[]}
+            nodes[s.id]=node
+            parent=nodes.get(s.parent)
+            (parent["children"] if parent is not None else roots).append(node)
+        return roots
+
+    #summed ms per span name, in order of first appearance
+    def totals(self):
+        totals={}
+        for s in self.spans:
+            if s.end is not None:
+                totals[s.name]=totals.get(s.name,0.0)+(s.end-s.start)*1000
+        return totals
+
+    def server_timing(self):
+        parts=[f"{name};dur={ms:.2f}" for name,ms in self.totals().items()]
+        parts.append(f"total;dur={self.total_ms:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self):
+        return {"name":self.name,**self.attrs,"total_ms":round(self.total_ms,3),"spans":self.tree()}
+
+
+class span:
+    """
+    Time a block as a child of the current span; a no-op outside a trace.
+    """
+
+    __slots__=("name","attrs","_span","_token")
+
+    def __init__(self,name,**attrs):
+        self.name=name
+        self.attrs=attrs
+        self._span=None
+
+    def __enter__(self):
+        trace=_current_trace.get()
+        if trace is None:
+            return None
+        self._span=Span(self.name,_current_span.get(),time.perf_counter(),self.attrs)
+        trace.spans.append(self._span)
+        self._token=_current_span.set(self._span.id)
+        return self._span
+
+    def __exit__(self,exc_type,exc,tb):
+        if self._span is None:
+            return False
+        self._span.end=time.perf_counter()
+        if exc_type is not None:
+            self._span.attrs["error"]=exc_type.__name__
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # exited in another context (e.g. an async generator closed elsewhere)
+            pass
+        return False
+
+
+#attributes on the innermost open span (ignored outside a trace)
+def annotate(**attrs):
+    trace=_current_trace.get()
+    span_id=_current_span.get()
+    if trace is None or span_id is None:
+        return
+    for s in reversed(trace.spans):
+        if s.id==span_id:
+            s.attrs.update(attrs)
+            return
+
+#a finished span that started at `start` (perf_counter) and ends now, for stages that cannot be
+#wrapped in a with block (e.g. across the yields of a stream)
+def record_span(name,start,**attrs):
+    trace=_current_trace.get()
+    if trace is None:
+        return
+    s=Span(name,_current_span.get(),start,attrs)
+    s.end=time.perf_counter()
+    trace.spans.append(s)
+
+def current_trace():
+    return _current_trace.get()
+
+
+class start_trace:
+    """
+    `with start_trace("ask") as trace:` makes `trace` current for the block (and for tasks / executor
+    calls started inside it).
+    """
+
+    def __init__(self,name,**attrs):
+        self.trace=Trace(name,**attrs)
+
+    def __enter__(self):
+        self._token=_current_trace.set(self.trace)
+        self._span_token=_current_span.set(None)
+        return self.trace
+
+    def __exit__(self,exc_type,exc,tb):
+        self.trace.finish()
+        try:
+            _current_span.reset(self._span_token)
+            _current_trace.reset(self._token)
+        except ValueError:
+            pass
+        return False
+
+#wrap an async generator so the trace is current while it runs (streams run after the endpoint returned)
+async def traced_events(trace,events):
+    token=_current_trace.set(trace)
+    try:
+        async for item in events:
+            yield item
+    finally:
+        trace.finish()
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            pass
+
+#loop.run_in_executor that carries the caller's context (trace and parent span) into the worker thread
+def run_in_executor(loop,executor,fn,*args):
+    ctx=contextvars.copy_context()
+    return loop.run_in_executor(executor,ctx.run,fn,*args)
+
+
+_trace_logger=None
+_listener=None
+
+def _logger():
+    global _trace_logger,_listener
+    if _trace_logger is None:
+        os.makedirs(os.path.dirname(TRACE_LOG_FILE) or ".",exist_ok=True)
+        records=queue.SimpleQueue()
+        handler=RotatingFileHandler(TRACE_LOG_FILE,maxBytes=TRACE_LOG_MAX_BYTES,backupCount=TRACE_LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _listener=QueueListener(records,handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+        logger=logging.getLogger("src.tracing.slow_requests")
+        logger.setLevel(logging.INFO)
+        logger.propagate=False
+        logger.addHandler(QueueHandler(records))
+        _trace_logger=logger
+    return _trace_logger
+
+def log_if_slow(trace,**info):
+    """
+    Queue the trace (span tree + info such as prompt size) for the trace log when it was slow or sampled.
+    Returns True when it was logged.
+    """
+    slow=trace.total_ms>=SLOW_REQUEST_MS
+    if not slow and not (TRACE_SAMPLE_RATE and random.random()<TRACE_SAMPLE_RATE):
+        return False
+    record={"time":time.strftime("%Y-%m-%dT%H:%M:%S"),"slow":slow,**info,**trace.to_dict()}
+    _logger().info(json.dumps(record,ensure_ascii=False,default=str))
+    return True
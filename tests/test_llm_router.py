@@ -0,0 +1,121 @@
+"""
+LLMRouter over FakeBackends with injected latency and errors: failover, timeouts, ejection,
+latency-aware ordering and hedging.
+"""
+
+import asyncio
+
+import pytest
+
+from src.llm_backends import FakeBackend
+from src.llm_router import EJECT_AFTER_ERRORS, MIN_LATENCY_SAMPLES, LLMRouter, LLMUnavailableError
+
+
+def prompt(model):
+    return f"question for {model}"
+
+def complete(router):
+    return asyncio.run(router.complete(prompt))
+
+def stream(router):
+    async def collect():
+        info={}
+        tokens=[token async for token in router.stream(prompt,info)]
+        return "".join(tokens).strip(),info
+    return asyncio.run(collect())
+
+#fill a backend's latency window so its rolling percentiles are known
+def prime(router,index,latency_ms):
+    for _ in range(MIN_LATENCY_SAMPLES):
+        router.states[index].record_success(latency_ms)
+
+
+def test_fails_over_to_next_backend():
+    broken=FakeBackend(name="broken",latency_ms=1,error_rate=1.0)
+    spare=FakeBackend(name="spare",latency_ms=1,answer="spare answer")
+    text,info=complete(LLMRouter([broken,spare]))
+    assert text=="spare answer"
+    assert info["llm_backend"]=="spare"
+    assert info["llm_attempts"]==2
+    assert broken.calls==1
+
+def test_timeout_fails_over():
+    slow=FakeBackend(name="slow",latency_ms=500,timeout_seconds=0.05)
+    fast=FakeBackend(name="fast",latency_ms=1)
+    # same latency prior, so the listed order decides who goes first
+    slow.expected_latency_ms=fast.expected_latency_ms
+    router=LLMRouter([slow,fast])
+    text,info=complete(router)
+    assert info["llm_backend"]=="fast"
+    assert router.states[0].consecutive_errors==1
+
+def test_all_backends_failing_raises():
+    router=LLMRouter([FakeBackend(name="a",latency_ms=1,error_rate=1.0),FakeBackend(name="b",latency_ms=1,error_rate=1.0)])
+    with pytest.raises(LLMUnavailableError,match="a: RuntimeError.*b: RuntimeError"):
+        complete(router)
+
+def test_failing_backend_is_ejected():
+    broken=FakeBackend(name="broken",latency_ms=1,error_rate=1.0)
+    spare=FakeBackend(name="spare",latency_ms=1)
+    router=LLMRouter([broken,spare])
+    for _ in range(EJECT_AFTER_ERRORS):
+        assert complete(router)[1]["llm_backend"]=="spare"
+    assert not router.states[0].healthy()
+    assert [s.backend.name for s in router.ranked()]==["spare","broken"]
+
+    # ejected: requests go straight to the healthy backend
+    text,info=complete(router)
+    assert info["llm_attempts"]==1
+    assert broken.calls==EJECT_AFTER_ERRORS
+
+def test_ejected_backend_is_last_resort():
+    flaky=FakeBackend(name="flaky",latency_ms=1,error_rate=1.0)
+    router=LLMRouter([flaky])
+    for _ in range(EJECT_AFTER_ERRORS):
+        with pytest.raises(LLMUnavailableError):
+            complete(router)
+    assert not router.states[0].healthy()
+    flaky.error_rate=0.0
+    text,info=complete(router)
+    assert info["llm_backend"]=="flaky"
+    assert router.states[0].healthy()
+
+def test_routes_to_lowest_rolling_latency():
+    first=FakeBackend(name="first",latency_ms=1)
+    second=FakeBackend(name="second",latency_ms=1)
+    router=LLMRouter([first,second])
+    assert complete(router)[1]["llm_backend"]=="first"
+    prime(router,0,200)
+    prime(router,1,5)
+    assert complete(router)[1]["llm_backend"]=="second"
+
+def test_hedge_wins_when_primary_runs_past_p95():
+    slow=FakeBackend(name="slow",latency_ms=300)
+    fast=FakeBackend(name="fast",latency_ms=5)
+    router=LLMRouter([slow,fast],hedge=True)
+    prime(router,0,10)
+    prime(router,1,50)
+    text,info=complete(router)
+    assert info["llm_backend"]=="fast"
+    assert info["hedged"]==1
+    assert info["llm_attempts"]==2
+    assert (router.hedges,router.hedge_wins)==(1,1)
+
+def test_no_hedge_when_disabled():
+    slow=FakeBackend(name="slow",latency_ms=100)
+    fast=FakeBackend(name="fast",latency_ms=5)
+    router=LLMRouter([slow,fast])
+    prime(router,0,10)
+    prime(router,1,50)
+    text,info=complete(router)
+    assert info["llm_backend"]=="slow"
+    assert info["hedged"]==0
+    assert fast.calls==0
+
+def test_stream_fails_over_before_first_token():
+    broken=FakeBackend(name="broken",latency_ms=1,error_rate=1.0)
+    spare=FakeBackend(name="spare",latency_ms=1,answer="streamed spare answer")
+    text,info=stream(LLMRouter([broken,spare]))
+    assert text=="streamed spare answer"
+    assert info["llm_backend"]=="spare"
+    assert info["llm_attempts"]==2